@@ -0,0 +1,116 @@
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Dict, Any, Callable
+
+from PySpice.Spice.Netlist import Circuit, SubCircuit
+from PySpice.Unit import *
+
+
+
+@dataclass
+class BenchmarkCase:
+    """
+    A tutorial circuit and analysis to benchmark.
+
+    Args:
+        name (str):
+            Case name, used in the results and baselines.
+        build (Callable):
+            Circuit factory, called with one swept value.
+        analysis (str):
+            Analysis method name, e.g. 'transient'.
+        analysis_kwargs (dict):
+            Keyword arguments of the analysis.
+        start (float):
+            First swept value.
+        step (float):
+            Step between swept values.
+    """
+    name: str
+    build: Callable[[float], Circuit]
+    analysis: str
+    analysis_kwargs: Dict[str, Any] = field(default_factory=dict)
+    start: float = 1.0
+    step: float = 1.0
+
+    def values(self, n_points:int) -> np.ndarray:
+        """ Swept values of an n_points sweep. """
+        return self.start + self.step * np.arange(n_points)
+
+
+def add_diode_model(circuit:Circuit):
+    """ Define the 1N4148PH (Signal Diode) used throughout the tutorials. """
+    circuit.model('MyDiode', 'D', IS=4.352@u_nA, RS=0.6458@u_Ohm, BV=110@u_V, IBV=0.0001@u_V, N=1.906)
+
+
+def rc_diode_circuit(r:float) -> Circuit:
+    """ The tutorial 6/7 RC + diode circuit, R1 in kOhm """
+    circuit = Circuit(f'RC diode: R={r} kOhm')
+    circuit.SinusoidalVoltageSource('input', 'n1', circuit.gnd, amplitude=1@u_V, frequency=100@u_Hz)
+    circuit.R(1, 'n1', 'n2', r@u_kOhm)
+    circuit.C(1, 'n2', circuit.gnd, 1@u_uF)
+    circuit.Diode(1, 'n2', 'n3', model='MyDiode')
+    circuit.R(2, 'n3', circuit.gnd, 1@u_kOhm)
+    add_diode_model(circuit)
+    return circuit
+
+
+def diode_circuit(r:float) -> Circuit:
+    """ The tutorial 4_1 diode circuit, R1 in kOhm """
+    circuit = Circuit(f'Diode: R={r} kOhm')
+    add_diode_model(circuit)
+    circuit.V('input', 1, circuit.gnd, 10@u_V)
+    circuit.Diode(1, 1, 2, model='MyDiode')
+    circuit.R(1, 2, circuit.gnd, r@u_kOhm)
+    return circuit
+
+
+class DiodeSubCircuit(SubCircuit):
+    """ The tutorial 3_2 sub-circuit (resistor parallel to a diode) """
+    __nodes__ = ('t_in', 't_out')
+
+    def __init__(self, name, r=1@u_kOhm):
+        SubCircuit.__init__(self, name, *self.__nodes__)
+        self.R(2, 't_in', 't_out', r)
+        self.Diode(2, 't_in', 't_out', model='MyDiode')
+
+
+def subcircuit_circuit(r:float) -> Circuit:
+    """ The tutorial 3_2 circuit, sub-circuit R in kOhm """
+    circuit = Circuit(f'Sub-circuit: R={r} kOhm')
+    add_diode_model(circuit)
+    circuit.V('input', 1, circuit.gnd, 10@u_V)
+    circuit.R(1, 1, 2, 9@u_kOhm)
+    circuit.Diode(1, 2, 3, model='MyDiode')
+    circuit.subcircuit(DiodeSubCircuit('sub1', r=r@u_kOhm))
+    circuit.X(1, 'sub1', 3, circuit.gnd)
+    return circuit
+
+
+CASES = {
+    'rc_diode_transient': BenchmarkCase(
+        'rc_diode_transient',
+        rc_diode_circuit,
+        'transient',
+        dict(step_time=0.0001, end_time=0.1),
+        start=0.5,
+        step=0.5,
+    ),
+    'diode_dc_sweep': BenchmarkCase(
+        'diode_dc_sweep',
+        diode_circuit,
+        'dc',
+        dict(Vinput=slice(0, 5, 0.1)),
+    ),
+    'rc_diode_ac': BenchmarkCase(
+        'rc_diode_ac',
+        rc_diode_circuit,
+        'ac',
+        dict(start_frequency=1@u_Hz, stop_frequency=1@u_MHz, number_of_points=10, variation='dec'),
+    ),
+    'subcircuit_operating_point': BenchmarkCase(
+        'subcircuit_operating_point',
+        subcircuit_circuit,
+        'operating_point',
+    ),
+}
@@ -0,0 +1,137 @@
+"""
+Benchmark the tutorial circuits, stage by stage.
+
+Run from the top level of the repository, e.g.:
+    python -m benchmarks.run_benchmarks --sizes 10 100 --workers 1 4
+    python -m benchmarks.run_benchmarks --save-baseline
+    python -m benchmarks.run_benchmarks --compare
+
+Each case is swept over every size and worker count. The mean time of each
+stage (build, render, launch, solve, parse, format) per point, and the wall
+time, are printed and written to a JSON results file. With --compare,
+timings are checked against the saved baseline and the script exits with
+status 1 if any regressed.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+
+import PySpice
+
+from utils.cache import ngspice_version
+
+from benchmarks.circuits import CASES
+from benchmarks.stages import STAGES, SPICE_COMMAND, launch_time, run_case, result_key, compare_results
+
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baselines', 'baseline.json')
+DEFAULT_OUTPUT = os.path.join(BENCHMARK_DIR, 'results', 'latest.json')
+
+
+def environment(spice_command:str) -> dict:
+    """ Describe the machine and versions the benchmarks ran with. """
+    return {
+        'python': platform.python_version(),
+        'pyspice': PySpice.__version__,
+        'ngspice': ngspice_version(spice_command),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def format_table(results:list) -> str:
+    """ Format results as a table of per point stage means, in milliseconds. """
+    header = f"{'case':<28}{'points':>7}{'workers':>8}{'wall (s)':>10}{'pts/s':>9}" + \
+             ''.join(f'{stage:>9}' for stage in STAGES)
+    lines = [header, '-' * len(header)]
+    for r in results:
+        lines.append(
+            f"{r['case']:<28}{r['n_points']:>7}{r['workers']:>8}{r['wall']:>10.3f}{r['points_per_second']:>9.1f}" +
+            ''.join(f"{r['stage_mean'][stage] * 1e3:>9.3f}" for stage in STAGES)
+        )
+    return os.linesep.join(lines)
+
+
+def write_json(path:str, data:dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the tutorial circuits, stage by stage.')
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=sorted(CASES),
+                        help='cases to run (default: all)')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100],
+                        help='sweep sizes (default: 10 100)')
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, os.cpu_count() or 1],
+                        help='worker process counts (default: 1 and the number of CPUs)')
+    parser.add_argument('--spice-command', default=SPICE_COMMAND,
+                        help='ngspice executable')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT,
+                        help='where to write the results JSON')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='save these results as the baseline')
+    parser.add_argument('--compare', action='store_true',
+                        help='compare against the baseline, exit 1 on a regression')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative slow down flagged as a regression (default: 0.2)')
+    parser.add_argument('--min-delta', type=float, default=1e-4,
+                        help='absolute slow down in seconds ignored as noise (default: 1e-4)')
+    args = parser.parse_args(argv)
+
+    if shutil.which(args.spice_command) is None:
+        print(f'{args.spice_command} was not found, it is needed to run the benchmarks', file=sys.stderr)
+        return 2
+
+    # Measure the launch overhead once, before any timing
+    launch_time(args.spice_command)
+
+    results = []
+    for name in args.cases:
+        for n_points in args.sizes:
+            for workers in sorted(set(args.workers)):
+                result = run_case(CASES[name], n_points, workers, args.spice_command)
+                results.append(result)
+                print(f'{result_key(result)}: {result["wall"]:.3f} s', flush=True)
+
+    print()
+    print(format_table(results))
+
+    data = {'environment': environment(args.spice_command),
+            'results': {result_key(r): r for r in results}}
+    write_json(args.output, data)
+    print(f'{os.linesep}Results written to {args.output}')
+
+    status = 0
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f'No baseline at {args.baseline}, run with --save-baseline first', file=sys.stderr)
+            return 2
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_results(results, baseline, args.threshold, args.min_delta)
+        for r in regressions:
+            print(f"REGRESSION {r['key']} {r['metric']}: "
+                  f"{r['baseline'] * 1e3:.3f} ms -> {r['current'] * 1e3:.3f} ms ({r['ratio']:.2f}x)")
+        if regressions:
+            status = 1
+        else:
+            print('No regressions against the baseline')
+
+    if args.save_baseline:
+        write_json(args.baseline, data)
+        print(f'Baseline saved to {args.baseline}')
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+import numpy as np
+import functools
+import os
+import subprocess
+import time
+from multiprocessing import Pool
+from typing import List, Dict, Optional, Any, Tuple
+
+from PySpice.Spice.Simulation import CircuitSimulation
+from PySpice.Spice.NgSpice.Simulation import NgSpiceCircuitSimulator
+from PySpice.Spice.NgSpice.Server import SpiceServer
+from PySpice.Spice.NgSpice.RawFile import RawFile
+
+from utils.methods import format_analysis
+from utils.sweep import DEFAULT_SIMULATOR_KWARGS
+
+from benchmarks.circuits import BenchmarkCase
+
+
+
+SPICE_COMMAND = 'ngspice'
+
+# Stages of one simulation, in order
+STAGES = ('build', 'render', 'launch', 'solve', 'parse', 'format')
+
+EMPTY_DECK = '.title launch' + os.linesep + '.end' + os.linesep
+
+
+def run_spice_server(deck:str, spice_command:str=SPICE_COMMAND) -> Tuple[bytes, bytes]:
+    """
+    Run a deck with `ngspice -s`, as PySpice's subprocess simulator does.
+
+    Returns:
+        tuple: (stdout, stderr) bytes
+    """
+    process = subprocess.Popen(
+        (spice_command, '-s'),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    return process.communicate(deck.encode('utf-8'))
+
+
+@functools.lru_cache(maxsize=None)
+def launch_time(spice_command:str=SPICE_COMMAND, repeat:int=5) -> float:
+    """
+    Median time to start and stop ngspice with an empty deck
+    (measured once per process, so pass the value on to workers).
+    """
+    timings = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        run_spice_server(EMPTY_DECK, spice_command)
+        timings.append(time.perf_counter() - tic)
+    return float(np.median(timings))
+
+
+def time_point(
+    case:BenchmarkCase,
+    value:float,
+    spice_command:str=SPICE_COMMAND,
+    launch:Optional[float]=None,
+) -> Dict[str, float]:
+    """
+    Simulate one point of a case, timing each stage separately.
+
+    The stages are: building the Circuit, rendering the netlist
+    (`str(circuit)` plus the simulator and analysis lines), launching
+    ngspice, the solve, parsing the raw output and `format_analysis`.
+    Launch is the time to run an empty deck, and is subtracted from
+    the simulation time to give the solve time.
+
+    Args:
+        case (BenchmarkCase):
+            The circuit and analysis.
+        value (float):
+            Swept value, passed to the circuit factory.
+        spice_command (str):
+            ngspice executable.
+        launch (float):
+            Launch time, see `launch_time`, measured here if not given.
+
+    Returns:
+        dict: stage name to seconds
+    """
+    timings = {}
+    if launch is None:
+        launch = launch_time(spice_command)
+
+    tic = time.perf_counter()
+    circuit = case.build(value)
+    timings['build'] = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    simulator = NgSpiceCircuitSimulator(circuit, pipe=True, **DEFAULT_SIMULATOR_KWARGS)
+    getattr(CircuitSimulation, case.analysis)(simulator, **case.analysis_kwargs)
+    deck = str(simulator)
+    timings['render'] = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    stdout, stderr = run_spice_server(deck, spice_command)
+    elapsed = time.perf_counter() - tic
+    timings['launch'] = min(launch, elapsed)
+    timings['solve'] = elapsed - timings['launch']
+
+    tic = time.perf_counter()
+    server = SpiceServer(spice_command=spice_command)
+    server._parse_stdout(stdout)
+    number_of_points = server._parse_stderr(stderr.decode('utf-8'))
+    if number_of_points is None:
+        raise NameError('Simulation failed, ngspice returned:' + os.linesep + stderr.decode('utf-8', 'replace'))
+    raw_file = RawFile(stdout, number_of_points)
+    raw_file.simulation = simulator
+    analysis = raw_file.to_analysis()
+    timings['parse'] = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    format_analysis(analysis)
+    timings['format'] = time.perf_counter() - tic
+
+    return timings
+
+
+def _time_point_task(task) -> Dict[str, float]:
+    case, value, spice_command, launch = task
+    return time_point(case, value, spice_command, launch)
+
+
+def run_case(
+    case:BenchmarkCase,
+    n_points:int,
+    workers:int=1,
+    spice_command:str=SPICE_COMMAND,
+) -> Dict[str, Any]:
+    """
+    Time a sweep of a case, with the given number of worker processes.
+
+    Args:
+        case (BenchmarkCase):
+            The circuit and analysis.
+        n_points (int):
+            Sweep size.
+        workers (int):
+            Number of processes, 1 to run serially.
+        spice_command (str):
+            ngspice executable.
+
+    Returns:
+        dict: wall time, points per second, and the mean and total of each stage
+    """
+    # Measured here, rather than in each worker inside the timed region
+    launch = launch_time(spice_command)
+    tasks = [(case, value, spice_command, launch) for value in case.values(n_points)]
+
+    tic = time.perf_counter()
+    if workers == 1:
+        timings = [_time_point_task(task) for task in tasks]
+    else:
+        with Pool(workers) as p:
+            timings = p.map(_time_point_task, tasks)
+    wall = time.perf_counter() - tic
+
+    totals = {stage: float(sum(t[stage] for t in timings)) for stage in STAGES}
+    return {
+        'case': case.name,
+        'n_points': n_points,
+        'workers': workers,
+        'wall': wall,
+        'points_per_second': n_points / wall,
+        'stage_mean': {stage: totals[stage] / n_points for stage in STAGES},
+        'stage_total': totals,
+    }
+
+
+def result_key(result:Dict[str, Any]) -> str:
+    """ Key of a run in a baseline, e.g. 'rc_diode_transient/100/4'. """
+    return f"{result['case']}/{result['n_points']}/{result['workers']}"
+
+
+def compare_results(
+    results:List[Dict[str, Any]],
+    baseline:Dict[str, Dict[str, Any]],
+    threshold:float=0.2,
+    min_delta:float=1e-4,
+) -> List[Dict[str, Any]]:
+    """
+    Find the timings that regressed against a baseline.
+
+    A timing regresses if it is more than `threshold` (relative) and
+    `min_delta` seconds (absolute) slower than the baseline.
+    Per point timings are compared: each stage mean, and the wall time per point.
+
+    Args:
+        results (list):
+            Results of `run_case`.
+        baseline (dict):
+            Result key to baseline result.
+        threshold (float):
+            Relative slow down that counts as a regression, e.g. 0.2 for 20%.
+        min_delta (float):
+            Absolute slow down, in seconds, below which changes are ignored.
+
+    Returns:
+        list: one {'key', 'metric', 'baseline', 'current', 'ratio'} dict per regression
+    """
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        if key not in baseline:
+            continue
+        reference = baseline[key]
+
+        metrics = {'wall_per_point': (result['wall'] / result['n_points'],
+                                      reference['wall'] / reference['n_points'])}
+        for stage in STAGES:
+            if stage in reference.get('stage_mean', {}):
+                metrics[stage] = (result['stage_mean'][stage], reference['stage_mean'][stage])
+
+        for metric, (current, previous) in metrics.items():
+            if current > previous * (1 + threshold) and current - previous > min_delta:
+                regressions.append({
+                    'key': key,
+                    'metric': metric,
+                    'baseline': previous,
+                    'current': current,
+                    'ratio': current / previous if previous > 0 else float('inf'),
+                })
+    return regressions
@@ -12,6 +12,8 @@ import PySpice.Logging.Logging as Logging
 from PySpice.Spice.Netlist import Circuit
 from PySpice.Unit import *
 
+from utils.newton import NewtonSystem
+
 
 
 logger = Logging.setup_logging()
@@ -68,6 +70,10 @@ analysis = simulator.dc(Vinput=slice(0, 5, 0.1))
 print("Node:", str(analysis["1"]), "Values:", np.array(analysis["1"]))
 print("Node:", str(analysis["2"]), "Values:", np.array(analysis["2"]))
 
+# # The same sweep solved in process, every point at once, checked against ngspice
+newton_analysis = NewtonSystem(circuit, temperature=25).dc(Vinput=slice(0, 5, 0.1))
+print("Max |Newton - ngspice| of V(2) = {:.3g} V".format(np.abs(newton_analysis["2"] - np.array(analysis["2"])).max()))
+
 
 fig = plt.figure()
 
@@ -7,13 +7,13 @@ import sys
 import matplotlib
 matplotlib.use('Agg')
 
+from utils.pwl import pwl_expression
+
 import PySpice
 import PySpice.Logging.Logging as Logging
 from PySpice.Spice.Netlist import Circuit
 from PySpice.Unit import *
 
-import os
-
 logger = Logging.setup_logging()
 
 # # change sim program location depending on system
@@ -48,19 +48,7 @@ circuit.R(1, 2, circuit.gnd, 1@u_kOhm)  # @u_kΩ is a unit of kOhms
 
 # # Create imaginary node
 data = [0,1,5,6,2,4]
-v_seq = "pwl(v(img),"
-loop = 1
-for val in data:
-
-    if loop % 10 == 0:
-        v_seq += os.linesep + '+'
-
-    if loop == len(data):
-        v_seq += ' %d,%.5f' % (loop, val)
-    else:
-        v_seq += ' %d,%.5f,' % (loop, val)
-    loop += 1
-v_seq += ')'
+v_seq = pwl_expression('v(img)', np.arange(1, len(data)+1), data, x_format='%d', y_format='%.5f')
 
 # produce B voltage soure with custom pwl profile (look up table style)
 circuit.B('Bs', 1, circuit.gnd, v=v_seq)
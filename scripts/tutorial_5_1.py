@@ -15,6 +15,8 @@ from PySpice.Unit import *
 
 from PySpice.Spice.Library import SpiceLibrary
 
+from utils.library import default_library
+
 
 logger = Logging.setup_logging()
 
@@ -88,6 +90,18 @@ circuit.X('importDiode', '1N4148', 1, 2)
 
 #
 
+''' # # # # Method 4 # # # #
+Use the model registry from utils, which indexes spice_library/ and LTSpice_include/
+once (cached on disk) and inlines only the definitions the circuit uses.
+No include paths are needed, so spaces in the path are not a problem.
+'''
+"""
+circuit.X('importDiode', '1N4148', 1, 2)
+default_library().inline(circuit)
+#"""
+
+#
+
 #
 
 # # print the circuit:
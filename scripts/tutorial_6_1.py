@@ -17,6 +17,9 @@ from PySpice.Unit import *
 
 from PySpice.Plot.BodeDiagram import bode_diagram
 
+from utils.ac import magnitude_db, phase, bandwidth
+from utils.mna import MNASystem
+
 logger = Logging.setup_logging()
 
 # # change sim program location depending on system
@@ -110,14 +113,15 @@ print("Frequency Values:", np.array(analysis.frequency))
 
 break_frequency = 1 / (2 * math.pi * float(R.resistance * C.capacitance))
 print("Break frequency = {:.1f} Hz".format(break_frequency))
+print("Simulated -3 dB bandwidth = {:.1f} Hz".format(float(bandwidth(analysis.frequency, analysis.n2))))
 
 # # Bode plot (imported function)
 fig, axes = plt.subplots(2, figsize=(20, 10))
 plt.title("Bode Diagram of a Low-Pass RC Filter")
 bode_diagram(axes=axes,
              frequency=analysis.frequency,
-             gain=20*np.log10(np.absolute(analysis.n2)),
-             phase=np.angle(analysis.n2, deg=False),
+             gain=magnitude_db(analysis.n2),
+             phase=phase(analysis.n2),
              marker='.',
              color='blue',
              linestyle='-')
@@ -128,6 +132,19 @@ plt.tight_layout()
 
 #
 
+# # The RC low-pass alone is linear, so it can be solved in process (no ngspice) # #
+rc_circuit = Circuit('Tutorial 6_1 RC')
+rc_circuit.SinusoidalVoltageSource('input', 'n1', rc_circuit.gnd, amplitude=1@u_V, frequency=100@u_Hz)
+rc_circuit.R(1, 'n1', 'n2', 1@u_kOhm)
+rc_circuit.C(1, 'n2', rc_circuit.gnd, 1@u_uF)
+
+ac_kwargs = dict(start_frequency=1@u_Hz, stop_frequency=1@u_MHz, number_of_points=10, variation='dec')
+mna_analysis = MNASystem(rc_circuit).ac(**ac_kwargs)
+spice_analysis = rc_circuit.simulator(temperature=25, nominal_temperature=25).ac(**ac_kwargs)
+print("Max |MNA - ngspice| of V(n2) = {:.3g} V".format(np.abs(mna_analysis['n2'] - np.array(spice_analysis.n2)).max()))
+
+#
+
 # # Save to a file
 fig.savefig("Sim_Output.png", dpi=300)
 plt.close(fig)
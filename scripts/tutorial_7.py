@@ -10,6 +10,13 @@ import PySpice.Logging.Logging as Logging
 from PySpice.Spice.Netlist import Circuit
 from PySpice.Unit import *
 
+from utils.result import SimulationResult
+from utils.sweep import ParameterSweep, sweep_timings
+from utils.template import NetlistTemplate
+from utils.measure import Measurement, measure
+from utils.resample import resample
+from utils.adaptive import AdaptiveSweep
+from utils.transient import TransientBatch
 
 logger = Logging.setup_logging()
 
@@ -54,8 +61,8 @@ def perform_simulation_to_dict(simulator) -> dict:
     analysis = simulator.transient(step_time=0.0001, end_time=0.1)
     return format_analysis(analysis)
 
-def create_and_perform_simulation(r:float) -> dict:
-    """ Create circuit, perform simulation and convert results to dict to return """
+def build_circuit(r:float) -> Circuit:
+    """ Create the tutorial circuit for a given R1 value """
     # # create the circuit
     circuit = Circuit(f"Tutorial 7: R={r} Ohm")
 
@@ -70,12 +77,19 @@ def create_and_perform_simulation(r:float) -> dict:
     # add our diode
     circuit.model('MyDiode', 'D', IS=4.352@u_nA, RS=0.6458@u_Ohm, BV=110@u_V, IBV=0.0001@u_V, N=1.906)  # Define the 1N4148PH (Signal Diode)
 
+    return circuit
+
+def create_and_perform_simulation(r:float) -> SimulationResult:
+    """ Create circuit, perform simulation and convert results to a SimulationResult to return """
+    circuit = build_circuit(r)
+
     # Print the netlist
     simulator = circuit.simulator(temperature=25, nominal_temperature=25)
 
     analysis = simulator.transient(step_time=0.0001, end_time=0.1)
 
-    return format_analysis(analysis)
+    # A single contiguous block, so returning it from a worker is one buffer copy
+    return SimulationResult.from_analysis(analysis)
 
 
 
@@ -156,4 +170,87 @@ if __name__ ==  '__main__':
         for k, v in res_serial.items():
             are_they_equal = (results_mp[i][k] == v).all()
             if are_they_equal is False:
-                raise ValueError('Serial and Multiprocessed results are not the same')
\ No newline at end of file
+                raise ValueError('Serial and Multiprocessed results are not the same')
+
+    # The same sweep, using the ParameterSweep engine from utils (no boilerplate)
+    sweep = ParameterSweep(
+        build_circuit,
+        {'r': sweep_resistors},
+        analysis='transient',
+        analysis_kwargs=dict(step_time=0.0001, end_time=0.1),
+        vectors=['n2', 'n3'],  # only what is measured below is sent back
+    )
+    tic = time.time()
+    points = sweep.run()
+    toc = time.time()
+    print(f"ParameterSweep total time = {toc-tic}")
+    print(f"Per point timings: {sweep_timings(points)}")
+
+    # Same sweep, with every worker writing its waveforms into one shared memory block
+    shared_sweep = ParameterSweep(
+        build_circuit,
+        {'r': sweep_resistors},
+        analysis='transient',
+        analysis_kwargs=dict(step_time=0.0001, end_time=0.1),
+        vectors=['n2', 'n3'],
+        shared_samples=5000,  # room per vector, longer results are pickled instead
+    )
+    tic = time.time()
+    shared_points = shared_sweep.run()
+    toc = time.time()
+    print(f"Shared memory ParameterSweep total time = {toc-tic}")
+
+    # Reduce every waveform of the sweep to a few scalars at once
+    measurements = [
+        Measurement('n3_peak', 'max', 'n3'),
+        Measurement('n3_rms', 'rms', 'n3', start=0.02),
+        Measurement('n2_ripple', 'pp', 'n2', start=0.05),
+    ]
+    scalars = measure(points, measurements)
+    for name, values in scalars.items():
+        print(f"{name}: {values.min():.4f} to {values.max():.4f}")
+
+    # Each point has its own adaptive time vector, put them on one grid to stack them
+    stacked = resample(points, ['n2', 'n3'], step=0.0001)
+    print(f"Resampled n3 array shape: {stacked['n3'].shape}")
+
+    # Every R1 variant integrated together in process, one batch instead of 199 ngspice runs
+    tic = time.time()
+    native = TransientBatch(build_circuit, {'r': sweep_resistors}).run(step_time=0.0001, end_time=0.1)
+    toc = time.time()
+    n_common = min(len(native['time']), len(stacked['time']))
+    native_error = np.abs(native['n2'][:, :n_common] - stacked['n2'][:, :n_common]).max()
+    print(f"TransientBatch total time = {toc-tic}, max |native - ngspice| of n2 = {native_error:.3g} V")
+
+    # The sparse backend is meant for large netlists; here it only checks a few variants against the dense one
+    tic = time.time()
+    sparse = TransientBatch(build_circuit, {'r': sweep_resistors[::20]}, sparse=True).run(step_time=0.0001, end_time=0.1)
+    toc = time.time()
+    sparse_error = np.abs(sparse['n2'] - native['n2'][::20]).max()
+    print(f"Sparse TransientBatch total time = {toc-tic}, max |sparse - dense| of n2 = {sparse_error:.3g} V")
+
+    # Start coarse and only add points of R where the peak output still bends
+    adaptive = AdaptiveSweep(
+        build_circuit,
+        'r',
+        (sweep_resistors[0], sweep_resistors[-1]),
+        Measurement('n3_peak', 'max', 'n3'),
+        analysis_kwargs=dict(step_time=0.0001, end_time=0.1),
+        scale='log',
+        tolerance=0.005,
+        max_points=len(sweep_resistors),
+    )
+    adaptive_res = adaptive.run()
+    print(f"Adaptive sweep used {len(adaptive)} of {len(sweep_resistors)} points in {adaptive.rounds} rounds")
+
+    # Render the netlist once, then each point only fills in the R1 slot
+    template = NetlistTemplate(
+        build_circuit(sweep_resistors[0]),
+        ['R1'],
+        analysis='transient',
+        analysis_kwargs=dict(step_time=0.0001, end_time=0.1),
+    )
+    tic = time.time()
+    netlists = [template.render(R1=r@u_kOhm) for r in sweep_resistors]
+    toc = time.time()
+    print(f"Template render time for {len(netlists)} netlists = {toc-tic}")
\ No newline at end of file
@@ -0,0 +1,44 @@
+import pickle
+
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Unit import *
+
+from utils.batch import control_sweep_lines, insert_control_block
+from utils.measure import Measurement
+from utils.montecarlo import MonteCarlo, Tolerance
+
+
+
+def build_circuit():
+    circuit = Circuit('Monte Carlo')
+    circuit.model('MyDiode', 'D', IS=4.352@u_nA, RS=0.6458@u_Ohm, BV=110@u_V, IBV=0.0001@u_V, N=1.906)
+    circuit.SinusoidalVoltageSource('input', 1, circuit.gnd, amplitude=10@u_V, frequency=50@u_Hz)
+    circuit.Diode(1, 1, 2, model='MyDiode')
+    circuit.R(1, 2, circuit.gnd, 1@u_kOhm)
+    return circuit
+
+
+def test_batch_state_unpickles():
+    # Needed to start the 'batch' workers under spawn/forkserver
+    mc = MonteCarlo(build_circuit(), {'R1': Tolerance(0.05), 'MyDiode.IS': Tolerance(0.2, 'lognormal')},
+                    'transient', dict(step_time=1e-4, end_time=0.02),
+                    metrics=[Measurement('peak', 'max', '2')], seed=1234)
+    copy = pickle.loads(pickle.dumps(mc))
+
+    assert copy.circuit is None
+    assert copy.netlist == mc.netlist
+    for key, values in mc.chunk_samples(3, 10).items():
+        assert (copy.chunk_samples(3, 10)[key] == values).all()
+
+
+def test_insert_control_block():
+    mc = MonteCarlo(build_circuit(), {'R1': Tolerance(0.05)}, 'transient', dict(step_time=1e-4, end_time=0.02),
+                    metrics=[Measurement('peak', 'max', '2')])
+    lines = control_sweep_lines([{'R1': 1000.0}, {'R1': 1100.0}], mc.command, 'sweep.raw',
+                                vectors=mc.vectors, model_names=mc.model_names)
+    deck = insert_control_block(mc.netlist, lines).splitlines()
+
+    assert deck[-1] == '.end'
+    assert deck[-2] == '.endc'
+    assert 'alter r1 = 1100.0' in deck
+    assert deck.count('tran 0.0001s 0.02s 0s') == 2
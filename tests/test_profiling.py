@@ -0,0 +1,28 @@
+from utils.profiling import add_acct_option, parse_solver_statistics
+
+
+
+def test_add_acct_option():
+    deck = add_acct_option('.title rc\nR1 1 0 1k\n.options TEMP = 25C\n.end\n').splitlines()
+    assert deck[-2:] == ['.options acct', '.end']
+
+
+def test_parse_acct_output():
+    # As printed by ngspice with `.options acct`
+    lines = [
+        'Total analysis time (seconds) = 0.012',
+        'Total iterations = 1254',
+        'Transient iterations = 1198',
+        'Circuit Equations = 4',
+        'Transient timepoints = 1003',
+        'Rejected timepoints = 12',
+    ]
+    statistics = parse_solver_statistics(lines)
+    assert statistics == {
+        'analysis_time': 0.012,
+        'iterations': 1254,
+        'transient_iterations': 1198,
+        'equations': 4,
+        'timepoints': 1003,
+        'rejected_timepoints': 12,
+    }
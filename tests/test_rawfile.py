@@ -0,0 +1,64 @@
+import numpy as np
+import os
+
+from utils.rawfile import read_raw, read_result
+
+
+
+def write_raw(path, plot_name, variables, points, flags='real'):
+    """
+    Write an ngspice style binary raw file, of float64 points.
+    """
+    lines = [
+        'Title: test',
+        'Date: Thu Jan  1 00:00:00  2026',
+        f'Plotname: {plot_name}',
+        f'Flags: {flags}',
+        f'No. Variables: {len(variables)}',
+        f'No. Points: {len(points)}',
+        'Variables:',
+    ]
+    lines += [f'\t{i}\t{name}\t{kind}' for i, (name, kind) in enumerate(variables)]
+    with open(path, 'wb') as f:
+        f.write(('\n'.join(lines) + '\nBinary:\n').encode('ascii'))
+        f.write(np.asarray(points, dtype='<f8').tobytes())
+
+
+def test_operating_point_has_no_abscissa(tmp_path):
+    path = os.path.join(tmp_path, 'op.raw')
+    variables = [('v(1)', 'voltage'), ('v(2)', 'voltage'), ('vinput#branch', 'current')]
+    write_raw(path, 'Operating Point', variables, [[10.0, 4.2, -5.8e-3]])
+
+    plot = read_raw(path).plots[-1]
+    assert plot.abscissa is None
+
+    res = read_result(path)
+    assert res.abscissa is None
+    assert sorted(res.names) == ['1', '2']
+    assert float(res['1'][0]) == 10.0
+    assert float(res['2'][0]) == 4.2
+
+
+def test_dc_sweep_abscissa(tmp_path):
+    path = os.path.join(tmp_path, 'dc.raw')
+    variables = [('v-sweep', 'voltage'), ('v(1)', 'voltage'), ('v(2)', 'voltage')]
+    points = [[v, v, v / 2] for v in np.linspace(0, 5, 6)]
+    write_raw(path, 'DC transfer characteristic', variables, points)
+
+    res = read_result(path)
+    assert res.abscissa == 'sweep'
+    assert sorted(res.names) == ['1', '2', 'sweep']
+    np.testing.assert_allclose(res['sweep'], np.linspace(0, 5, 6))
+    np.testing.assert_allclose(res['2'], np.linspace(0, 5, 6) / 2)
+
+
+def test_transient_abscissa(tmp_path):
+    path = os.path.join(tmp_path, 'tran.raw')
+    variables = [('time', 'time'), ('v(out)', 'voltage')]
+    t = np.linspace(0, 1e-3, 11)
+    write_raw(path, 'Transient Analysis', variables, np.column_stack([t, np.sin(t)]))
+
+    res = read_result(path, ['out'])
+    assert res.abscissa == 'time'
+    np.testing.assert_allclose(res['time'], t)
+    np.testing.assert_allclose(res['out'], np.sin(t))
@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Unit import *
+
+from utils.stream import StreamingNgSpice, stream_transient
+
+
+
+TIMEOUT = 30  # seconds allowed for a stream to close
+
+
+@pytest.fixture
+def streaming_ngspice():
+    try:
+        return StreamingNgSpice.new_instance()
+    except OSError:
+        pytest.skip('the ngspice shared library is not installed')
+
+
+def test_close_shared_stream_after_first_window(streaming_ngspice):
+    circuit = Circuit('Stream close')
+    circuit.SinusoidalVoltageSource('input', 1, circuit.gnd, amplitude=1@u_V, frequency=1@u_kHz)
+    circuit.R(1, 1, 2, 1@u_kOhm)
+    circuit.C(1, 2, circuit.gnd, 1@u_uF)
+
+    outcome = {}
+    closed = threading.Event()
+
+    def close_after_first_window():
+        # A long run and small blocks, so that ngspice fills the queue and is
+        # left waiting in send_data when the stream is closed
+        stream = stream_transient(circuit, step_time=1e-6, end_time=10, window=1e-3,
+                                  vectors=['2'], source='shared', block_points=64)
+        try:
+            outcome['first'] = next(stream)
+            stream.close()
+        except Exception as error:
+            outcome['error'] = error
+        closed.set()
+
+    threading.Thread(target=close_after_first_window, daemon=True).start()
+    assert closed.wait(TIMEOUT), f'the stream did not close within {TIMEOUT} s'
+    assert 'error' not in outcome, outcome.get('error')
+
+    t, chunk = outcome['first']
+    assert len(t) > 0 and len(chunk['2']) == len(t)
+    assert streaming_ngspice.stopping.is_set()
@@ -0,0 +1,271 @@
+import numpy as np
+from typing import Dict, Optional, Any, Sequence, Tuple
+
+
+
+# Level, relative to the reference gain, of the bandwidth edge
+CUTOFF_DB = -3.0103  # 20*log10(1/sqrt(2))
+
+# Smallest magnitude used before taking a log, to avoid -inf dB
+MAGNITUDE_FLOOR = 1e-300
+
+
+def stack_responses(
+    results:Sequence[Any],
+    nodes:Sequence[str],
+    frequency_key:str='frequency',
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Stack the AC results of a sweep into a (n_sweeps, n_nodes, n_freq) array.
+
+    Args:
+        results (Sequence):
+            One result per sweep point, anything indexable by node name,
+            e.g. a SimulationResult, a `format_analysis` dict or a SweepPoint.
+        nodes (Sequence[str]):
+            Nodes to stack, e.g. ['n2', 'n3'].
+        frequency_key (str):
+            Name of the frequency vector.
+
+    Returns:
+        tuple: frequency (n_freq,), and the complex responses (n_sweeps, n_nodes, n_freq)
+    """
+    results = [getattr(r, 'result', r) for r in results]
+    if not results:
+        raise ValueError('No results to stack')
+
+    frequency = np.real(np.asarray(results[0][frequency_key], dtype=np.complex128))
+    responses = np.empty((len(results), len(nodes), len(frequency)), dtype=np.complex128)
+    for i, result in enumerate(results):
+        for j, node in enumerate(nodes):
+            responses[i, j] = result[node]
+    return frequency, responses
+
+
+def magnitude_db(
+    response:np.ndarray,
+    reference:Optional[np.ndarray]=None,
+) -> np.ndarray:
+    """
+    Gain in dB, 20*log10(|H|), of a (batched) complex response.
+
+    Args:
+        response (np.ndarray):
+            Complex response, frequency on the last axis.
+        reference (np.ndarray):
+            Optional input (e.g. the source node) the response is divided by,
+            broadcastable against the response.
+
+    Returns:
+        np.ndarray: gain in dB, same shape as the response
+    """
+    response = np.asarray(response)
+    if reference is not None:
+        response = response / np.asarray(reference)
+    return 20 * np.log10(np.maximum(np.abs(response), MAGNITUDE_FLOOR))
+
+
+def phase(
+    response:np.ndarray,
+    deg:bool=False,
+    unwrap:bool=True,
+) -> np.ndarray:
+    """
+    Phase of a (batched) complex response, unwrapped along frequency.
+
+    Args:
+        response (np.ndarray):
+            Complex response, frequency on the last axis.
+        deg (bool):
+            Return degrees rather than radians.
+        unwrap (bool):
+            Remove the 2*pi jumps along the frequency axis.
+
+    Returns:
+        np.ndarray: phase, same shape as the response
+    """
+    res = np.angle(np.asarray(response))
+    if unwrap:
+        res = np.unwrap(res, axis=-1)
+    return np.degrees(res) if deg else res
+
+
+def group_delay(
+    frequency:np.ndarray,
+    response:np.ndarray,
+) -> np.ndarray:
+    """
+    Group delay, -d(phase)/d(omega), of a (batched) complex response.
+    Non-uniform (e.g. per decade) frequency points are supported.
+
+    Args:
+        frequency (np.ndarray):
+            Frequencies in Hz (n_freq,).
+        response (np.ndarray):
+            Complex response, frequency on the last axis.
+
+    Returns:
+        np.ndarray: group delay in seconds, same shape as the response
+    """
+    omega = 2 * np.pi * np.real(np.asarray(frequency)).astype(np.float64)
+    return -np.gradient(phase(response), omega, axis=-1)
+
+
+def level_crossing(
+    frequency:np.ndarray,
+    values:np.ndarray,
+    level:np.ndarray,
+    falling:bool=True,
+) -> np.ndarray:
+    """
+    Frequency at which each response first crosses a level, for every
+    response in a batch at once. The crossing is interpolated linearly
+    against log frequency.
+
+    Args:
+        frequency (np.ndarray):
+            Increasing frequencies in Hz (n_freq,).
+        values (np.ndarray):
+            Real values (e.g. gain in dB), frequency on the last axis.
+        level (np.ndarray):
+            Level per response, broadcastable to values.shape[:-1].
+        falling (bool):
+            Look for the first crossing below the level (or above, if False).
+
+    Returns:
+        np.ndarray: crossing frequency per response, NaN where there is none
+    """
+    frequency = np.real(np.asarray(frequency)).astype(np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    level = np.broadcast_to(np.asarray(level, dtype=np.float64), values.shape[:-1])[..., np.newaxis]
+
+    past = values < level if falling else values > level
+    # The first sample cannot be a crossing, the response must start on the other side
+    past[..., 0] = False
+    found = past.any(axis=-1)
+    i = np.where(found, past.argmax(axis=-1), 1)
+
+    y0 = np.take_along_axis(values, (i - 1)[..., np.newaxis], axis=-1)[..., 0]
+    y1 = np.take_along_axis(values, i[..., np.newaxis], axis=-1)[..., 0]
+    log_f = np.log10(np.maximum(frequency, MAGNITUDE_FLOOR))
+    x0 = log_f[i - 1]
+    x1 = log_f[i]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(y1 != y0, (level[..., 0] - y0) / (y1 - y0), 0.0)
+    crossing = 10 ** (x0 + np.clip(t, 0, 1) * (x1 - x0))
+    return np.where(found, crossing, np.nan)
+
+
+def bandwidth(
+    frequency:np.ndarray,
+    response:np.ndarray,
+    kind:str='lowpass',
+    reference:str='edge',
+    cutoff_db:float=CUTOFF_DB,
+) -> np.ndarray:
+    """
+    -3 dB bandwidth (cut-off frequency) of each response in a batch.
+
+    Args:
+        frequency (np.ndarray):
+            Increasing frequencies in Hz (n_freq,).
+        response (np.ndarray):
+            Complex response, frequency on the last axis.
+        kind (str):
+            'lowpass' for the first drop below the reference gain going up in
+            frequency, 'highpass' for the first drop going down in frequency.
+        reference (str):
+            Reference gain: 'edge' (the gain at the lowest frequency for a
+            low-pass, at the highest for a high-pass) or 'max' (the peak gain).
+        cutoff_db (float):
+            Level of the edge, relative to the reference gain.
+
+    Returns:
+        np.ndarray: cut-off frequency per response (response.shape[:-1]), NaN if none
+    """
+    frequency = np.real(np.asarray(frequency)).astype(np.float64)
+    gain = magnitude_db(response)
+    if kind == 'highpass':
+        frequency = frequency[::-1]
+        gain = gain[..., ::-1]
+    elif kind != 'lowpass':
+        raise ValueError("kind must be 'lowpass' or 'highpass'")
+
+    if reference == 'edge':
+        level = gain[..., 0] + cutoff_db
+    elif reference == 'max':
+        level = gain.max(axis=-1) + cutoff_db
+    else:
+        raise ValueError("reference must be 'edge' or 'max'")
+
+    if kind == 'highpass':
+        # Crossing on the reversed (decreasing) frequency axis, interpolated in log space
+        return 1 / level_crossing(1 / frequency, gain, level)
+    return level_crossing(frequency, gain, level)
+
+
+def break_frequency(
+    frequency:np.ndarray,
+    response:np.ndarray,
+    phase_shift:float=-45.0,
+) -> np.ndarray:
+    """
+    Break (corner) frequency of each response in a batch, where the phase
+    has moved by `phase_shift` degrees from its low frequency asymptote.
+    The asymptote is taken as the phase at the lowest frequency, rounded to
+    a multiple of 90 degrees, so -45 degrees finds the corner of a first
+    order low-pass (0 -> -90) as well as of a high-pass (90 -> 0).
+
+    Args:
+        frequency (np.ndarray):
+            Increasing frequencies in Hz (n_freq,).
+        response (np.ndarray):
+            Complex response, frequency on the last axis.
+        phase_shift (float):
+            Phase change, in degrees, at the break frequency.
+
+    Returns:
+        np.ndarray: break frequency per response (response.shape[:-1]), NaN if none
+    """
+    phi = phase(response, deg=True)
+    level = 90 * np.round(phi[..., 0] / 90) + phase_shift
+    return level_crossing(frequency, phi, level, falling=phase_shift < 0)
+
+
+def bode(
+    frequency:np.ndarray,
+    response:np.ndarray,
+    reference:Optional[np.ndarray]=None,
+) -> Dict[str, np.ndarray]:
+    """
+    Every Bode quantity of a batch of responses, e.g. those of `stack_responses`.
+
+    Example:
+        frequency, responses = stack_responses(points, ['n2'])
+        res = bode(frequency, responses)
+        res['bandwidth'].shape  # (n_sweeps, n_nodes)
+
+    Args:
+        frequency (np.ndarray):
+            Increasing frequencies in Hz (n_freq,).
+        response (np.ndarray):
+            Complex response, e.g. (n_sweeps, n_nodes, n_freq).
+        reference (np.ndarray):
+            Optional input the response is divided by (e.g. the source node).
+
+    Returns:
+        dict: 'frequency', 'gain_db', 'phase' (degrees, unwrapped),
+        'group_delay', 'bandwidth' and 'break_frequency'
+    """
+    response = np.asarray(response)
+    if reference is not None:
+        response = response / np.asarray(reference)
+    return {
+        'frequency': np.real(np.asarray(frequency)).astype(np.float64),
+        'gain_db': magnitude_db(response),
+        'phase': phase(response, deg=True),
+        'group_delay': group_delay(frequency, response),
+        'bandwidth': bandwidth(frequency, response),
+        'break_frequency': break_frequency(frequency, response),
+    }
@@ -0,0 +1,295 @@
+import numpy as np
+import os
+from typing import List, Dict, Optional, Any, Callable, Sequence, Tuple
+
+from PySpice.Spice.Netlist import Circuit
+
+from utils.measure import Measurement, measure
+from utils.result import SimulationResult
+from utils.sweep import ParameterSweep, SweepPoint, ANALYSES, DEFAULT_SIMULATOR_KWARGS
+
+
+
+SCALES = ('linear', 'log')
+
+
+def linear_deviation(u:np.ndarray, y:np.ndarray) -> np.ndarray:
+    """
+    Distance of every interior sample from the straight line through its
+    two neighbours, i.e. the error of linear interpolation had the sample
+    been skipped. It is zero where the response is linear, and grows with
+    the local curvature times the squared spacing.
+
+    Args:
+        u (np.ndarray):
+            Increasing sample positions (n,).
+        y (np.ndarray):
+            Sample values (n,).
+
+    Returns:
+        np.ndarray: deviation of the interior samples (n-2,)
+    """
+    w = (u[1:-1] - u[:-2]) / (u[2:] - u[:-2])
+    return np.abs(y[1:-1] - (y[:-2] + w * (y[2:] - y[:-2])))
+
+
+def interval_errors(u:np.ndarray, y:np.ndarray) -> np.ndarray:
+    """
+    Error estimate of each interval between consecutive samples: the
+    largest linear deviation of the samples at its two ends.
+
+    Args:
+        u (np.ndarray):
+            Increasing sample positions (n,), n >= 3.
+        y (np.ndarray):
+            Sample values (n,).
+
+    Returns:
+        np.ndarray: error of each interval (n-1,)
+    """
+    deviation = np.zeros(len(u))
+    deviation[1:-1] = linear_deviation(u, y)
+    return np.maximum(deviation[:-1], deviation[1:])
+
+
+def evaluate_metric(
+    metric:Measurement|Callable[[SimulationResult], float],
+    points:Sequence[SweepPoint],
+) -> np.ndarray:
+    """
+    Reduce the results of simulated points to one scalar each.
+
+    Args:
+        metric (Measurement | Callable):
+            A waveform measurement, applied to all the points at once,
+            or a function of a point's SimulationResult returning a float.
+        points (Sequence[SweepPoint]):
+            The simulated points.
+
+    Returns:
+        np.ndarray: metric of each point (n_points,)
+    """
+    if isinstance(metric, Measurement):
+        return measure(points, [metric])[metric.name]
+    return np.array([metric(p.result) for p in points], dtype=np.float64)
+
+
+class AdaptiveSweep:
+    """
+    Sweep one parameter, concentrating the simulations where a scalar
+    metric of the response changes non-linearly.
+
+    The range is first sampled on a coarse grid. Each round then estimates
+    the interpolation error of every interval from the curvature of the
+    metric (see `interval_errors`), and bisects the intervals whose error
+    exceeds the tolerance, largest first. All the new points of a round
+    are simulated together with a `ParameterSweep`. Refinement stops when
+    every interval is within tolerance, the intervals reach `min_spacing`,
+    or `max_points` simulations have been run.
+
+    Example:
+        sweep = AdaptiveSweep(build_circuit, 'r', (500, 100000),
+                              Measurement('n3_peak', 'max', 'n3'),
+                              analysis_kwargs=dict(step_time=0.0001, end_time=0.1),
+                              scale='log', tolerance=0.005)
+        res = sweep.run()
+        res['r'], res['n3_peak']  # increasing r, and the metric at each
+
+    Args:
+        factory (Callable):
+            Module level function returning a PySpice Circuit.
+        parameter (str):
+            Name of the swept factory argument.
+        bounds (tuple):
+            (low, high) values of the parameter, both simulated.
+        metric (Measurement | Callable):
+            Scalar of interest, see `evaluate_metric`.
+        analysis (str):
+            Analysis method of the simulator, e.g. 'transient'.
+        analysis_kwargs (dict):
+            Keyword arguments of the analysis method.
+        fixed (dict):
+            Other factory arguments, held constant.
+        scale (str):
+            'linear', or 'log' to sample and bisect in log10 of the parameter.
+        n_initial (int):
+            Number of points of the initial grid.
+        tolerance (float):
+            Allowed interpolation error, as a fraction of the metric's range.
+        abs_tolerance (float):
+            Allowed interpolation error in the metric's units, if larger.
+        max_points (int):
+            Budget of simulations.
+        min_spacing (float):
+            Smallest interval (in scaled units) that is still bisected,
+            defaults to 1e-3 of the scaled range. Keeps a discontinuity
+            from using up the whole budget.
+        simulator_kwargs (dict):
+            Keyword arguments of `circuit.simulator()`.
+        processes (int):
+            Number of worker processes, see `ParameterSweep`.
+        vectors (Sequence[str]):
+            Nodes/vectors to save and return. Defaults to the measured
+            node if the metric is a Measurement, otherwise all.
+        keep_results (bool):
+            Keep every point's SweepPoint in `points`, not just its metric.
+    """
+
+    def __init__(
+        self,
+        factory:Callable[..., Circuit],
+        parameter:str,
+        bounds:Tuple[float, float],
+        metric:Measurement|Callable[[SimulationResult], float],
+        analysis:str='transient',
+        analysis_kwargs:Optional[Dict[str, Any]]=None,
+        fixed:Optional[Dict[str, Any]]=None,
+        scale:str='linear',
+        n_initial:int=9,
+        tolerance:float=0.01,
+        abs_tolerance:float=0.0,
+        max_points:int=100,
+        min_spacing:Optional[float]=None,
+        simulator_kwargs:Optional[Dict[str, Any]]=None,
+        processes:Optional[int]=None,
+        vectors:Optional[Sequence[str]]=None,
+        keep_results:bool=False,
+    ):
+        if analysis not in ANALYSES:
+            raise ValueError(f'Unknown analysis {analysis}, must be one of {ANALYSES}')
+        if scale not in SCALES:
+            raise ValueError(f'Unknown scale {scale}, must be one of {SCALES}')
+        if n_initial < 3:
+            raise ValueError('n_initial must be at least 3 to estimate the curvature')
+        if max_points < n_initial:
+            raise ValueError('max_points must be at least n_initial')
+        low, high = bounds
+        if not low < high or (scale == 'log' and low <= 0):
+            raise ValueError(f'Invalid bounds {bounds} for a {scale} scale')
+
+        self.factory = factory
+        self.parameter = parameter
+        self.bounds = (float(low), float(high))
+        self.metric = metric
+        self.metric_name = metric.name if isinstance(metric, Measurement) else 'metric'
+        self.analysis = analysis
+        self.analysis_kwargs = dict(analysis_kwargs or {})
+        self.fixed = dict(fixed or {})
+        self.scale = scale
+        self.n_initial = n_initial
+        self.tolerance = tolerance
+        self.abs_tolerance = abs_tolerance
+        self.max_points = max_points
+        u0, u1 = self.to_scaled(np.array(self.bounds))
+        self.min_spacing = (u1 - u0) * 1e-3 if min_spacing is None else min_spacing
+        self.simulator_kwargs = dict(simulator_kwargs or DEFAULT_SIMULATOR_KWARGS)
+        self.processes = processes
+        if vectors is None and isinstance(metric, Measurement):
+            vectors = [metric.node]
+        self.vectors = list(vectors) if vectors else None
+        self.keep_results = keep_results
+
+        # Samples so far, in increasing order of the parameter
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.points: List[SweepPoint] = []
+        self.rounds = 0
+
+    def to_scaled(self, x:np.ndarray) -> np.ndarray:
+        return np.log10(x) if self.scale == 'log' else np.asarray(x, dtype=np.float64)
+
+    def from_scaled(self, u:np.ndarray) -> np.ndarray:
+        return 10.0 ** u if self.scale == 'log' else u
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def simulate(self, values:np.ndarray) -> np.ndarray:
+        """
+        Simulate the given parameter values, add them to the samples
+        and return their metric.
+
+        Args:
+            values (np.ndarray):
+                Parameter values.
+
+        Returns:
+            np.ndarray: metric of each value
+        """
+        processes = min(self.processes or os.cpu_count() or 1, len(values))
+        sweep = ParameterSweep(
+            self.factory,
+            {self.parameter: values, **{k: [v] for k, v in self.fixed.items()}},
+            analysis=self.analysis,
+            analysis_kwargs=self.analysis_kwargs,
+            simulator_kwargs=self.simulator_kwargs,
+            processes=processes,
+            vectors=self.vectors,
+        )
+        points = sweep.run()
+        metric = evaluate_metric(self.metric, points)
+
+        x = np.concatenate([self.x, values])
+        order = np.argsort(x, kind='stable')
+        self.x = x[order]
+        self.y = np.concatenate([self.y, metric])[order]
+        if self.keep_results:
+            points = self.points + points
+            self.points = [points[i] for i in order]
+        self.rounds += 1
+        return metric
+
+    def threshold(self) -> float:
+        """ Allowed interpolation error, in the metric's units. """
+        return max(self.abs_tolerance, self.tolerance * float(np.ptp(self.y)))
+
+    def candidates(self) -> np.ndarray:
+        """
+        Midpoints of the intervals to bisect next, largest error first,
+        limited to the remaining budget.
+
+        Returns:
+            np.ndarray: new parameter values
+        """
+        u = self.to_scaled(self.x)
+        errors = interval_errors(u, self.y)
+        width = np.diff(u)
+
+        refine = (errors > self.threshold()) & (width / 2 >= self.min_spacing)
+        intervals = np.flatnonzero(refine)
+        intervals = intervals[np.argsort(-errors[intervals], kind='stable')]
+        intervals = intervals[:max(0, self.max_points - len(self))]
+        return self.from_scaled(u[intervals] + width[intervals] / 2)
+
+    def run(
+        self,
+        callback:Optional[Callable[['AdaptiveSweep'], None]]=None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Sample the initial grid, then refine until converged or out of budget.
+
+        Args:
+            callback (Callable):
+                Called with the sweep after every round, e.g. to report progress.
+
+        Returns:
+            dict: the parameter name and the metric name, to their (n,) arrays
+        """
+        if not len(self):
+            u = np.linspace(*self.to_scaled(np.array(self.bounds)), self.n_initial)
+            self.simulate(self.from_scaled(u))
+            if callback is not None:
+                callback(self)
+
+        while len(values := self.candidates()):
+            self.simulate(values)
+            if callback is not None:
+                callback(self)
+
+        return {self.parameter: self.x, self.metric_name: self.y}
+
+    def interpolate(self, x:np.ndarray|float) -> np.ndarray|float:
+        """
+        Linearly interpolate the metric (in the sweep's scale) at any parameter value.
+        """
+        return np.interp(self.to_scaled(x), self.to_scaled(self.x), self.y)
@@ -0,0 +1,216 @@
+import numpy as np
+import asyncio
+import os
+import tempfile
+from typing import List, Dict, Optional, Any, Sequence
+
+from PySpice.Spice.Netlist import Circuit
+
+from utils.methods import render_netlist
+from utils.outputs import add_saves
+from utils.rawfile import read_result
+from utils.sweep import ANALYSES, DEFAULT_SIMULATOR_KWARGS
+
+
+
+SPICE_COMMAND = 'ngspice'
+
+
+def read_results(
+    path:str,
+    vectors:Optional[Sequence[str]]=None,
+    cast:bool=True,
+) -> Dict[str, np.ndarray|float]:
+    """
+    Read the last plot of an ngspice raw file into the dictionary
+    format returned by `format_analysis`: the node voltages, and the
+    time or frequency vector if any.
+
+    Args:
+        path (str):
+            Path to the raw file.
+        vectors (Sequence[str]):
+            Nodes to include (e.g. ['n3']), or None for all.
+        cast (bool):
+            Whether to convert single point vectors to a float.
+
+    Returns:
+        dict: analysis results dictionary
+    """
+    res = read_result(path, vectors).to_dict(cast)
+    res.pop('sweep', None)  # as format_analysis, which only adds time and frequency
+    return res
+
+
+class AsyncSimulator:
+    """
+    Run analyses as ngspice batch subprocesses from asyncio code.
+
+    Each call renders the deck, starts `ngspice -b` with
+    `asyncio.create_subprocess_exec` and awaits it, so the event loop is
+    never blocked and many simulations can overlap. A semaphore bounds
+    the number of ngspice processes in flight. On a timeout or a
+    cancellation the ngspice process is killed before the error propagates.
+
+    Example:
+        simulator = AsyncSimulator(max_concurrency=8, timeout=30)
+        results = await asyncio.gather(*(
+            simulator.transient(build_circuit(r), step_time=0.0001, end_time=0.1)
+            for r in sweep_resistors
+        ))
+
+    Args:
+        max_concurrency (int):
+            Maximum number of ngspice processes running at once,
+            defaults to the number of CPUs.
+        timeout (float):
+            Default time limit, in seconds, of each simulation (None for no limit).
+        simulator_kwargs (dict):
+            Keyword arguments as passed to `circuit.simulator()`.
+        spice_command (str):
+            ngspice executable.
+    """
+
+    def __init__(
+        self,
+        max_concurrency:Optional[int]=None,
+        timeout:Optional[float]=None,
+        simulator_kwargs:Optional[Dict[str, Any]]=None,
+        spice_command:str=SPICE_COMMAND,
+    ):
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        self.timeout = timeout
+        self.simulator_kwargs = dict(simulator_kwargs or DEFAULT_SIMULATOR_KWARGS)
+        self.spice_command = spice_command
+        self._semaphore = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created on first use, so it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def run_deck(
+        self,
+        deck:str,
+        vectors:Optional[Sequence[str]]=None,
+        timeout:Optional[float]=None,
+    ) -> Dict[str, np.ndarray|float]:
+        """
+        Simulate a rendered deck (with its analysis line).
+
+        Args:
+            deck (str):
+                SPICE deck.
+            vectors (Sequence[str]):
+                Nodes to save and return, or None for all.
+            timeout (float):
+                Time limit in seconds, defaults to the simulator's.
+
+        Returns:
+            dict: analysis results dictionary, as `format_analysis`
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deck = add_saves(deck, vectors)
+
+        async with self.semaphore:
+            with tempfile.TemporaryDirectory() as workdir:
+                with open(os.path.join(workdir, 'deck.cir'), 'w') as f:
+                    f.write(deck)
+
+                process = await asyncio.create_subprocess_exec(
+                    self.spice_command, '-b', '-r', 'output.raw', 'deck.cir',
+                    cwd=workdir,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                try:
+                    stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+                except BaseException:
+                    # Timed out or cancelled: do not leave ngspice running
+                    if process.returncode is None:
+                        process.kill()
+                        await process.wait()
+                    raise
+
+                output_path = os.path.join(workdir, 'output.raw')
+                if process.returncode != 0 or not os.path.exists(output_path):
+                    raise NameError('Simulation failed, ngspice returned:' + os.linesep +
+                                    stdout.decode('utf-8', 'replace') + stderr.decode('utf-8', 'replace'))
+
+                # Parse in a thread, as large raw files would stall the event loop
+                return await asyncio.to_thread(read_results, output_path, vectors)
+
+    async def run(
+        self,
+        circuit:Circuit,
+        analysis:str,
+        vectors:Optional[Sequence[str]]=None,
+        timeout:Optional[float]=None,
+        **analysis_kwargs,
+    ) -> Dict[str, np.ndarray|float]:
+        """
+        Simulate an analysis of a circuit.
+
+        Args:
+            circuit (Circuit):
+                PySpice Circuit object.
+            analysis (str):
+                Analysis method name, e.g. 'transient'.
+            vectors (Sequence[str]):
+                Nodes to save and return, or None for all.
+            timeout (float):
+                Time limit in seconds, defaults to the simulator's.
+            **analysis_kwargs:
+                Keyword arguments of the analysis.
+
+        Returns:
+            dict: analysis results dictionary, as `format_analysis`
+        """
+        if analysis not in ANALYSES:
+            raise ValueError(f'Unknown analysis {analysis}, must be one of {ANALYSES}')
+        # pipe=True adds `filetype=binary`, the format read back by `read_results`
+        deck = render_netlist(circuit, analysis, analysis_kwargs, self.simulator_kwargs, pipe=True)
+        return await self.run_deck(deck, vectors, timeout)
+
+    async def operating_point(self, circuit:Circuit, **kwargs) -> Dict[str, np.ndarray|float]:
+        return await self.run(circuit, 'operating_point', **kwargs)
+
+    async def dc(self, circuit:Circuit, **kwargs) -> Dict[str, np.ndarray|float]:
+        return await self.run(circuit, 'dc', **kwargs)
+
+    async def ac(self, circuit:Circuit, **kwargs) -> Dict[str, np.ndarray|float]:
+        return await self.run(circuit, 'ac', **kwargs)
+
+    async def transient(self, circuit:Circuit, **kwargs) -> Dict[str, np.ndarray|float]:
+        return await self.run(circuit, 'transient', **kwargs)
+
+    async def map(
+        self,
+        circuits:Sequence[Circuit],
+        analysis:str,
+        return_exceptions:bool=False,
+        **kwargs,
+    ) -> List[Dict[str, np.ndarray|float]|BaseException]:
+        """
+        Simulate the same analysis of many circuits concurrently.
+
+        Args:
+            circuits (Sequence[Circuit]):
+                PySpice Circuit objects.
+            analysis (str):
+                Analysis method name, e.g. 'transient'.
+            return_exceptions (bool):
+                Return a failed simulation's exception in its place,
+                rather than raising the first one.
+            **kwargs:
+                As `run`.
+
+        Returns:
+            list: one result per circuit, in order
+        """
+        return await asyncio.gather(
+            *(self.run(circuit, analysis, **kwargs) for circuit in circuits),
+            return_exceptions=return_exceptions,
+        )
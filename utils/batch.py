@@ -0,0 +1,331 @@
+import numpy as np
+import os
+import subprocess
+import tempfile
+from typing import List, Dict, Optional, Any, Sequence
+
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Spice.Simulation import CircuitSimulation
+from PySpice.Spice.NgSpice.Simulation import NgSpiceCircuitSimulator
+
+from utils.methods import write_line_to_netlist, render_netlist
+from utils.outputs import vector_expression
+from utils.pool import alter_commands
+from utils.rawfile import read_raw, simplified_name
+from utils.sweep import parameter_grid, DEFAULT_SIMULATOR_KWARGS
+
+
+
+SPICE_COMMAND = 'ngspice'
+
+# ngspice abscissa vectors, and the name they are returned under
+ABSCISSA_VECTORS = {'time': 'time', 'frequency': 'frequency', 'v-sweep': 'sweep', 'i-sweep': 'sweep'}
+
+
+def analysis_command(
+    circuit:Circuit,
+    analysis:str,
+    analysis_kwargs:Optional[Dict[str, Any]]=None,
+) -> str:
+    """
+    Get the interactive ngspice command for an analysis,
+    e.g. 'transient' -> 'tran 0.0001s 0.1s 0s'.
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit object (needed to resolve DC sweep sources).
+        analysis (str):
+            Analysis method name, e.g. 'transient'.
+        analysis_kwargs (dict):
+            Keyword arguments of the analysis.
+
+    Returns:
+        str: the analysis as a control command (without the leading '.')
+    """
+    simulation = NgSpiceCircuitSimulator(circuit, pipe=False)
+    getattr(CircuitSimulation, analysis)(simulation, **(analysis_kwargs or {}))
+    (parameters,) = simulation.analysis_iter()
+    return str(parameters).lstrip('.')
+
+
+def control_sweep_lines(
+    points:Sequence[Dict[str, Any]],
+    command:str,
+    output_file:str,
+    vectors:Optional[Sequence[str]]=None,
+    model_names:Sequence[str]=(),
+    linearize:bool=False,
+) -> List[str]:
+    """
+    Create a `.control` block which runs one analysis per sweep point.
+
+    For each point the parameters are set with `alter`/`altermod`,
+    the analysis is run and the vectors are appended, as a new plot,
+    to a single binary raw file.
+
+    Args:
+        points (Sequence[dict]):
+            Parameter values of each point, see `utils.pool.alter_commands`.
+        command (str):
+            The analysis command, e.g. 'tran 0.0001 0.1'.
+        output_file (str):
+            Path of the raw file written by ngspice.
+        vectors (Sequence[str]):
+            Vectors to write, e.g. ['n3'], or None for all.
+        model_names (Sequence[str]):
+            Names of the models defined in the circuit (for `altermod`).
+        linearize (bool):
+            Resample transient results onto the uniform step time grid,
+            so every point has the same number of samples.
+
+    Returns:
+        list: lines of the control block
+    """
+    saved = ' '.join(vector_expression(v) for v in vectors) if vectors else ''
+
+    lines = [
+        '.control',
+        'set filetype=binary',
+        'set appendwrite',
+    ]
+    for point in points:
+        lines += alter_commands(point, model_names)
+        lines.append(command)
+        if linearize:
+            lines.append(f'linearize {saved}'.rstrip())
+        lines.append(f'write {output_file} {saved}'.rstrip())
+        lines.append('destroy all')
+    lines.append('.endc')
+    return lines
+
+
+def add_control_sweep(
+    circuit:Circuit,
+    points:Sequence[Dict[str, Any]],
+    analysis:str,
+    analysis_kwargs:Optional[Dict[str, Any]]=None,
+    output_file:str='sweep.raw',
+    vectors:Optional[Sequence[str]]=None,
+) -> Circuit:
+    """
+    Write a batched sweep `.control` block to a circuit's netlist.
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit object.
+        points (Sequence[dict]):
+            Parameter values of each point, see `utils.pool.alter_commands`.
+        analysis (str):
+            Analysis method name, e.g. 'transient'.
+        analysis_kwargs (dict):
+            Keyword arguments of the analysis.
+        output_file (str):
+            Path of the raw file written by ngspice.
+        vectors (Sequence[str]):
+            Vectors to write, e.g. ['n3'], or None for all.
+
+    Returns:
+        Circuit: PySpice circuit object with the added control block
+    """
+    lines = control_sweep_lines(
+        points,
+        analysis_command(circuit, analysis, analysis_kwargs),
+        output_file,
+        vectors=vectors,
+        model_names=list(circuit.model_names),
+        linearize=(analysis == 'transient'),
+    )
+    for line in lines:
+        circuit = write_line_to_netlist(circuit, line)
+    return circuit
+
+
+def insert_control_block(deck:str, lines:Sequence[str]) -> str:
+    """
+    Insert a `.control` block (see `control_sweep_lines`) into a rendered
+    deck, just before its final `.end` line.
+
+    This lets a deck rendered once (e.g. in a parent process) be reused for
+    many sweeps, without needing the PySpice Circuit.
+
+    Args:
+        deck (str):
+            Rendered SPICE deck, see `utils.methods.render_netlist`.
+        lines (Sequence[str]):
+            Lines of the control block.
+
+    Returns:
+        str: the deck with the control block
+    """
+    deck_lines = deck.splitlines()
+    for i in range(len(deck_lines) - 1, -1, -1):
+        if deck_lines[i].strip().lower() == '.end':
+            break
+    else:
+        raise ValueError('The deck has no .end line')
+    return os.linesep.join(deck_lines[:i] + list(lines) + deck_lines[i:]) + os.linesep
+
+
+def read_raw_plots(path:str) -> List[Dict[str, np.ndarray]]:
+    """
+    Read every plot of an ngspice binary raw file
+    (e.g. one written with `set appendwrite`).
+
+    Args:
+        path (str):
+            Path to the raw file.
+
+    Returns:
+        list: one {vector name: array} dictionary per plot
+    """
+    # Copy out of the memory-map, as the file is usually temporary
+    return [{name: np.array(plot[name]) for name in plot.keys()} for plot in read_raw(path)]
+
+
+def stack_plots(
+    plots:List[Dict[str, np.ndarray]],
+) -> Dict[str, np.ndarray]:
+    """
+    Stack the plots of a batched sweep into (n_points, n_samples) arrays.
+
+    The abscissa (time, frequency or DC sweep) is shared by every point
+    and is returned as a single 1-D array.
+
+    Args:
+        plots (list):
+            One {vector name: array} dictionary per point.
+
+    Returns:
+        dict: vector name to stacked array
+    """
+    if not plots:
+        raise ValueError('No plots to stack')
+
+    lengths = {len(v) for plot in plots for v in plot.values()}
+    if len(lengths) > 1:
+        raise ValueError(f'Plots have different lengths {sorted(lengths)}, '
+                         'transient results must be linearized to be stacked')
+
+    res = {}
+    for name in plots[0].keys():
+        if name in ABSCISSA_VECTORS:
+            res[ABSCISSA_VECTORS[name]] = np.real(plots[0][name])
+        else:
+            res[simplified_name(name)] = np.stack([plot[name] for plot in plots])
+    return res
+
+
+def run_batched_sweep(
+    circuit:Circuit,
+    parameters:Dict[str, Sequence],
+    analysis:str='transient',
+    analysis_kwargs:Optional[Dict[str, Any]]=None,
+    mode:str='product',
+    vectors:Optional[Sequence[str]]=None,
+    simulator_kwargs:Optional[Dict[str, Any]]=None,
+    spice_command:str=SPICE_COMMAND,
+    workdir:Optional[str]=None,
+) -> Dict[str, np.ndarray]:
+    """
+    Run a whole parameter sweep with a single ngspice launch.
+
+    One netlist is written with a `.control` block that loops over the
+    points with `alter`, runs the analysis for each and appends the
+    vectors to one raw file, which is then read back and stacked.
+    Transient results are linearized onto the step time grid.
+
+    Example:
+        res = run_batched_sweep(build_circuit(500), {'R1': sweep_resistors},
+                                'transient', dict(step_time=0.0001, end_time=0.1),
+                                vectors=['n3'])
+        res['n3'].shape  # (n_points, n_samples)
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit, with the nominal parameter values.
+        parameters (dict):
+            Element/model parameter name to sequence of values,
+            see `utils.pool.alter_commands`.
+        analysis (str):
+            Analysis method name, e.g. 'transient'.
+        analysis_kwargs (dict):
+            Keyword arguments of the analysis.
+        mode (str):
+            'product' (Cartesian) or 'zip' combination of the parameters.
+        vectors (Sequence[str]):
+            Vectors to keep, e.g. ['n3'], or None for all.
+        simulator_kwargs (dict):
+            Keyword arguments as passed to `circuit.simulator()`.
+        spice_command (str):
+            ngspice executable.
+        workdir (str):
+            Directory for the netlist and raw file, defaults to a temporary one.
+
+    Returns:
+        dict: vector name to (n_points, n_samples) array, plus the shared abscissa
+    """
+    points = parameter_grid(parameters, mode=mode)
+
+    output_file = 'sweep.raw'
+
+    # Add the control block, leaving the caller's circuit as it was
+    raw_spice = circuit.raw_spice
+    try:
+        add_control_sweep(circuit, points, analysis, analysis_kwargs, output_file, vectors)
+        deck = render_netlist(circuit, simulator_kwargs=simulator_kwargs or DEFAULT_SIMULATOR_KWARGS)
+    finally:
+        circuit.raw_spice = raw_spice
+
+    return run_batched_deck(deck, len(points), output_file, spice_command, workdir)
+
+
+def run_batched_deck(
+    deck:str,
+    n_points:int,
+    output_file:str='sweep.raw',
+    spice_command:str=SPICE_COMMAND,
+    workdir:Optional[str]=None,
+) -> Dict[str, np.ndarray]:
+    """
+    Run a deck holding a batched sweep `.control` block, and stack its plots.
+
+    Args:
+        deck (str):
+            SPICE deck, with a control block writing `output_file`.
+        n_points (int):
+            Number of sweep points (plots) expected.
+        output_file (str):
+            Raw file written by the control block, relative to `workdir`.
+        spice_command (str):
+            ngspice executable.
+        workdir (str):
+            Directory for the netlist and raw file, defaults to a temporary one.
+
+    Returns:
+        dict: vector name to (n_points, n_samples) array, plus the shared abscissa
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = workdir or tmpdir
+        output_path = os.path.join(workdir, output_file)
+        if os.path.exists(output_path):
+            os.remove(output_path)  # as plots are appended
+
+        deck_path = os.path.join(workdir, 'sweep.cir')
+        with open(deck_path, 'w') as f:
+            f.write(deck)
+
+        process = subprocess.run(
+            (spice_command, '-b', 'sweep.cir'),
+            cwd=workdir,
+            capture_output=True,
+        )
+        if process.returncode != 0 or not os.path.exists(output_path):
+            raise NameError('Batched sweep failed, ngspice returned:' + os.linesep +
+                            process.stdout.decode('utf-8', 'replace') +
+                            process.stderr.decode('utf-8', 'replace'))
+
+        plots = read_raw_plots(output_path)
+
+    if len(plots) != n_points:
+        raise NameError(f'Expected {n_points} plots, ngspice wrote {len(plots)}')
+    return stack_plots(plots)
@@ -0,0 +1,239 @@
+import functools
+import hashlib
+import os
+import subprocess
+from typing import List, Dict, Optional, Any
+
+import PySpice
+
+from utils.batch import analysis_command
+from utils.result import SimulationResult
+
+
+
+DEFAULT_CACHE_DIR = '.spice_cache'
+DEFAULT_MAX_BYTES = 1 << 30  # 1 GiB
+
+
+@functools.lru_cache(maxsize=None)
+def ngspice_version(spice_command:str='ngspice') -> str:
+    """
+    Get the version banner of an ngspice executable (run once per command).
+    """
+    try:
+        process = subprocess.run((spice_command, '-v'), capture_output=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return 'unknown'
+    lines = process.stdout.decode('utf-8', 'replace').splitlines()
+    return next((line.strip() for line in lines if 'ngspice' in line.lower()), 'unknown')
+
+
+def simulator_version(simulator) -> str:
+    """
+    Describe the simulator backend and version, for use in cache keys.
+    """
+    version = f'PySpice-{PySpice.__version__} {type(simulator).__name__}'
+    if hasattr(simulator, 'ngspice'):
+        return version + f' ngspice-{simulator.ngspice.ngspice_version}'
+    if hasattr(simulator, '_spice_server'):
+        return version + ' ' + ngspice_version(simulator._spice_server._spice_command)
+    return version
+
+
+def cache_key(
+    simulator,
+    analysis:str,
+    **analysis_kwargs,
+) -> str:
+    """
+    Hash everything that determines a simulation's output: the netlist,
+    simulator options (including temperature), initial conditions and saved
+    vectors (all rendered by `str(simulator)`), the analysis and its
+    parameters, and the simulator version.
+
+    Args:
+        simulator (CircuitSimulator):
+            PySpice simulator, as returned by `circuit.simulator()`.
+        analysis (str):
+            Analysis method name, e.g. 'transient'.
+        **analysis_kwargs:
+            Keyword arguments of the analysis.
+
+    Returns:
+        str: hex digest
+    """
+    h = hashlib.sha256()
+    for part in (
+        str(simulator),
+        analysis_command(simulator.circuit, analysis, analysis_kwargs),
+        simulator_version(simulator),
+    ):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class SimulationCache:
+    """
+    Content-addressed on-disk cache of simulation results.
+
+    Results are stored as memory-mappable `.npy` blocks (see
+    `SimulationResult.save`), named by a hash of the simulation inputs.
+    Entries are evicted least recently used first when the cache grows
+    beyond `max_bytes`.
+
+    Example:
+        cache = SimulationCache()
+        res = cache.run(simulator, 'transient', step_time=0.0001, end_time=0.1)
+
+    Args:
+        directory (str):
+            Cache directory, created if needed.
+        max_bytes (int):
+            Size budget of the cache directory.
+    """
+
+    def __init__(
+        self,
+        directory:str=DEFAULT_CACHE_DIR,
+        max_bytes:int=DEFAULT_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _entries(self) -> List[Dict[str, Any]]:
+        entries = {}
+        for file_name in os.listdir(self.directory):
+            key, ext = os.path.splitext(file_name)
+            if ext not in ('.npy', '.json'):
+                continue
+            stat = os.stat(os.path.join(self.directory, file_name))
+            entry = entries.setdefault(key, {'key': key, 'size': 0, 'used': 0.0})
+            entry['size'] += stat.st_size
+            if ext == '.npy':
+                entry['used'] = stat.st_mtime
+        return list(entries.values())
+
+    @property
+    def size(self) -> int:
+        """ Total size of the cached results in bytes. """
+        return sum(entry['size'] for entry in self._entries())
+
+    def __contains__(self, key:str) -> bool:
+        return os.path.exists(self._path(key) + '.json')
+
+    def get(self, key:str) -> Optional[SimulationResult]:
+        """
+        Get a cached result (memory-mapped), or None on a miss.
+        """
+        if key not in self:
+            return None
+        path = self._path(key)
+        try:
+            result = SimulationResult.load(path)
+        except (OSError, ValueError):
+            return None
+        os.utime(path + '.npy')  # mark as recently used
+        return result
+
+    def put(
+        self,
+        key:str,
+        result:SimulationResult,
+    ):
+        """
+        Store a result, then evict old entries if over budget.
+        """
+        result.save(self._path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until within the size budget.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry['used'])
+        total = sum(entry['size'] for entry in entries)
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            for ext in ('.json', '.npy'):
+                path = self._path(entry['key']) + ext
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= entry['size']
+
+    def clear(self):
+        """ Remove every cached result. """
+        for entry in self._entries():
+            for ext in ('.json', '.npy'):
+                path = self._path(entry['key']) + ext
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def run(
+        self,
+        simulator,
+        analysis:str,
+        **analysis_kwargs,
+    ) -> SimulationResult:
+        """
+        Run an analysis, or return the cached result of an identical run.
+
+        Args:
+            simulator (CircuitSimulator):
+                PySpice simulator, as returned by `circuit.simulator()`.
+            analysis (str):
+                Analysis method name, e.g. 'transient'.
+            **analysis_kwargs:
+                Keyword arguments of the analysis.
+
+        Returns:
+            SimulationResult: columnar analysis results
+        """
+        key = cache_key(simulator, analysis, **analysis_kwargs)
+        result = self.get(key)
+        if result is None:
+            analysis_res = getattr(simulator, analysis)(**analysis_kwargs)
+            result = SimulationResult.from_analysis(analysis_res)
+            self.put(key, result)
+        return result
+
+
+class CachedSimulator:
+    """
+    Wrap a PySpice simulator so its analyses are served from a cache.
+
+    Example:
+        simulator = CachedSimulator(circuit.simulator(temperature=25, nominal_temperature=25))
+        res = simulator.transient(step_time=0.0001, end_time=0.1)
+
+    Args:
+        simulator (CircuitSimulator):
+            PySpice simulator, as returned by `circuit.simulator()`.
+        cache (SimulationCache):
+            Cache to use, defaults to one in `DEFAULT_CACHE_DIR`.
+    """
+
+    def __init__(
+        self,
+        simulator,
+        cache:Optional[SimulationCache]=None,
+    ):
+        self.simulator = simulator
+        self.cache = cache if cache is not None else SimulationCache()
+
+    def operating_point(self, **kwargs) -> SimulationResult:
+        return self.cache.run(self.simulator, 'operating_point', **kwargs)
+
+    def dc(self, **kwargs) -> SimulationResult:
+        return self.cache.run(self.simulator, 'dc', **kwargs)
+
+    def ac(self, **kwargs) -> SimulationResult:
+        return self.cache.run(self.simulator, 'ac', **kwargs)
+
+    def transient(self, **kwargs) -> SimulationResult:
+        return self.cache.run(self.simulator, 'transient', **kwargs)
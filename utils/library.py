@@ -0,0 +1,284 @@
+import functools
+import json
+import os
+import re
+from typing import List, Dict, Optional, Any, Sequence, Set
+
+from PySpice.Spice.Netlist import Circuit
+
+from utils.methods import write_line_to_netlist
+
+
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_LIBRARY_DIRS = (
+    os.path.join(REPOSITORY_DIR, 'spice_library'),
+    os.path.join(REPOSITORY_DIR, 'LTSpice_include'),
+)
+DEFAULT_INDEX_PATH = os.path.join('.spice_cache', 'library_index.json')
+LIBRARY_EXTENSIONS = ('.lib', '.mod', '.sub', '.inc')
+
+# Bump when the index layout changes, so old indexes are rebuilt
+INDEX_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r'[^\s=(),]+')
+
+
+def parse_library(text:str) -> List[Dict[str, str]]:
+    """
+    Parse the top level `.SUBCKT` and `.MODEL` definitions of a library file.
+
+    A `.MODEL` includes its `+` continuation lines, a `.SUBCKT` runs up to
+    its matching `.ENDS` (models defined inside a subcircuit stay part of it).
+
+    Args:
+        text (str):
+            Library file contents.
+
+    Returns:
+        list: one {'name', 'kind', 'text'} dictionary per definition,
+        kind is 'subckt' or 'model'
+    """
+    blocks = []
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        words = lines[i].split()
+        keyword = words[0].lower() if words else ''
+
+        if keyword == '.subckt' and len(words) > 1:
+            depth = 0
+            for j in range(i, len(lines)):
+                word = lines[j].split()[0].lower() if lines[j].split() else ''
+                if word == '.subckt':
+                    depth += 1
+                elif word == '.ends':
+                    depth -= 1
+                    if depth == 0:
+                        break
+            blocks.append({'name': words[1], 'kind': 'subckt', 'text': '\n'.join(lines[i:j+1])})
+            i = j + 1
+
+        elif keyword == '.model' and len(words) > 1:
+            j = i + 1
+            while j < len(lines) and lines[j].lstrip().startswith(('+', '*')):
+                j += 1
+            # Drop trailing comment lines
+            while lines[j-1].lstrip().startswith('*'):
+                j -= 1
+            blocks.append({'name': words[1], 'kind': 'model', 'text': '\n'.join(lines[i:j])})
+            i = j
+
+        else:
+            i += 1
+    return blocks
+
+
+def referenced_names(circuit:Circuit) -> Set[str]:
+    """
+    Get the names of the models and subcircuits a circuit uses but does not define.
+    """
+    defined = {name.lower() for name in circuit.model_names}
+    defined |= {name.lower() for name in circuit.subcircuit_names}
+
+    names = set()
+    for netlist in [circuit] + list(circuit.subcircuits):
+        for element in netlist.elements:
+            for attribute in ('subcircuit_name', 'model'):
+                name = getattr(element, attribute, None)
+                if isinstance(name, str) and name.lower() not in defined:
+                    names.add(name)
+    return names
+
+
+class ModelLibrary:
+    """
+    Registry of the `.SUBCKT`/`.MODEL` definitions in SPICE library directories.
+
+    The directories are scanned once, each definition is indexed by name
+    (case insensitive, as in SPICE) and the index is saved to disk. On the
+    next start only files whose modification time or size changed are
+    parsed again. Circuits then get just the definitions they reference
+    inlined into their netlist, so no `.include` paths (which break on
+    spaces) are needed.
+
+    Example:
+        library = ModelLibrary()
+        circuit.X('importDiode', '1N4148', 1, 2)
+        library.inline(circuit)
+
+    Args:
+        directories (Sequence[str]):
+            Directories to scan (recursively), defaults to
+            `spice_library/` and `LTSpice_include/`.
+        index_path (str):
+            Where the index is saved, or None to not save it.
+    """
+
+    def __init__(
+        self,
+        directories:Optional[Sequence[str]]=None,
+        index_path:Optional[str]=DEFAULT_INDEX_PATH,
+    ):
+        self.directories = [os.path.abspath(d) for d in (directories or DEFAULT_LIBRARY_DIRS)]
+        self.index_path = index_path
+        self.files = {}
+        self.definitions = {}
+        self.refresh()
+
+    def _library_files(self) -> Dict[str, os.stat_result]:
+        files = {}
+        for directory in self.directories:
+            for root, _, file_names in os.walk(directory):
+                for file_name in file_names:
+                    if file_name.lower().endswith(LIBRARY_EXTENSIONS):
+                        path = os.path.join(root, file_name)
+                        files[path] = os.stat(path)
+        return files
+
+    def _load_index(self) -> Dict[str, Any]:
+        if self.index_path is None or not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if index.get('version') != INDEX_VERSION or index.get('directories') != self.directories:
+            return {}
+        return index.get('files', {})
+
+    def _save_index(self):
+        if self.index_path is None:
+            return
+        os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+        index = {'version': INDEX_VERSION, 'directories': self.directories, 'files': self.files}
+        with open(self.index_path, 'w') as f:
+            json.dump(index, f)
+
+    def refresh(self):
+        """
+        Bring the index up to date, re-parsing only new or modified files.
+        """
+        cached = self._load_index()
+        changed = False
+
+        self.files = {}
+        for path, stat in self._library_files().items():
+            entry = cached.get(path)
+            if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+                with open(path, errors='replace') as f:
+                    entry = {'mtime': stat.st_mtime, 'size': stat.st_size, 'blocks': parse_library(f.read())}
+                changed = True
+            self.files[path] = entry
+        changed = changed or set(self.files) != set(cached)
+
+        # Earlier directories (and files) take precedence for duplicate names
+        self.definitions = {}
+        for path, entry in self.files.items():
+            for block in entry['blocks']:
+                self.definitions.setdefault(block['name'].lower(), dict(block, path=path))
+
+        if changed:
+            self._save_index()
+
+    def __contains__(self, name:str) -> bool:
+        return name.lower() in self.definitions
+
+    def __getitem__(self, name:str) -> Dict[str, str]:
+        """ Get a definition: {'name', 'kind', 'text', 'path'}. """
+        try:
+            return self.definitions[name.lower()]
+        except KeyError:
+            raise KeyError(f'{name} is not defined in {self.directories}') from None
+
+    def __len__(self) -> int:
+        return len(self.definitions)
+
+    def names(self) -> List[str]:
+        return [definition['name'] for definition in self.definitions.values()]
+
+    def dependencies(self, names:Sequence[str]) -> List[str]:
+        """
+        Get the given definitions plus every library definition they use,
+        dependencies first.
+
+        Args:
+            names (Sequence[str]):
+                Model or subcircuit names.
+
+        Returns:
+            list: lower case names, in the order they should be written
+        """
+        ordered = []
+        visiting = set()
+
+        def visit(name):
+            key = name.lower()
+            if key in ordered or key in visiting:
+                return
+            visiting.add(key)
+            definition = self[key]
+            if definition['kind'] == 'subckt':
+                local = {block['name'].lower() for block in parse_library(definition['text'].split('\n', 1)[-1])}
+                for token in TOKEN_PATTERN.findall(self._body(definition['text'])):
+                    token = token.lower()
+                    if token != key and token not in local and token in self.definitions:
+                        visit(token)
+            ordered.append(key)
+
+        for name in names:
+            visit(name)
+        return ordered
+
+    @staticmethod
+    def _body(text:str) -> str:
+        # Element lines only (no comments, or the .SUBCKT/.ENDS lines)
+        lines = text.splitlines()[1:]
+        return '\n'.join(line for line in lines if line.strip() and not line.lstrip().startswith(('*', '.')))
+
+    def inline(
+        self,
+        circuit:Circuit,
+        names:Optional[Sequence[str]]=None,
+    ) -> Circuit:
+        """
+        Write the definitions a circuit references (and their dependencies)
+        into its netlist.
+
+        Args:
+            circuit (Circuit):
+                PySpice Circuit object.
+            names (Sequence[str]):
+                Definitions to add, defaults to those the circuit references.
+
+        Returns:
+            Circuit: PySpice circuit object with the added definitions
+        """
+        if names is None:
+            names = sorted(name for name in referenced_names(circuit) if name in self)
+        for key in self.dependencies(names):
+            circuit = write_line_to_netlist(circuit, self.definitions[key]['text'].replace('\n', os.linesep))
+        return circuit
+
+    def include(
+        self,
+        circuit:Circuit,
+        name:str,
+    ) -> Circuit:
+        """
+        Add an (quoted, so paths may contain spaces) `.include` line
+        for the file defining a model or subcircuit.
+        """
+        return write_line_to_netlist(circuit, f'.include "{self[name]["path"]}"')
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({len(self)} definitions, files={len(self.files)})'
+
+
+@functools.lru_cache(maxsize=None)
+def default_library() -> ModelLibrary:
+    """
+    Get the library of the repository's model directories (built once per process).
+    """
+    return ModelLibrary()
@@ -0,0 +1,514 @@
+import numpy as np
+import os
+import re
+import subprocess
+import tempfile
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Any, Sequence, Tuple
+
+from PySpice.Spice.Netlist import Circuit
+
+from utils.methods import write_line_to_netlist, render_netlist
+from utils.outputs import vector_expression
+from utils.sweep import DEFAULT_SIMULATOR_KWARGS
+
+
+
+SPICE_COMMAND = 'ngspice'
+
+MEASUREMENT_KINDS = (
+    'max', 'min', 'pp', 'avg', 'rms', 'integ', 'ripple',
+    'value_at', 'cross', 'rise_time', 'fall_time',
+)
+
+# ngspice .meas functions, for the kinds which map onto one directly
+MEAS_FUNCTIONS = {'max': 'MAX', 'min': 'MIN', 'pp': 'PP', 'avg': 'AVG', 'rms': 'RMS', 'integ': 'INTEG'}
+
+
+@dataclass
+class Measurement:
+    """
+    A declared waveform measurement, the NumPy equivalent of a `.meas` line.
+
+    Kinds:
+        - 'max', 'min', 'pp' (peak to peak): over the window.
+        - 'avg', 'rms', 'integ': time weighted (trapezoidal) over the window.
+        - 'ripple': peak to peak divided by the average, over the window.
+        - 'value_at': value at time `at`.
+        - 'cross': time of the first crossing of `level` after `start`
+          (rising, or falling if `rising` is False).
+        - 'rise_time', 'fall_time': time between the crossings of the low
+          and high levels. The levels are `levels` (absolute) if given,
+          otherwise the `low`/`high` fractions of the window's min to max range.
+
+    Args:
+        name (str):
+            Name of the result.
+        kind (str):
+            One of `MEASUREMENT_KINDS`.
+        node (str):
+            Node (or vector) measured, e.g. 'n3'.
+        start (float):
+            Window start time, defaults to the start of the simulation.
+        stop (float):
+            Window stop time, defaults to the end of the simulation.
+        at (float):
+            Time, for 'value_at'.
+        level (float):
+            Level, for 'cross'.
+        rising (bool):
+            Crossing direction, for 'cross'.
+        low (float):
+            Low level fraction, for 'rise_time'/'fall_time'.
+        high (float):
+            High level fraction, for 'rise_time'/'fall_time'.
+        levels (tuple):
+            Absolute (low, high) levels, for 'rise_time'/'fall_time'.
+    """
+    name: str
+    kind: str
+    node: str
+    start: Optional[float] = None
+    stop: Optional[float] = None
+    at: Optional[float] = None
+    level: Optional[float] = None
+    rising: bool = True
+    low: float = 0.1
+    high: float = 0.9
+    levels: Optional[Tuple[float, float]] = None
+
+    def __post_init__(self):
+        if self.kind not in MEASUREMENT_KINDS:
+            raise ValueError(f'Unknown measurement kind {self.kind}, must be one of {MEASUREMENT_KINDS}')
+        if self.kind == 'value_at' and self.at is None:
+            raise ValueError(f'Measurement {self.name} needs a time `at`')
+        if self.kind == 'cross' and self.level is None:
+            raise ValueError(f'Measurement {self.name} needs a `level`')
+
+
+class WaveformBatch:
+    """
+    A batch of transient waveforms, each on its own (non-uniform) time grid.
+
+    The waveforms are held end to end in flat arrays with row offsets, so
+    every measurement is a handful of NumPy operations over the whole
+    batch, rather than a Python loop over the results.
+
+    Args:
+        time (np.ndarray):
+            Concatenated time vectors.
+        values (Dict[str, np.ndarray]):
+            Node name to concatenated values.
+        offsets (np.ndarray):
+            Start of each waveform in the flat arrays, plus the total length.
+    """
+
+    def __init__(
+        self,
+        time:np.ndarray,
+        values:Dict[str, np.ndarray],
+        offsets:np.ndarray,
+    ):
+        self.time = np.asarray(time, dtype=np.float64)
+        self.values = {name: np.real(np.asarray(v)).astype(np.float64) for name, v in values.items()}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+        lengths = np.diff(self.offsets)
+        if np.any(lengths < 2):
+            raise ValueError('Every waveform needs at least two samples')
+        self.segment = np.repeat(np.arange(len(lengths)), lengths)
+        self.t0 = self.time[self.offsets[:-1]]
+        self.t1 = self.time[self.offsets[1:] - 1]
+
+        # Strictly increasing search key: waveform i occupies [2i, 2i+1]
+        span = np.where(self.t1 > self.t0, self.t1 - self.t0, 1.0)
+        self._span = span
+        self._keys = 2 * self.segment + (self.time - self.t0[self.segment]) / span[self.segment]
+
+        # Trapezoidal cumulative integral of each waveform is built lazily, per node
+        self._cumulative = {}
+
+    @classmethod
+    def from_results(
+        cls,
+        results:Sequence[Any],
+        nodes:Optional[Sequence[str]]=None,
+        time_key:str='time',
+    ) -> 'WaveformBatch':
+        """
+        Build a batch from a sequence of results, each indexable by node name
+        (e.g. SimulationResult, `format_analysis` dicts or SweepPoints).
+        """
+        results = [getattr(r, 'result', r) for r in results]
+        if nodes is None:
+            nodes = [name for name in results[0].keys() if name != time_key]
+        times = [np.real(np.asarray(r[time_key])) for r in results]
+        offsets = np.concatenate([[0], np.cumsum([len(t) for t in times])])
+        values = {node: np.concatenate([np.asarray(r[node]) for r in results]) for node in nodes}
+        return cls(np.concatenate(times), values, offsets)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        time:np.ndarray,
+        values:Dict[str, np.ndarray],
+    ) -> 'WaveformBatch':
+        """
+        Build a batch from (n_points, n_samples) arrays, e.g. the output of
+        `utils.batch.run_batched_sweep`, with a shared (n_samples,) time
+        vector or one (n_points, n_samples) time array.
+        """
+        values = {name: np.atleast_2d(v) for name, v in values.items()}
+        n_points, n_samples = next(iter(values.values())).shape
+        time = np.broadcast_to(np.asarray(time, dtype=np.float64), (n_points, n_samples))
+        offsets = np.arange(n_points + 1) * n_samples
+        return cls(time.ravel(), {name: v.ravel() for name, v in values.items()}, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _window(self, start:Optional[float], stop:Optional[float]) -> Tuple[np.ndarray, np.ndarray]:
+        start = self.t0 if start is None else np.clip(start, self.t0, self.t1)
+        stop = self.t1 if stop is None else np.clip(stop, self.t0, self.t1)
+        return np.broadcast_to(start, self.t0.shape), np.broadcast_to(stop, self.t0.shape)
+
+    def rows(self, x:np.ndarray, t:np.ndarray) -> np.ndarray:
+        """ Reshape a per waveform array to broadcast against t, of shape (n_waveforms, ...). """
+        return np.reshape(x, (-1,) + (1,) * (np.ndim(t) - 1))
+
+    def locate(self, t:np.ndarray) -> np.ndarray:
+        """
+        Flat index k of the sample interval [k, k+1] holding each time,
+        where t has shape (n_waveforms,) or (n_waveforms, n_times).
+        """
+        fraction = np.clip((t - self.rows(self.t0, t)) / self.rows(self._span, t), 0, 1)
+        k = np.searchsorted(self._keys, self.rows(2 * np.arange(len(self)), t) + fraction, side='right') - 1
+        return np.clip(k, self.rows(self.offsets[:-1], t), self.rows(self.offsets[1:] - 2, t))
+
+    def interpolate(self, node:str, t:np.ndarray) -> np.ndarray:
+        """
+        Linearly interpolated value of a node at time t,
+        of shape (n_waveforms,) or (n_waveforms, n_times).
+        """
+        y = self.values[node]
+        k = self.locate(t)
+        dt = self.time[k+1] - self.time[k]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(dt > 0, (t - self.time[k]) / dt, 0.0)
+        return y[k] + fraction * (y[k+1] - y[k])
+
+    def _cumulative_integral(self, node:str, power:int=1) -> np.ndarray:
+        key = (node, power)
+        if key not in self._cumulative:
+            y = self.values[node] ** power
+            area = 0.5 * (y[1:] + y[:-1]) * np.diff(self.time)
+            area[self.offsets[1:-1] - 1] = 0.0  # no area between two waveforms
+            cumulative = np.concatenate([[0.0], np.cumsum(area)])
+            self._cumulative[key] = cumulative - cumulative[self.offsets[:-1]][self.segment]
+        return self._cumulative[key]
+
+    def integrate(self, node:str, start:np.ndarray, stop:np.ndarray, power:int=1) -> np.ndarray:
+        """
+        Trapezoidal integral of node**power from start to stop (per waveform),
+        on the actual time points, with the window edges interpolated.
+        """
+        cumulative = self._cumulative_integral(node, power)
+
+        def integral_to(t):
+            k = self.locate(t)
+            y = self.values[node]
+            yk = y[k] ** power
+            yt = self.interpolate(node, t) ** power
+            return cumulative[k] + (t - self.time[k]) * (yk + yt) / 2
+
+        return integral_to(stop) - integral_to(start)
+
+    def reduce(self, node:str, start:np.ndarray, stop:np.ndarray, ufunc:np.ufunc) -> np.ndarray:
+        """ np.maximum/np.minimum of a node over each window (edges interpolated). """
+        y = self.values[node]
+        identity = -np.inf if ufunc is np.maximum else np.inf
+        inside = (self.time >= start[self.segment]) & (self.time <= stop[self.segment])
+        res = ufunc.reduceat(np.where(inside, y, identity), self.offsets[:-1])
+        return ufunc(res, ufunc(self.interpolate(node, start), self.interpolate(node, stop)))
+
+    def crossing(
+        self,
+        node:str,
+        level:np.ndarray,
+        start:np.ndarray,
+        rising:bool=True,
+    ) -> np.ndarray:
+        """ Time of the first crossing of level after start (per waveform), NaN if none. """
+        y = self.values[node]
+        s = y - np.broadcast_to(level, self.t0.shape)[self.segment]
+        if rising:
+            crosses = (s[:-1] < 0) & (s[1:] >= 0)
+        else:
+            crosses = (s[:-1] > 0) & (s[1:] <= 0)
+        crosses &= self.segment[:-1] == self.segment[1:]
+        crosses &= self.time[1:] > start[self.segment[:-1]]
+
+        candidates = np.flatnonzero(crosses)
+        segments, first = np.unique(self.segment[candidates], return_index=True)
+        k = candidates[first]
+
+        t0, t1 = self.time[k], self.time[k+1]
+        s0, s1 = s[k], s[k+1]
+        res = np.full(len(self), np.nan)
+        res[segments] = t0 + (t1 - t0) * (-s0) / (s1 - s0)
+        return res
+
+    def measure(self, measurement:Measurement) -> np.ndarray:
+        """
+        Evaluate one measurement over the whole batch.
+
+        Returns:
+            np.ndarray: one value per waveform
+        """
+        m = measurement
+        start, stop = self._window(m.start, m.stop)
+
+        if m.kind == 'max':
+            return self.reduce(m.node, start, stop, np.maximum)
+        if m.kind == 'min':
+            return self.reduce(m.node, start, stop, np.minimum)
+        if m.kind == 'pp':
+            return self.reduce(m.node, start, stop, np.maximum) - self.reduce(m.node, start, stop, np.minimum)
+        if m.kind == 'integ':
+            return self.integrate(m.node, start, stop)
+
+        duration = stop - start
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if m.kind == 'avg':
+                return self.integrate(m.node, start, stop) / duration
+            if m.kind == 'rms':
+                return np.sqrt(np.maximum(self.integrate(m.node, start, stop, power=2), 0) / duration)
+            if m.kind == 'ripple':
+                pp = self.reduce(m.node, start, stop, np.maximum) - self.reduce(m.node, start, stop, np.minimum)
+                return pp / np.abs(self.integrate(m.node, start, stop) / duration)
+
+        if m.kind == 'value_at':
+            return self.interpolate(m.node, np.clip(m.at, self.t0, self.t1))
+        if m.kind == 'cross':
+            return self.crossing(m.node, m.level, start, m.rising)
+
+        # rise_time / fall_time
+        if m.levels is not None:
+            low, high = (np.full(len(self), level, dtype=np.float64) for level in m.levels)
+        else:
+            y_min = self.reduce(m.node, start, stop, np.minimum)
+            y_max = self.reduce(m.node, start, stop, np.maximum)
+            low = y_min + m.low * (y_max - y_min)
+            high = y_min + m.high * (y_max - y_min)
+        if m.kind == 'rise_time':
+            t_low = self.crossing(m.node, low, start, rising=True)
+            return self.crossing(m.node, high, t_low, rising=True) - t_low
+        t_high = self.crossing(m.node, high, start, rising=False)
+        return self.crossing(m.node, low, t_high, rising=False) - t_high
+
+
+def measure(
+    results:Sequence[Any]|WaveformBatch,
+    measurements:Sequence[Measurement],
+) -> Dict[str, np.ndarray]:
+    """
+    Apply declared measurements to a whole batch of transient results.
+
+    Example:
+        measurements = [
+            Measurement('peak', 'max', 'n3'),
+            Measurement('vrms', 'rms', 'n3', start=0.02),
+            Measurement('ripple', 'ripple', 'n2', start=0.05),
+            Measurement('tr', 'rise_time', 'n2', stop=0.01),
+        ]
+        res = measure([p.result for p in sweep.run()], measurements)
+        res['peak'].shape  # (n_points,)
+
+    Args:
+        results (Sequence | WaveformBatch):
+            One result per sweep point (see `WaveformBatch.from_results`),
+            or a WaveformBatch.
+        measurements (Sequence[Measurement]):
+            The measurements.
+
+    Returns:
+        dict: measurement name to (n_points,) array
+    """
+    if isinstance(results, WaveformBatch):
+        batch = results
+    else:
+        nodes = sorted({m.node for m in measurements})
+        batch = WaveformBatch.from_results(results, nodes)
+    return {m.name: batch.measure(m) for m in measurements}
+
+
+def meas_lines(
+    measurement:Measurement,
+    analysis:str='tran',
+) -> List[str]:
+    """
+    Convert a measurement to ngspice `.meas` statements.
+
+    'ripple' is written as a peak to peak and an average measurement,
+    combined by a `param` measurement. Rise and fall times need
+    absolute `levels`, as ngspice cannot measure the levels first.
+
+    Args:
+        measurement (Measurement):
+            The measurement.
+        analysis (str):
+            ngspice analysis type, e.g. 'tran'.
+
+    Returns:
+        list: `.meas` lines
+    """
+    m = measurement
+    name = m.name.lower()
+    vector = vector_expression(m.node)
+    window = ''
+    if m.start is not None:
+        window += f' from={m.start}'
+    if m.stop is not None:
+        window += f' to={m.stop}'
+
+    if m.kind in MEAS_FUNCTIONS:
+        return [f'.meas {analysis} {name} {MEAS_FUNCTIONS[m.kind]} {vector}{window}']
+    if m.kind == 'ripple':
+        return [
+            f'.meas {analysis} {name}_pp PP {vector}{window}',
+            f'.meas {analysis} {name}_avg AVG {vector}{window}',
+            f".meas {analysis} {name} param='{name}_pp/abs({name}_avg)'",
+        ]
+    if m.kind == 'value_at':
+        return [f'.meas {analysis} {name} FIND {vector} AT={m.at}']
+
+    delay = f' TD={m.start}' if m.start is not None else ''
+    if m.kind == 'cross':
+        edge = 'RISE' if m.rising else 'FALL'
+        return [f'.meas {analysis} {name} WHEN {vector}={m.level} {edge}=1{delay}']
+
+    if m.levels is None:
+        raise ValueError(f'Measurement {m.name}: a .meas {m.kind} needs absolute `levels`')
+    low, high = m.levels
+    if m.kind == 'rise_time':
+        return [f'.meas {analysis} {name} TRIG {vector} VAL={low} RISE=1{delay} TARG {vector} VAL={high} RISE=1{delay}']
+    return [f'.meas {analysis} {name} TRIG {vector} VAL={high} FALL=1{delay} TARG {vector} VAL={low} FALL=1{delay}']
+
+
+def add_measurements(
+    circuit:Circuit,
+    measurements:Sequence[Measurement],
+    analysis:str='tran',
+) -> Circuit:
+    """
+    Write measurements to a circuit's netlist as `.meas` statements.
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit object.
+        measurements (Sequence[Measurement]):
+            The measurements.
+        analysis (str):
+            ngspice analysis type, e.g. 'tran'.
+
+    Returns:
+        Circuit: PySpice circuit object with the added `.meas` lines
+    """
+    for m in measurements:
+        for line in meas_lines(m, analysis):
+            circuit = write_line_to_netlist(circuit, line)
+    return circuit
+
+
+MEAS_RESULT_PATTERN = re.compile(r'^\s*(\w+)\s*=\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+
+
+def parse_meas_output(
+    text:str,
+    names:Optional[Sequence[str]]=None,
+) -> Dict[str, float]:
+    """
+    Parse the `.meas` results printed by ngspice, e.g. 'peak = 1.234e+00 at= 5e-03'.
+    Measurements which failed are returned as NaN.
+
+    Args:
+        text (str):
+            ngspice output.
+        names (Sequence[str]):
+            Measurement names to look for, or None for every `name = value` line.
+
+    Returns:
+        dict: measurement name to value
+    """
+    wanted = {name.lower() for name in names} if names is not None else None
+    res = {}
+    for line in text.splitlines():
+        match = MEAS_RESULT_PATTERN.match(line)
+        if match is not None:
+            name = match.group(1).lower()
+            if wanted is None or name in wanted:
+                res[name] = float(match.group(2))
+        elif wanted is not None:
+            for name in wanted:
+                if line.strip().lower().startswith(name) and 'failed' in line.lower():
+                    res.setdefault(name, np.nan)
+    if wanted is not None:
+        for name in wanted:
+            res.setdefault(name, np.nan)
+    return res
+
+
+def run_measurements(
+    circuit:Circuit,
+    measurements:Sequence[Measurement],
+    step_time:float,
+    end_time:float,
+    simulator_kwargs:Optional[Dict[str, Any]]=None,
+    spice_command:str=SPICE_COMMAND,
+) -> Dict[str, float]:
+    """
+    Run a transient with the measurements done by ngspice (`.meas`),
+    so only the scalars come back rather than the full waveforms.
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit object (left unchanged).
+        measurements (Sequence[Measurement]):
+            The measurements.
+        step_time (float):
+            Transient step time.
+        end_time (float):
+            Transient end time.
+        simulator_kwargs (dict):
+            Keyword arguments as passed to `circuit.simulator()`.
+        spice_command (str):
+            ngspice executable.
+
+    Returns:
+        dict: measurement name (lower case) to value
+    """
+    raw_spice = circuit.raw_spice
+    try:
+        add_measurements(circuit, measurements)
+        deck = render_netlist(
+            circuit,
+            'transient',
+            dict(step_time=step_time, end_time=end_time),
+            simulator_kwargs or DEFAULT_SIMULATOR_KWARGS,
+        )
+    finally:
+        circuit.raw_spice = raw_spice
+
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, 'meas.cir'), 'w') as f:
+            f.write(deck)
+        process = subprocess.run(
+            (spice_command, '-b', 'meas.cir'),
+            cwd=workdir,
+            capture_output=True,
+        )
+    output = process.stdout.decode('utf-8', 'replace')
+    if process.returncode != 0:
+        raise NameError('Measurement run failed, ngspice returned:' + os.linesep +
+                        output + process.stderr.decode('utf-8', 'replace'))
+    return parse_meas_output(output, [m.name for m in measurements])
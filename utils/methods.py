@@ -3,7 +3,12 @@ import os
 from typing import List, Dict, Optional
 
 import PySpice
+import PySpice.Probe.WaveForm
 from PySpice.Spice.Netlist import Circuit
+from PySpice.Spice.Simulation import CircuitSimulation
+from PySpice.Spice.NgSpice.Simulation import NgSpiceCircuitSimulator
+
+from utils.outputs import output_filter, output_key
 
 
 
@@ -21,6 +26,7 @@ def cast_waveform(waveform) -> np.ndarray|float:
 def format_analysis(
     analysis,
     cast:bool=True,
+    vectors:Optional[List[str]]=None,
 ) -> Dict[str|int, np.ndarray|float|PySpice.Probe.WaveForm.WaveForm]:
     '''
     Extracts dictionary containing SPICE sim values.
@@ -32,6 +38,8 @@ def format_analysis(
         cast (bool):
             Whether to convert waveform outputs to
             single float value or numpy array.
+        vectors (List[str]):
+            Nodes to include (e.g. ['n3']), or None for all.
 
     Returns:
         dict: analysis results dictionary
@@ -41,9 +49,12 @@ def format_analysis(
         raise ValueError('Must pass a completed analysis')
 
     res = {}
+    wanted = output_filter(vectors)
 
     # Include node voltagess
     for node, waveform in analysis.nodes.items():
+        if wanted is not None and output_key(node) not in wanted:
+            continue
         res[node] = cast_waveform(waveform) if cast else waveform
 
     # Include time if it exists
@@ -76,3 +87,39 @@ def write_line_to_netlist(
     circuit.raw_spice += new_line + os.linesep
     return circuit
 
+
+def render_netlist(
+    circuit:Circuit,
+    analysis:Optional[str]=None,
+    analysis_kwargs:Optional[Dict]=None,
+    simulator_kwargs:Optional[Dict]=None,
+    pipe:bool=False,
+) -> str:
+    """
+    Render the full ngspice deck for a circuit: the netlist, simulator
+    options (e.g. temperature) and the analysis line, without running it.
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit object.
+        analysis (str):
+            Analysis method name, e.g. 'transient', or None to omit it.
+        analysis_kwargs (dict):
+            Keyword arguments of the analysis, e.g. step_time.
+        simulator_kwargs (dict):
+            Keyword arguments as passed to `circuit.simulator()`.
+        pipe (bool):
+            Whether to add the options used by ngspice server mode
+            (as the 'ngspice-subprocess' simulator does).
+
+    Returns:
+        str: the SPICE deck
+    """
+    simulator_kwargs = dict(simulator_kwargs or {})
+    simulator_kwargs.pop('simulator', None)
+
+    simulation = NgSpiceCircuitSimulator(circuit, pipe=pipe, **simulator_kwargs)
+    if analysis is not None:
+        getattr(CircuitSimulation, analysis)(simulation, **(analysis_kwargs or {}))
+    return str(simulation)
+
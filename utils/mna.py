@@ -0,0 +1,391 @@
+import numpy as np
+import re
+from typing import List, Dict, Optional, Sequence, Tuple
+
+import scipy.sparse
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Spice.BasicElement import Resistor, Capacitor, Inductor, VoltageSource, CurrentSource
+
+from utils.methods import cast_waveform
+
+
+
+GROUND = '0'
+
+# SPICE scale factors, longest first so 'meg' is not read as 'm'
+SPICE_SCALES = (
+    ('meg', 1e6), ('mil', 25.4e-6), ('t', 1e12), ('g', 1e9), ('k', 1e3),
+    ('m', 1e-3), ('u', 1e-6), ('n', 1e-9), ('p', 1e-12), ('f', 1e-15),
+)
+
+SPICE_NUMBER_PATTERN = re.compile(r'^([+-]?(?:\d+\.?\d*|\.\d+)(?:e[+-]?\d+)?)([a-z]*)$')
+
+AC_VARIATIONS = ('dec', 'oct', 'lin')
+
+
+def spice_value(value) -> float:
+    """
+    Convert a PySpice value (a UnitValue, a number or a SPICE number
+    string such as '4.7k' or '10meg') to a float.
+    """
+    if not isinstance(value, str):
+        return float(value)
+    match = SPICE_NUMBER_PATTERN.match(value.strip().lower())
+    if match is None:
+        raise ValueError(f'Cannot read the SPICE value {value!r}')
+    number, suffix = match.groups()
+    for scale, factor in SPICE_SCALES:
+        if suffix.startswith(scale):
+            return float(number) * factor
+    return float(number)  # unit only, e.g. '5v'
+
+
+def source_values(element:VoltageSource|CurrentSource) -> Tuple[float, complex]:
+    """
+    DC value and AC phasor of an independent source.
+
+    High level sources (e.g. SinusoidalVoltageSource) are written with
+    an explicit `DC dc_offset` (and `AC ac_magnitude` for sinusoids), which
+    is what ngspice uses for the operating point and AC analyses. Plain
+    sources hold either a value or a 'DC x AC mag phase' string.
+
+    Returns:
+        tuple: (dc value, ac phasor)
+    """
+    if hasattr(element, 'dc_offset'):
+        ac = getattr(element, 'ac_magnitude', 0)
+        return spice_value(element.dc_offset), complex(spice_value(ac))
+
+    value = element.dc_value
+    if not isinstance(value, str):
+        return spice_value(value), 0j
+
+    dc, ac = 0.0, 0j
+    tokens = value.replace('(', ' ').replace(')', ' ').split()
+    i = 0
+    while i < len(tokens):
+        token = tokens[i].lower()
+        if token == 'dc':
+            dc = spice_value(tokens[i+1])
+            i += 2
+        elif token == 'ac':
+            magnitude = spice_value(tokens[i+1]) if i + 1 < len(tokens) else 1.0
+            angle = 0.0
+            if i + 2 < len(tokens) and SPICE_NUMBER_PATTERN.match(tokens[i+2].lower()):
+                angle = spice_value(tokens[i+2])
+                i += 1
+            ac = magnitude * np.exp(1j * np.deg2rad(angle))
+            i += 2
+        elif i == 0 and SPICE_NUMBER_PATTERN.match(token):
+            dc = spice_value(token)
+            i += 1
+        else:
+            break  # a transient function, e.g. SIN(...), has no DC or AC part
+    return dc, ac
+
+
+def element_scale(element) -> Tuple[float, float]:
+    """ The (multiplier, scale) instance parameters of an R, C or L, defaulting to 1. """
+    multiplier = getattr(element, 'multiplier', None)
+    scale = getattr(element, 'scale', None)
+    return (1.0 if multiplier is None else spice_value(multiplier),
+            1.0 if scale is None else spice_value(scale))
+
+
+def ac_frequencies(
+    start_frequency:float,
+    stop_frequency:float,
+    number_of_points:int,
+    variation:str='dec',
+) -> np.ndarray:
+    """
+    The frequency points of an ngspice `.ac` line.
+
+    Args:
+        start_frequency (float):
+            First frequency.
+        stop_frequency (float):
+            Last frequency (included if on the grid).
+        number_of_points (int):
+            Points per decade ('dec') or octave ('oct'), or in total ('lin').
+        variation (str):
+            'dec', 'oct' or 'lin'.
+
+    Returns:
+        np.ndarray: frequencies in Hz
+    """
+    start, stop = spice_value(start_frequency), spice_value(stop_frequency)
+    if variation == 'lin':
+        return np.linspace(start, stop, int(number_of_points))
+    if variation not in AC_VARIATIONS:
+        raise ValueError(f'Unknown variation {variation}, must be one of {AC_VARIATIONS}')
+    base = 10.0 if variation == 'dec' else 2.0
+    n_steps = int(np.floor(np.log(stop / start) / np.log(base) * number_of_points + 1e-9))
+    return start * base ** (np.arange(n_steps + 1) / number_of_points)
+
+
+def sweep_values(values:slice|Sequence[float]|np.ndarray) -> np.ndarray:
+    """
+    Values of a DC sweep, given as in PySpice (`slice(start, stop, step)`,
+    stop included) or as an explicit sequence.
+    """
+    if isinstance(values, slice):
+        start, stop, step = (spice_value(v) for v in (values.start, values.stop, values.step))
+        return start + step * np.arange(int(np.floor((stop - start) / step + 1e-9)) + 1)
+    return np.array([spice_value(v) for v in values], dtype=np.float64)
+
+
+class MNASystem:
+    """
+    Modified nodal analysis of a linear circuit, solved with NumPy
+    in process, without ngspice.
+
+    The circuit's R, C, L, V and I elements are stamped once into sparse
+    conductance (G) and susceptance (C) matrices, over the node voltages
+    and the currents of the voltage sources and inductors:
+
+        (G + j*2*pi*f*C) x = b
+
+    An AC analysis solves this for every frequency in one batched
+    `np.linalg.solve` over a stacked (n_freq, n, n) system, and a DC sweep
+    of a source solves one factorisation for every value at once. The
+    analyses mirror the PySpice simulator's, and return the node voltages
+    as `format_analysis` does.
+
+    Example:
+        system = MNASystem(circuit)
+        res = system.ac(start_frequency=1, stop_frequency=1e6, number_of_points=100, variation='dec')
+        res['n2'], res['frequency']
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit with only R, C, L, V and I elements.
+        gmin (float):
+            Conductance added from every node to ground, keeps nodes
+            only connected through capacitors solvable at DC.
+    """
+
+    def __init__(
+        self,
+        circuit:Circuit,
+        gmin:float=0.0,
+    ):
+        self.title = circuit.title
+        self.gmin = gmin
+
+        # Unknowns: the node voltages (in order of appearance), then the branch currents
+        self.nodes: List[str] = []
+        self.branches: List[str] = []
+        elements = list(circuit.elements)
+        self.node_index: Dict[str, int] = {}
+        for element in elements:
+            for name in self.element_nodes(element):
+                if name != GROUND and name not in self.node_index:
+                    self.node_index[name] = len(self.nodes)
+                    self.nodes.append(name)
+
+        g_triplets, c_triplets = [], []
+        self.sources: Dict[str, Tuple[str, List[Tuple[int, float]], float, complex]] = {}
+        for element in elements:
+            self.stamp(element, g_triplets, c_triplets)
+
+        for i in range(len(self.nodes) if gmin else 0):
+            g_triplets.append((i, i, gmin))
+
+        # The stamps are kept, (rows, cols, values), for solvers reusing their pattern
+        self.g_stamps = self.stamp_arrays(g_triplets)
+        self.c_stamps = self.stamp_arrays(c_triplets)
+        self.G = self.assemble(self.g_stamps)
+        self.C = self.assemble(self.c_stamps)
+
+    def element_nodes(self, element) -> List[str]:
+        """ Nodes of an element, including any internal node it adds (named 'element#node'). """
+        return [str(node).lower() for node in element.nodes]
+
+    def stamp(
+        self,
+        element,
+        g_triplets:List[Tuple[int, int, float]],
+        c_triplets:List[Tuple[int, int, float]],
+    ):
+        """
+        Stamp one element into the G and C triplets, or register it as a source.
+        Subclasses extend this to support more elements.
+        """
+        a, b = (self.index(node) for node in element.nodes)
+        if isinstance(element, Resistor):
+            multiplier, scale = element_scale(element)
+            self.stamp_admittance(g_triplets, a, b, multiplier / (spice_value(element.resistance) * scale))
+        elif isinstance(element, Capacitor):
+            multiplier, scale = element_scale(element)
+            self.stamp_admittance(c_triplets, a, b, multiplier * spice_value(element.capacitance) * scale)
+        elif isinstance(element, Inductor):
+            multiplier, scale = element_scale(element)
+            k = self.add_branch(g_triplets, element.name, a, b)
+            c_triplets.append((k, k, -spice_value(element.inductance) * scale / multiplier))
+        elif isinstance(element, VoltageSource):
+            k = self.add_branch(g_triplets, element.name, a, b)
+            self.sources[element.name.lower()] = (element.name, [(k, 1.0)], *source_values(element))
+        elif isinstance(element, CurrentSource):
+            # Current flows from the plus node, through the source, to the minus node
+            self.sources[element.name.lower()] = (element.name, [(a, -1.0), (b, 1.0)], *source_values(element))
+        else:
+            raise ValueError(f'Element {element.name} ({type(element).__name__}) is not supported '
+                             f'by {type(self).__name__}')
+
+    @property
+    def size(self) -> int:
+        """ Number of unknowns: node voltages and branch currents. """
+        return len(self.nodes) + len(self.branches)
+
+    def index(self, node) -> int:
+        """ Row of a node, or -1 for ground. """
+        name = str(node).lower()
+        return -1 if name == GROUND else self.node_index[name]
+
+    @staticmethod
+    def stamp_admittance(triplets:List[Tuple[int, int, float]], a:int, b:int, y:float):
+        for i, j, sign in ((a, a, 1), (b, b, 1), (a, b, -1), (b, a, -1)):
+            if i >= 0 and j >= 0:
+                triplets.append((i, j, sign * y))
+
+    def add_branch(self, triplets:List[Tuple[int, int, float]], name:str, a:int, b:int) -> int:
+        """ Add the current of a voltage defined branch (V or L) as an unknown, return its row. """
+        # Every node is numbered before stamping, so branch rows follow them
+        k = len(self.nodes) + len(self.branches)
+        self.branches.append(name)
+        for node, sign in ((a, 1.0), (b, -1.0)):
+            if node >= 0:
+                triplets.append((node, k, sign))
+                triplets.append((k, node, sign))
+        return k
+
+    @staticmethod
+    def stamp_arrays(triplets:List[Tuple[int, int, float]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Stamped (row, col, value) triplets as row, column and value arrays. """
+        if not triplets:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        rows, cols, values = zip(*triplets)
+        return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64), np.array(values, dtype=np.float64)
+
+    def assemble(self, stamps:Tuple[np.ndarray, np.ndarray, np.ndarray]) -> scipy.sparse.csr_array:
+        """ Sum stamp arrays into a sparse matrix, see `stamp_arrays`. """
+        rows, cols, values = stamps
+        return scipy.sparse.coo_array((values, (rows, cols)), shape=(self.size, self.size)).tocsr()
+
+    def rhs(self, ac:bool=False, overrides:Optional[Dict[str, float]]=None) -> np.ndarray:
+        """
+        Right hand side of the system, from the DC values (or AC phasors) of the sources.
+
+        Args:
+            ac (bool):
+                Use the AC phasors rather than the DC values.
+            overrides (dict):
+                Source name to DC value, replacing the circuit's.
+
+        Returns:
+            np.ndarray: (n,) right hand side
+        """
+        b = np.zeros(self.size, dtype=np.complex128 if ac else np.float64)
+        overrides = {k.lower(): v for k, v in (overrides or {}).items()}
+        for key, (_, rows, dc, phasor) in self.sources.items():
+            value = phasor if ac else overrides.get(key, dc)
+            for i, sign in rows:
+                if i >= 0:
+                    b[i] += sign * value
+        return b
+
+    def source_pattern(self, source:str) -> np.ndarray:
+        """ Right hand side of a unit value of one source. """
+        key = source.lower()
+        if key not in self.sources:
+            raise KeyError(f'No independent source {source} in the circuit')
+        b = np.zeros(self.size)
+        for i, sign in self.sources[key][1]:
+            if i >= 0:
+                b[i] += sign
+        return b
+
+    def solve(self, A:np.ndarray, b:np.ndarray) -> np.ndarray:
+        try:
+            return np.linalg.solve(A, b)
+        except np.linalg.LinAlgError as e:
+            raise NameError('Simulation failed, the MNA matrix is singular '
+                            '(a floating node, or a loop of voltage sources and inductors?)') from e
+
+    def solve_dc(self, B:np.ndarray) -> np.ndarray:
+        """ Solve the DC system G x = B, for one (n,) or many (n, k) right hand sides. """
+        return self.solve(self.G.toarray(), B)
+
+    def format_solution(self, x:np.ndarray, cast:bool=True) -> Dict[str, np.ndarray|float]:
+        """ Node voltages of solutions (n, ...) as a results dictionary. """
+        res = {}
+        for node, i in self.node_index.items():
+            if '#' in node:
+                continue  # internal node of a device, not reported by ngspice either
+            res[node] = cast_waveform(x[i]) if cast else x[i]
+        return res
+
+    def operating_point(self, cast:bool=True) -> Dict[str, np.ndarray|float]:
+        """
+        DC operating point: capacitors open, inductors shorted.
+
+        Returns:
+            dict: node voltages, as `format_analysis`
+        """
+        x = self.solve_dc(self.rhs())
+        return self.format_solution(x[:, np.newaxis], cast)
+
+    def dc(self, **kwargs) -> Dict[str, np.ndarray|float]:
+        """
+        DC sweep of one independent source, e.g. `dc(Vinput=slice(-3, 3, 0.1))`.
+        The matrix does not depend on the source, so every value is solved
+        at once as a (n, n_values) right hand side.
+
+        Returns:
+            dict: node voltages (n_values,), as `format_analysis`
+        """
+        if len(kwargs) != 1:
+            raise ValueError('Sweep exactly one source, e.g. dc(Vinput=slice(-3, 3, 0.1))')
+        (source, values), = kwargs.items()
+        values = sweep_values(values)
+        base = self.rhs(overrides={source: 0.0})
+        B = base[:, np.newaxis] + self.source_pattern(source)[:, np.newaxis] * values[np.newaxis, :]
+        return self.format_solution(self.solve_dc(B), cast=False)
+
+    def solve_ac(self, frequency:np.ndarray) -> np.ndarray:
+        """
+        Solve the AC system at every frequency, as one batched solve.
+
+        Args:
+            frequency (np.ndarray):
+                Frequencies in Hz (n_freq,).
+
+        Returns:
+            np.ndarray: complex solution (n, n_freq)
+        """
+        omega = 2 * np.pi * np.asarray(frequency, dtype=np.float64)
+        A = self.G.toarray()[np.newaxis] + 1j * omega[:, np.newaxis, np.newaxis] * self.C.toarray()[np.newaxis]
+        b = np.broadcast_to(self.rhs(ac=True)[:, np.newaxis], (len(omega), self.size, 1))
+        return self.solve(A, b)[..., 0].T
+
+    def ac(
+        self,
+        start_frequency:float,
+        stop_frequency:float,
+        number_of_points:int,
+        variation:str='dec',
+    ) -> Dict[str, np.ndarray]:
+        """
+        Small signal AC analysis, as `simulator.ac`.
+
+        Returns:
+            dict: complex node voltages (n_freq,) and 'frequency', as `format_analysis`
+        """
+        frequency = ac_frequencies(start_frequency, stop_frequency, number_of_points, variation)
+        res = self.format_solution(self.solve_ac(frequency), cast=False)
+        res['frequency'] = frequency
+        return res
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.title!r}, {len(self.nodes)} nodes, {len(self.branches)} branches)'
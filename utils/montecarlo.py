@@ -0,0 +1,527 @@
+import numpy as np
+import itertools
+import math
+import os
+from dataclasses import dataclass
+from multiprocessing import Pool
+from typing import List, Dict, Optional, Any, Callable, Iterator, Sequence
+
+from scipy.special import ndtri
+from PySpice.Spice.Netlist import Circuit
+
+from utils.batch import analysis_command, control_sweep_lines, insert_control_block, run_batched_deck
+from utils.measure import Measurement, WaveformBatch, measure
+from utils.methods import render_netlist
+from utils.pool import WarmSimulatorPool
+from utils.sweep import DEFAULT_SIMULATOR_KWARGS
+from utils.template import resolve_slot
+
+
+
+DISTRIBUTIONS = ('normal', 'uniform', 'lognormal')
+
+SAMPLING_METHODS = ('random', 'lhs')
+
+BACKENDS = ('batch', 'pool')
+
+# Keeps the normal quantile finite for samples at 0 or 1
+QUANTILE_EPSILON = 1e-12
+
+
+@dataclass
+class Tolerance:
+    """
+    Statistical spread of one component or model parameter.
+
+    Keys follow `utils.pool.alter_commands`, e.g. 'R1' or 'MyDiode.IS'.
+
+    Args:
+        tolerance (float):
+            Relative tolerance, e.g. 0.05 for 5%.
+        kind (str):
+            'normal' (the tolerance is `sigmas` standard deviations),
+            'uniform' (within +/- the tolerance) or 'lognormal'
+            (normal in log space, so the value stays positive, e.g. for IS).
+        nominal (float):
+            Nominal value, defaults to the value in the circuit.
+        sigmas (float):
+            Number of standard deviations the tolerance covers,
+            for the normal and lognormal distributions.
+    """
+    tolerance: float
+    kind: str = 'normal'
+    nominal: Optional[float] = None
+    sigmas: float = 3.0
+
+    def __post_init__(self):
+        if self.kind not in DISTRIBUTIONS:
+            raise ValueError(f'Unknown distribution {self.kind}, must be one of {DISTRIBUTIONS}')
+
+    def ppf(self, u:np.ndarray) -> np.ndarray:
+        """
+        Map uniform [0, 1) samples to parameter values (inverse CDF),
+        so random and Latin hypercube samples are drawn the same way.
+        """
+        u = np.asarray(u, dtype=np.float64)
+        if self.kind == 'uniform':
+            return self.nominal * (1 + self.tolerance * (2 * u - 1))
+        z = ndtri(np.clip(u, QUANTILE_EPSILON, 1 - QUANTILE_EPSILON))
+        if self.kind == 'normal':
+            return self.nominal * (1 + self.tolerance / self.sigmas * z)
+        return self.nominal * np.exp(np.log1p(self.tolerance) / self.sigmas * z)
+
+    def corners(self) -> List[float]:
+        """ Low and high corner values. """
+        if self.kind == 'lognormal':
+            return [self.nominal / (1 + self.tolerance), self.nominal * (1 + self.tolerance)]
+        return [self.nominal * (1 - self.tolerance), self.nominal * (1 + self.tolerance)]
+
+
+def nominal_value(circuit:Circuit, key:str) -> float:
+    """
+    Value of an element or model parameter in a circuit, e.g. 'R1' or 'MyDiode.IS'.
+    """
+    kind, obj, attribute = resolve_slot(circuit, key)
+    value = obj._parameters[attribute] if kind == 'model' else getattr(obj, attribute)
+    return float(value)
+
+
+def resolve_nominals(
+    circuit:Circuit,
+    tolerances:Dict[str, Tolerance],
+) -> Dict[str, Tolerance]:
+    """
+    Fill in the nominal value of every tolerance from the circuit, where not given.
+    """
+    return {
+        key: t if t.nominal is not None else Tolerance(t.tolerance, t.kind, nominal_value(circuit, key), t.sigmas)
+        for key, t in tolerances.items()
+    }
+
+
+def unit_samples(
+    n_samples:int,
+    n_parameters:int,
+    rng:np.random.Generator,
+    method:str='random',
+) -> np.ndarray:
+    """
+    Uniform [0, 1) samples, of shape (n_samples, n_parameters).
+
+    Args:
+        n_samples (int):
+            Number of samples.
+        n_parameters (int):
+            Number of parameters.
+        rng (np.random.Generator):
+            Random generator.
+        method (str):
+            'random', or 'lhs' for a Latin hypercube: each parameter's
+            range is split into n_samples equal strata, with exactly one
+            sample in each, which covers the tails with fewer samples.
+
+    Returns:
+        np.ndarray: samples
+    """
+    if method == 'random':
+        return rng.random((n_samples, n_parameters))
+    if method == 'lhs':
+        strata = rng.permuted(np.tile(np.arange(n_samples), (n_parameters, 1)), axis=1).T
+        return (strata + rng.random((n_samples, n_parameters))) / n_samples
+    raise ValueError(f'Unknown sampling method {method}, must be one of {SAMPLING_METHODS}')
+
+
+def sample_parameters(
+    tolerances:Dict[str, Tolerance],
+    n_samples:int,
+    rng:np.random.Generator,
+    method:str='random',
+) -> Dict[str, np.ndarray]:
+    """
+    Draw parameter samples.
+
+    Args:
+        tolerances (dict):
+            Parameter key to Tolerance, with the nominal values set.
+        n_samples (int):
+            Number of samples.
+        rng (np.random.Generator):
+            Random generator.
+        method (str):
+            'random' or 'lhs', see `unit_samples`.
+
+    Returns:
+        dict: parameter key to (n_samples,) values
+    """
+    u = unit_samples(n_samples, len(tolerances), rng, method)
+    return {key: t.ppf(u[:, i]) for i, (key, t) in enumerate(tolerances.items())}
+
+
+def corner_points(
+    tolerances:Dict[str, Tolerance],
+    include_nominal:bool=True,
+) -> List[Dict[str, float]]:
+    """
+    Every combination of the low and high corners (2**n_parameters points).
+
+    Args:
+        tolerances (dict):
+            Parameter key to Tolerance, with the nominal values set.
+        include_nominal (bool):
+            Add the nominal point first.
+
+    Returns:
+        list: one {parameter key: value} dictionary per corner
+    """
+    keys = list(tolerances)
+    points = [dict(zip(keys, values)) for values in itertools.product(*(tolerances[k].corners() for k in keys))]
+    if include_nominal:
+        points.insert(0, {key: t.nominal for key, t in tolerances.items()})
+    return points
+
+
+class RunningStatistics:
+    """
+    Statistics of a stream of values, updated one batch at a time,
+    so the values themselves never need to be kept.
+
+    The mean and variance are merged batch by batch (Chan et al.), which
+    stays accurate over many batches. Percentiles are estimated from a
+    fixed-bin histogram, whose range is set from the first batch
+    (widened by `margin` on both sides); values outside it are counted
+    in the edge bins' under/overflow and clamp the percentiles to the range.
+
+    Args:
+        bins (int):
+            Number of histogram bins.
+        range (tuple):
+            Histogram (low, high), defaults to the range of the first batch.
+        margin (float):
+            Widening of the first batch's range, relative to its width.
+    """
+
+    def __init__(
+        self,
+        bins:int=200,
+        range:Optional[Sequence[float]]=None,
+        margin:float=0.5,
+    ):
+        self.bins = bins
+        self.margin = margin
+        self.edges = np.linspace(range[0], range[1], bins + 1) if range is not None else None
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+        self.count = 0
+        self.failed = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values:np.ndarray):
+        """ Add a batch of values, non-finite values are counted as failed. """
+        values = np.ravel(np.asarray(values, dtype=np.float64))
+        finite = np.isfinite(values)
+        self.failed += int((~finite).sum())
+        values = values[finite]
+        n = len(values)
+        if n == 0:
+            return
+
+        if self.edges is None:
+            low, high = values.min(), values.max()
+            width = (high - low) or abs(low) or 1.0
+            self.edges = np.linspace(low - self.margin * width, high + self.margin * width, self.bins + 1)
+
+        # Merge the batch mean and sum of squared deviations
+        mean = float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        self.underflow += int((values < self.edges[0]).sum())
+        self.overflow += int((values > self.edges[-1]).sum())
+        self.counts += np.histogram(values, self.edges)[0]
+
+    @property
+    def std(self) -> float:
+        """ Sample standard deviation. """
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else float('nan')
+
+    def percentile(self, q:float|Sequence[float]) -> np.ndarray:
+        """
+        Estimate percentiles (0 to 100) from the histogram,
+        interpolating linearly within a bin.
+        """
+        if self.count == 0:
+            return np.full(np.shape(q), np.nan)
+        cumulative = np.concatenate([[self.underflow], self.underflow + np.cumsum(self.counts)])
+        target = np.asarray(q, dtype=np.float64) / 100 * self.count
+        return np.interp(target, cumulative, self.edges)
+
+    def summary(self, percentiles:Sequence[float]=(1, 5, 50, 95, 99)) -> Dict[str, float]:
+        """
+        Returns:
+            dict: count, failed, mean, std, min, max and the percentiles (e.g. 'p95')
+        """
+        res = {
+            'count': self.count,
+            'failed': self.failed,
+            'mean': self.mean if self.count else float('nan'),
+            'std': self.std,
+            'min': self.min,
+            'max': self.max,
+        }
+        for q, value in zip(percentiles, self.percentile(percentiles)):
+            res[f'p{q:g}'] = float(value)
+        return res
+
+
+# Monte Carlo definition held by each pool worker, set once by the initializer
+_worker_monte_carlo = None
+
+
+def _init_worker(monte_carlo:'MonteCarlo'):
+    global _worker_monte_carlo
+    _worker_monte_carlo = monte_carlo
+
+
+def _run_worker_chunk(task) -> Dict[str, np.ndarray]:
+    index, n_samples = task
+    return _worker_monte_carlo.run_chunk(index, n_samples)
+
+
+class MonteCarlo:
+    """
+    Monte Carlo tolerance analysis of a circuit's component and model parameters.
+
+    Samples are drawn, simulated and reduced to scalar metrics one chunk
+    at a time; only the metrics' running statistics are kept, so the memory
+    used does not grow with the number of samples.
+
+    The 'batch' backend runs each chunk as one batched ngspice sweep
+    (see `utils.batch.run_batched_sweep`), with the chunks spread over a
+    process pool; each worker returns only the chunk's metrics. The netlist
+    is rendered once, so the workers are sent it rather than the Circuit.
+    The 'pool' backend runs the points on warm ngspice sessions
+    (`utils.pool.WarmSimulatorPool`) and reduces them in this process.
+
+    Chunk i is always drawn from the i-th child of the seed, so the samples
+    (and results) do not depend on the number of processes. With 'lhs',
+    each chunk is its own Latin hypercube.
+
+    Example:
+        mc = MonteCarlo(build_circuit(10), {'MyDiode.IS': Tolerance(0.2, 'lognormal'),
+                                            'R1': Tolerance(0.05)},
+                        'transient', dict(step_time=0.0001, end_time=0.1),
+                        metrics=[Measurement('peak', 'max', 'n3')], seed=1234)
+        stats = mc.run(10000)
+        stats['peak'].summary()
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit, with the nominal parameter values.
+        tolerances (dict):
+            Parameter key (e.g. 'R1', 'MyDiode.IS') to Tolerance.
+        analysis (str):
+            Analysis method name, e.g. 'transient'.
+        analysis_kwargs (dict):
+            Keyword arguments of the analysis.
+        metrics (Sequence[Measurement] | Callable):
+            Transient measurements (see `utils.measure`), or a module level
+            function returning {metric name: (n_points,) array} from a chunk's
+            results: the stacked arrays of `run_batched_sweep` ('batch'),
+            or the list of SweepPoints ('pool').
+        vectors (Sequence[str]):
+            Vectors to save, defaults to the nodes of the measurements.
+        method (str):
+            'random' or 'lhs' sampling.
+        seed (int):
+            Root seed, for reproducible samples.
+        chunk_size (int):
+            Number of samples simulated and reduced at a time.
+        backend (str):
+            'batch' or 'pool'.
+        processes (int):
+            Number of worker processes, defaults to the number of CPUs.
+        simulator_kwargs (dict):
+            Keyword arguments as passed to `circuit.simulator()`.
+        bins (int):
+            Number of histogram bins of each metric.
+    """
+
+    def __init__(
+        self,
+        circuit:Circuit,
+        tolerances:Dict[str, Tolerance],
+        analysis:str='transient',
+        analysis_kwargs:Optional[Dict[str, Any]]=None,
+        metrics:Sequence[Measurement]|Callable=(),
+        vectors:Optional[Sequence[str]]=None,
+        method:str='random',
+        seed:Optional[int]=None,
+        chunk_size:int=1000,
+        backend:str='batch',
+        processes:Optional[int]=None,
+        simulator_kwargs:Optional[Dict[str, Any]]=None,
+        bins:int=200,
+    ):
+        if method not in SAMPLING_METHODS:
+            raise ValueError(f'Unknown sampling method {method}, must be one of {SAMPLING_METHODS}')
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown backend {backend}, must be one of {BACKENDS}')
+
+        self.circuit = circuit
+        self.tolerances = resolve_nominals(circuit, tolerances)
+        self.analysis = analysis
+        self.analysis_kwargs = dict(analysis_kwargs or {})
+        self.metrics = metrics
+        if vectors is None and not callable(metrics):
+            vectors = sorted({m.node for m in metrics}) or None
+        self.vectors = list(vectors) if vectors else None
+        self.method = method
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.chunk_size = chunk_size
+        self.backend = backend
+        self.processes = processes or os.cpu_count() or 1
+        self.simulator_kwargs = simulator_kwargs
+        self.bins = bins
+
+        # Rendered once, for the 'batch' backend workers
+        self.netlist = render_netlist(circuit, simulator_kwargs=simulator_kwargs or DEFAULT_SIMULATOR_KWARGS)
+        self.command = analysis_command(circuit, analysis, self.analysis_kwargs)
+        self.model_names = list(circuit.model_names)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Sent to the 'batch' workers, which only need the rendered netlist
+        # (a PySpice Circuit pickles, but does not unpickle)
+        state = self.__dict__.copy()
+        state['circuit'] = None
+        return state
+
+    def chunk_samples(self, index:int, n_samples:Optional[int]=None) -> Dict[str, np.ndarray]:
+        """
+        Parameter samples of chunk `index`, drawn from its own child seed.
+        """
+        seed = np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=(index,))
+        rng = np.random.default_rng(seed)
+        return sample_parameters(self.tolerances, n_samples or self.chunk_size, rng, self.method)
+
+    def reduce(self, results) -> Dict[str, np.ndarray]:
+        """ Reduce a chunk's results to {metric name: (n_points,) array}. """
+        if callable(self.metrics):
+            return self.metrics(results)
+        if isinstance(results, dict):
+            results = WaveformBatch.from_arrays(results['time'], {v: results[v] for v in self.vectors})
+        return measure(results, self.metrics)
+
+    def simulate(self, parameters:Dict[str, np.ndarray], pool:Optional[WarmSimulatorPool]=None) -> Dict[str, np.ndarray]:
+        """
+        Simulate one set of parameter values and reduce it to metrics.
+
+        Args:
+            parameters (dict):
+                Parameter key to (n_points,) values.
+            pool (WarmSimulatorPool):
+                Pool of the 'pool' backend.
+
+        Returns:
+            dict: metric name to (n_points,) array
+        """
+        keys = list(parameters)
+        points = [dict(zip(keys, values)) for values in zip(*parameters.values())]
+        if pool is not None:
+            return self.reduce(pool.map(points))
+
+        lines = control_sweep_lines(
+            points,
+            self.command,
+            'sweep.raw',
+            vectors=self.vectors,
+            model_names=self.model_names,
+            linearize=(self.analysis == 'transient'),
+        )
+        results = run_batched_deck(insert_control_block(self.netlist, lines), len(points), 'sweep.raw')
+        return self.reduce(results)
+
+    def run_chunk(self, index:int, n_samples:Optional[int]=None) -> Dict[str, np.ndarray]:
+        """ Sample, simulate and reduce chunk `index` with the 'batch' backend. """
+        return self.simulate(self.chunk_samples(index, n_samples))
+
+    def imap(self, n_samples:int) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Lazily yield the metrics of each chunk, in order.
+
+        Args:
+            n_samples (int):
+                Total number of samples.
+        """
+        tasks = [(index, min(self.chunk_size, n_samples - start))
+                 for index, start in enumerate(range(0, n_samples, self.chunk_size))]
+
+        if self.backend == 'pool':
+            with WarmSimulatorPool(self.circuit, self.analysis, self.analysis_kwargs, self.simulator_kwargs,
+                                   processes=self.processes, vectors=self.vectors) as pool:
+                for index, size in tasks:
+                    yield self.simulate(self.chunk_samples(index, size), pool)
+            return
+
+        if self.processes == 1 or len(tasks) == 1:
+            for task in tasks:
+                yield self.run_chunk(*task)
+            return
+
+        with Pool(min(self.processes, len(tasks)), initializer=_init_worker, initargs=(self,)) as p:
+            yield from p.imap(_run_worker_chunk, tasks)
+
+    def run(
+        self,
+        n_samples:int,
+        callback:Optional[Callable[[int, Dict[str, RunningStatistics]], Optional[bool]]]=None,
+    ) -> Dict[str, RunningStatistics]:
+        """
+        Run the Monte Carlo analysis.
+
+        Args:
+            n_samples (int):
+                Total number of samples.
+            callback (Callable):
+                Called as `callback(n_done, statistics)` after every chunk,
+                e.g. to report progress. If it returns True the run stops
+                early (e.g. on convergence), and the remaining chunks are not run.
+
+        Returns:
+            dict: metric name to RunningStatistics
+        """
+        statistics = {}
+        n_done = 0
+        for chunk in self.imap(n_samples):
+            for name, values in chunk.items():
+                statistics.setdefault(name, RunningStatistics(self.bins)).update(values)
+            n_done += len(next(iter(chunk.values()))) if chunk else 0
+            if callback is not None and callback(n_done, statistics):
+                break
+        return statistics
+
+    def run_corners(self, include_nominal:bool=True) -> Dict[str, Any]:
+        """
+        Simulate every corner of the tolerances (2**n_parameters points).
+
+        Returns:
+            dict: 'points' (the corner parameter values) and 'metrics' (name to array)
+        """
+        points = corner_points(self.tolerances, include_nominal)
+        parameters = {key: np.array([p[key] for p in points]) for key in self.tolerances}
+        if self.backend == 'pool':
+            with WarmSimulatorPool(self.circuit, self.analysis, self.analysis_kwargs, self.simulator_kwargs,
+                                   processes=self.processes, vectors=self.vectors) as pool:
+                metrics = self.simulate(parameters, pool)
+        else:
+            metrics = self.simulate(parameters)
+        return {'points': points, 'metrics': metrics}
@@ -0,0 +1,544 @@
+import numpy as np
+from typing import List, Dict, Optional, Any, Sequence, Tuple
+
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Spice.BasicElement import Diode
+
+from utils.mna import MNASystem, spice_value, sweep_values
+
+
+
+# Physical constants, as ngspice's
+BOLTZMANN = 1.38064852e-23
+CHARGE = 1.6021766208e-19
+KELVIN = 273.15
+
+# Diode model parameters supported, and their SPICE defaults
+DIODE_DEFAULTS = {'IS': 1e-14, 'N': 1.0, 'RS': 0.0, 'BV': np.inf, 'IBV': 1e-3}
+
+# Parameters with no effect on the DC solution at the nominal temperature
+DIODE_DC_IGNORED = ('CJO', 'CJ0', 'VJ', 'M', 'TT', 'FC', 'EG', 'XTI', 'KF', 'AF')
+
+# ngspice default options
+DEFAULT_OPTIONS = {
+    'gmin': 1e-12,      # conductance in parallel with every junction
+    'reltol': 1e-3,
+    'vntol': 1e-6,
+    'abstol': 1e-12,
+    'itl1': 100,        # Newton iterations of a DC solve
+    'itl4': 10,         # Newton iterations of a transient time step
+    'gminsteps': 10,
+    'srcsteps': 10,
+}
+
+# Beyond this exponent the exponential is continued linearly, so extreme
+# trial voltages stay finite without flattening the current
+MAX_EXPONENT = 300.0
+
+
+def thermal_voltage(temperature:float=25.0) -> float:
+    """ kT/q, in volts, at a temperature in Celsius. """
+    return BOLTZMANN * (temperature + KELVIN) / CHARGE
+
+
+def limited_exp(x:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ exp(x) and its derivative, continued linearly above `MAX_EXPONENT`. """
+    e = np.exp(np.minimum(x, MAX_EXPONENT))
+    with np.errstate(invalid='ignore'):  # x = -inf (no breakdown) only reaches the unused branch
+        return np.where(x > MAX_EXPONENT, e * (1 + x - MAX_EXPONENT), e), e
+
+
+def breakdown_voltage(
+    saturation_current:np.ndarray,
+    bv:np.ndarray,
+    ibv:np.ndarray,
+    vte:np.ndarray,
+    iterations:int=25,
+) -> np.ndarray:
+    """
+    Knee voltage of the reverse breakdown exponential, fitted (as ngspice
+    does) so the current at -BV is IBV.
+    """
+    small = ibv < saturation_current * bv / vte
+    cbv = np.where(small, saturation_current * bv / vte, ibv)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xbv = bv - vte * np.log(1 + cbv / saturation_current)
+        for _ in range(iterations):
+            xbv = bv - vte * np.log(np.maximum(cbv / saturation_current + 1 - xbv / vte, 1.0))
+    return np.where(small | ~np.isfinite(bv), bv, xbv)
+
+
+def diode_current(
+    vd:np.ndarray,
+    saturation_current:np.ndarray,
+    vte:np.ndarray,
+    breakdown:np.ndarray,
+    gmin:float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Shockley diode current and conductance, with ngspice's reverse bias and
+    breakdown regions, for arrays of junction voltages.
+
+    Args:
+        vd (np.ndarray):
+            Junction voltages.
+        saturation_current (np.ndarray):
+            IS.
+        vte (np.ndarray):
+            N times the thermal voltage.
+        breakdown (np.ndarray):
+            Breakdown knee voltage, see `breakdown_voltage` (inf for none).
+        gmin (float):
+            Conductance in parallel with the junction.
+
+    Returns:
+        tuple: current and its derivative (conductance)
+    """
+    forward = vd >= -3 * vte
+    reverse_breakdown = vd < -breakdown
+
+    evd, devd = limited_exp(vd / vte)
+    cd = saturation_current * (evd - 1)
+    gd = saturation_current * devd / vte
+
+    # Reverse bias: the current approaches -IS smoothly
+    vr = np.where(forward, -1.0, vd)
+    arg = (3 * vte / (vr * np.e)) ** 3
+    cd = np.where(forward, cd, -saturation_current * (1 + arg))
+    gd = np.where(forward, gd, saturation_current * 3 * arg / vr)
+
+    # Breakdown: a mirrored exponential beyond the knee
+    evrev, devrev = limited_exp(-(breakdown + vd) / vte)
+    cd = np.where(reverse_breakdown, -saturation_current * evrev, cd)
+    gd = np.where(reverse_breakdown, saturation_current * devrev / vte, gd)
+
+    return cd + gmin * vd, gd + gmin
+
+
+def limit_junction_voltage(
+    vnew:np.ndarray,
+    vold:np.ndarray,
+    vte:np.ndarray,
+    vcrit:np.ndarray,
+    breakdown:Optional[np.ndarray]=None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    SPICE `pnjlim`: damp the Newton update of junction voltages, so the
+    exponential is not evaluated far beyond where it was linearized.
+    Beyond the breakdown knee (see `breakdown_voltage`, inf for none) the
+    mirrored exponential is limited the same way, as ngspice does.
+
+    Returns:
+        tuple: limited voltages, and whether each was limited
+    """
+    if breakdown is not None:
+        knee = np.where(np.isfinite(breakdown), breakdown, 0.0)
+        reverse = np.isfinite(breakdown) & (vnew < np.minimum(0, -knee + 10 * vte))
+        mirrored, mirrored_limited = limit_junction_voltage(-(vnew + knee), -(vold + knee), vte, vcrit)
+        forward, forward_limited = limit_junction_voltage(vnew, vold, vte, vcrit)
+        return (np.where(reverse, -(mirrored + knee), forward),
+                np.where(reverse, mirrored_limited, forward_limited))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        step_up = (vnew > vcrit) & (np.abs(vnew - vold) > 2 * vte)
+        arg = 1 + (vnew - vold) / vte
+        up = np.where(vold > 0,
+                      np.where(arg > 0, vold + vte * np.log(arg), vcrit),
+                      vte * np.log(vnew / vte))
+        floor = np.where(vold > 0, -vold - 1, 2 * vold - 1)
+        step_down = ~step_up & (vnew < 0) & (vnew < floor)
+    limited = np.where(step_up, up, np.where(step_down, floor, vnew))
+    return limited, step_up | step_down
+
+
+class NewtonSystem(MNASystem):
+    """
+    Nonlinear DC solver for circuits of diodes and linear elements,
+    running Newton-Raphson for many points at once.
+
+    The linear part is stamped once, as in `MNASystem`. Each iteration
+    adds the linearized diodes (conductance and equivalent current) of
+    every point to a stacked (n_points, n, n) system, solved with one
+    batched `np.linalg.solve`. Junction voltages are limited as in SPICE,
+    and each point stops iterating once converged. Points which do not
+    converge fall back to gmin stepping, then to source stepping.
+
+    The points are the values of a DC sweep, and/or variants of the
+    diode model parameters (IS, N, RS, BV, IBV), e.g. for Monte Carlo.
+    Model parameters are used as given, at the nominal temperature.
+
+    Example:
+        system = NewtonSystem(circuit)
+        res = system.dc(Vinput=slice(-3, 3, 0.01))
+        res = system.dc({'MyDiode.IS': np.geomspace(1e-9, 1e-8, 1000)}, Vinput=slice(0, 5, 0.1))
+        res['2'].shape  # (1000, 51)
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit with only R, C, L, V, I and D elements.
+        temperature (float):
+            Circuit temperature, in Celsius.
+        options (dict):
+            Overrides of `DEFAULT_OPTIONS`.
+    """
+
+    def __init__(
+        self,
+        circuit:Circuit,
+        temperature:float=25.0,
+        options:Optional[Dict[str, Any]]=None,
+    ):
+        self.models = {name.lower(): {k.upper(): v for k, v in model._parameters.items()}
+                       for name, model in circuit._models.items()}
+        self.diodes: List[Dict[str, Any]] = []
+        self.vt = thermal_voltage(temperature)
+        self.options = {**DEFAULT_OPTIONS, **(options or {})}
+        super().__init__(circuit)
+        self.stats: Dict[str, int] = {}
+
+    def diode_model(self, name:str) -> Dict[str, float]:
+        """ Parameters of a diode model, with the SPICE defaults filled in. """
+        if name.lower() not in self.models:
+            raise KeyError(f'Undefined diode model {name}')
+        model = self.models[name.lower()]
+        unsupported = set(model) - set(DIODE_DEFAULTS) - set(DIODE_DC_IGNORED)
+        if unsupported:
+            raise ValueError(f'Diode model {name} parameters {sorted(unsupported)} '
+                             f'are not supported, only {list(DIODE_DEFAULTS)}')
+        return {k: spice_value(model[k]) if k in model else v for k, v in DIODE_DEFAULTS.items()}
+
+    def element_nodes(self, element) -> List[str]:
+        nodes = super().element_nodes(element)
+        if isinstance(element, Diode) and self.diode_model(str(element.model))['RS'] > 0:
+            nodes.append(f'{element.name.lower()}#internal')
+        return nodes
+
+    def stamp(self, element, g_triplets, c_triplets):
+        if not isinstance(element, Diode):
+            return super().stamp(element, g_triplets, c_triplets)
+
+        anode, cathode = (self.index(node) for node in element.nodes)
+        internal = self.node_index.get(f'{element.name.lower()}#internal')
+        area = 1.0 if element.area is None else spice_value(element.area)
+        multiplier = 1.0 if element.multiplier is None else spice_value(element.multiplier)
+        self.diodes.append({
+            'name': element.name,
+            'model': str(element.model),
+            'anode': anode,
+            'cathode': cathode,
+            # The junction is behind RS, if any
+            'junction': anode if internal is None else internal,
+            'series': internal is not None,
+            'scale': area * multiplier,
+        })
+
+    def diode_parameters(
+        self,
+        parameters:Optional[Dict[str, np.ndarray]],
+        n_points:int,
+    ) -> List[Dict[str, np.ndarray]]:
+        """
+        Per point model parameters of every diode, with the derived
+        quantities used by the Newton iterations.
+
+        Args:
+            parameters (dict):
+                'Model.PARAM' (e.g. 'MyDiode.IS') to per point values (n_points,).
+            n_points (int):
+                Number of points.
+
+        Returns:
+            list: one dict of (n_points,) arrays per diode
+        """
+        overrides = {}
+        for key, values in (parameters or {}).items():
+            name, _, parameter = key.partition('.')
+            parameter = parameter.upper()
+            if name.lower() not in self.models or parameter not in DIODE_DEFAULTS:
+                raise KeyError(f'{key} is not a diode model parameter, e.g. MyDiode.IS')
+            overrides[(name.lower(), parameter)] = np.asarray(values, dtype=np.float64)
+
+        res = []
+        for diode in self.diodes:
+            model = self.diode_model(diode['model'])
+            p = {k: np.broadcast_to(overrides.get((diode['model'].lower(), k), v), (n_points,)).astype(np.float64)
+                 for k, v in model.items()}
+            p['IS'] = p['IS'] * diode['scale']
+            p['RS'] = p['RS'] / diode['scale']
+            p['IBV'] = p['IBV'] * diode['scale']
+            p['vte'] = p['N'] * self.vt
+            p['vcrit'] = p['vte'] * np.log(p['vte'] / (np.sqrt(2) * p['IS']))
+            p['breakdown'] = breakdown_voltage(p['IS'], p['BV'], p['IBV'], p['vte'])
+            res.append(p)
+        return res
+
+    def newton(
+        self,
+        b:np.ndarray,
+        diodes:List[Dict[str, np.ndarray]],
+        x0:Optional[np.ndarray]=None,
+        shunt:float=0.0,
+        linear:Optional[np.ndarray]=None,
+        max_iterations:Optional[int]=None,
+    ) -> Tuple[np.ndarray, np.ndarray, int]:
+        """
+        Newton-Raphson iterations of every point at once.
+
+        Args:
+            b (np.ndarray):
+                Right hand side of each point (n_points, n).
+            diodes (list):
+                Per point diode parameters, see `diode_parameters`.
+            x0 (np.ndarray):
+                Initial solution (n_points, n), defaults to zeros.
+            shunt (float):
+                Conductance from every node to ground (for gmin stepping).
+            linear (np.ndarray):
+                Matrix of the linear elements of each point (n_points, n, n),
+                defaults to the circuit's G for every point (a `SparseSystem`
+                takes stamp values instead, see `linear_base`).
+            max_iterations (int):
+                Iteration limit, defaults to the `itl1` option.
+
+        Returns:
+            tuple: solutions (n_points, n), convergence of each point, and iterations run
+        """
+        n_points, n = b.shape
+        n_nodes = len(self.nodes)
+        x = np.zeros((n_points, n)) if x0 is None else x0.copy()
+        converged = np.zeros(n_points, dtype=bool)
+
+        base = self.linear_base(linear, shunt)
+        tol_abs = np.where(np.arange(n) < n_nodes, self.options['vntol'], self.options['abstol'])
+
+        # Junction voltages of the previous iteration, for limiting
+        vd_old = [x[:, d['junction']] - (x[:, d['cathode']] if d['cathode'] >= 0 else 0.0) for d in self.diodes]
+
+        iteration = 0
+        for iteration in range(1, (max_iterations or self.options['itl1']) + 1):
+            active = np.flatnonzero(~converged)
+            # Ground is an extra, last, column (index -1) which is dropped before solving
+            xa = np.concatenate([x[active], np.zeros((len(active), 1))], axis=1)
+            rhs = np.concatenate([b[active], np.zeros((len(active), 1))], axis=1)
+            limited = np.zeros(len(active), dtype=bool)
+            linearized = []
+            conductances = []
+
+            for d, p, old in zip(self.diodes, diodes, vd_old):
+                j, c = d['junction'], d['cathode']
+                vd, clipped = limit_junction_voltage(xa[:, j] - xa[:, c], old[active], p['vte'][active],
+                                                     p['vcrit'][active], p['breakdown'][active])
+                old[active] = vd
+                limited |= clipped
+                cd, gd = diode_current(vd, p['IS'][active], p['vte'][active], p['breakdown'][active],
+                                       self.options['gmin'])
+                linearized.append((vd, cd, gd))
+                ieq = cd - gd * vd
+                conductances.append((j, c, gd))
+                rhs[:, j] -= ieq
+                rhs[:, c] += ieq
+                if d['series']:
+                    conductances.append((d['anode'], j, 1 / p['RS'][active]))
+
+            x_new = self.solve_linearized(base[active] if len(base) > 1 else base, conductances, rhs[:, :n])
+            x_old = x[active]
+            tolerance = self.options['reltol'] * np.maximum(np.abs(x_new), np.abs(x_old)) + tol_abs
+            done = np.all(np.abs(x_new - x_old) <= tolerance, axis=1) & ~limited & (iteration > 1)
+            done &= np.all(np.isfinite(x_new), axis=1)
+
+            # As ngspice, the diode currents must also agree with their linearization
+            xn = np.concatenate([x_new, np.zeros((len(active), 1))], axis=1)
+            for d, p, (vd, cd, gd) in zip(self.diodes, diodes, linearized):
+                vd_new = xn[:, d['junction']] - xn[:, d['cathode']]
+                cd_new, _ = diode_current(vd_new, p['IS'][active], p['vte'][active], p['breakdown'][active],
+                                          self.options['gmin'])
+                cd_hat = cd + gd * (vd_new - vd)
+                done &= np.abs(cd_hat - cd_new) <= (self.options['reltol'] * np.maximum(np.abs(cd_hat), np.abs(cd_new))
+                                                    + self.options['abstol'])
+
+            x[active] = x_new
+            converged[active] = done
+            if converged.all():
+                break
+
+        return x, converged, iteration
+
+    def linear_base(
+        self,
+        linear:Optional[np.ndarray],
+        shunt:float,
+    ) -> np.ndarray:
+        """
+        Matrices of the linear elements (and shunt conductances) of each
+        point, padded with a ground row and column, (n_points or 1, n+1, n+1).
+        """
+        n, n_nodes = self.size, len(self.nodes)
+        linear = self.G.toarray()[np.newaxis] if linear is None else linear
+        base = np.zeros((len(linear), n + 1, n + 1))
+        base[:, :n, :n] = linear
+        base[:, np.arange(n_nodes), np.arange(n_nodes)] += shunt
+        return base
+
+    def solve_linearized(
+        self,
+        base:np.ndarray,
+        conductances:List[Tuple[int, int, np.ndarray]],
+        rhs:np.ndarray,
+    ) -> np.ndarray:
+        """
+        Solve one Newton iteration of every point.
+
+        Args:
+            base (np.ndarray):
+                Linear part of the points, see `linear_base`.
+            conductances (list):
+                (node, node, per point conductance) of the linearized devices,
+                node -1 being ground.
+            rhs (np.ndarray):
+                Right hand side of each point (n_points, n).
+
+        Returns:
+            np.ndarray: solutions (n_points, n)
+        """
+        n = self.size
+        A = base.copy() if len(base) == len(rhs) else np.repeat(base, len(rhs), axis=0)
+        for i, j, g in conductances:
+            A[:, i, i] += g
+            A[:, j, j] += g
+            A[:, i, j] -= g
+            A[:, j, i] -= g
+        return self.solve(A[:, :n, :n], rhs[..., np.newaxis])[..., 0]
+
+    def solve_points(
+        self,
+        b:np.ndarray,
+        parameters:Optional[Dict[str, np.ndarray]]=None,
+        strict:bool=True,
+        linear:Optional[np.ndarray]=None,
+    ) -> np.ndarray:
+        """
+        DC solution of every point: Newton from zero, then gmin stepping,
+        then source stepping for the points which did not converge.
+
+        Args:
+            b (np.ndarray):
+                Right hand side of each point (n_points, n).
+            parameters (dict):
+                Per point diode model parameters, see `diode_parameters`.
+            strict (bool):
+                Raise if any point does not converge, otherwise return NaN for it.
+            linear (np.ndarray):
+                Matrix of the linear elements of each point, see `newton`.
+
+        Returns:
+            np.ndarray: solutions (n_points, n)
+        """
+        n_points = len(b)
+        diodes = self.diode_parameters(parameters, n_points)
+
+        def subset(p, idx):
+            return [{k: v[idx] for k, v in d.items()} for d in p]
+
+        def subset_linear(idx):
+            return linear if linear is None or len(linear) == 1 else linear[idx]
+
+        x, converged, iterations = self.newton(b, diodes, linear=linear)
+        self.stats = {'points': n_points, 'iterations': iterations, 'gmin_stepping': 0, 'source_stepping': 0}
+
+        # Each step starts from the previous step's solution, and only the
+        # last one (the actual circuit) has to converge
+
+        # gmin stepping: solve with a large shunt conductance, then relax it decade by decade
+        failed = np.flatnonzero(~converged)
+        if len(failed):
+            self.stats['gmin_stepping'] = len(failed)
+            sub_b, sub_d, sub_x = b[failed], subset(diodes, failed), None
+            for shunt in [*np.logspace(-2, -12, self.options['gminsteps']), 0.0]:
+                sub_x, ok, _ = self.newton(sub_b, sub_d, sub_x, shunt=shunt, linear=subset_linear(failed))
+            x[failed] = sub_x
+            converged[failed] = ok
+
+        # Source stepping: ramp every source up from zero, following the solution
+        failed = np.flatnonzero(~converged)
+        if len(failed):
+            self.stats['source_stepping'] = len(failed)
+            sub_b, sub_d, sub_x = b[failed], subset(diodes, failed), None
+            for factor in np.linspace(0, 1, self.options['srcsteps'] + 1)[1:]:
+                sub_x, ok, _ = self.newton(factor * sub_b, sub_d, sub_x, linear=subset_linear(failed))
+            x[failed] = sub_x
+            converged[failed] = ok
+
+        failed = np.flatnonzero(~converged)
+        self.stats['failed'] = len(failed)
+        if len(failed):
+            if strict:
+                raise NameError(f'Simulation failed, no DC convergence for {len(failed)} of {n_points} points')
+            x[failed] = np.nan
+        return x
+
+    def n_variants(self, parameters:Optional[Dict[str, np.ndarray]]) -> int:
+        lengths = {np.size(v) for v in (parameters or {}).values()}
+        if len(lengths) > 1:
+            raise ValueError(f'Parameter variants must have equal lengths, got {sorted(lengths)}')
+        return lengths.pop() if lengths else 0
+
+    def operating_point(
+        self,
+        parameters:Optional[Dict[str, Sequence[float]]]=None,
+        cast:bool=True,
+        strict:bool=True,
+    ) -> Dict[str, np.ndarray|float]:
+        """
+        DC operating point, of the circuit or of each parameter variant.
+
+        Args:
+            parameters (dict):
+                'Model.PARAM' to the values of each variant, e.g. {'MyDiode.IS': [1e-9, 2e-9]}.
+            cast (bool):
+                Return floats when there are no variants.
+            strict (bool):
+                See `solve_points`.
+
+        Returns:
+            dict: node voltages, (n_variants,) arrays if variants are given
+        """
+        n_variants = self.n_variants(parameters)
+        b = np.broadcast_to(self.rhs(), (max(n_variants, 1), self.size))
+        x = self.solve_points(np.array(b), parameters, strict)
+        return self.format_solution(x.T, cast and not n_variants)
+
+    def dc(
+        self,
+        parameters:Optional[Dict[str, Sequence[float]]]=None,
+        strict:bool=True,
+        **kwargs,
+    ) -> Dict[str, np.ndarray]:
+        """
+        DC sweep of one independent source, e.g. `dc(Vinput=slice(-3, 3, 0.01))`,
+        optionally for every variant of the diode parameters.
+
+        Args:
+            parameters (dict):
+                'Model.PARAM' to the values of each variant.
+            strict (bool):
+                See `solve_points`.
+
+        Returns:
+            dict: node voltages, (n_values,) or (n_variants, n_values) if variants are given
+        """
+        if len(kwargs) != 1:
+            raise ValueError('Sweep exactly one source, e.g. dc(Vinput=slice(-3, 3, 0.1))')
+        (source, values), = kwargs.items()
+        values = sweep_values(values)
+        n_variants = self.n_variants(parameters)
+
+        base = self.rhs(overrides={source: 0.0})
+        b = base[np.newaxis, :] + values[:, np.newaxis] * self.source_pattern(source)[np.newaxis, :]
+        if not n_variants:
+            return self.format_solution(self.solve_points(b, None, strict).T, cast=False)
+
+        # Every variant at every sweep value, variant major
+        b = np.tile(b, (n_variants, 1))
+        parameters = {k: np.repeat(np.asarray(v, dtype=np.float64), len(values)) for k, v in parameters.items()}
+        x = self.solve_points(b, parameters, strict).reshape(n_variants, len(values), self.size)
+        return self.format_solution(np.moveaxis(x, 2, 0), cast=False)
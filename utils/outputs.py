@@ -0,0 +1,74 @@
+import os
+from typing import Optional, Sequence, Set
+
+
+
+def vector_expression(name:str) -> str:
+    """
+    Convert a node name to an ngspice vector expression, e.g. 'n3' -> 'v(n3)'.
+    Expressions that are already explicit (e.g. 'i(vinput)') are kept.
+    """
+    if '(' in name or '#' in name:
+        return name
+    return f'v({name})'
+
+
+def output_key(name:str) -> str:
+    """
+    Key under which a vector is matched against the requested outputs:
+    lower case, without the v()/i() wrapper or the '#branch' suffix,
+    e.g. 'V(n3)' -> 'n3' and 'i(Vinput)' -> 'vinput'.
+    """
+    name = str(name).lower()
+    if name[:2] in ('v(', 'i(') and name.endswith(')'):
+        name = name[2:-1]
+    if name.endswith('#branch'):
+        name = name[:-len('#branch')]
+    return name
+
+
+def output_filter(vectors:Optional[Sequence[str]]) -> Optional[Set[str]]:
+    """
+    Set of output keys to keep, or None to keep every vector.
+    """
+    if not vectors:
+        return None
+    return {output_key(v) for v in vectors}
+
+
+def save_line(vectors:Sequence[str]) -> str:
+    """ `.save` line for the given nodes/vectors, e.g. ['n3'] -> '.save v(n3)'. """
+    return '.save ' + ' '.join(vector_expression(v) for v in vectors)
+
+
+def add_saves(deck:str, vectors:Optional[Sequence[str]]) -> str:
+    """
+    Add a `.save` line for the given nodes to a rendered deck.
+    """
+    if not vectors:
+        return deck
+    head, _, _ = deck.rpartition('.end')
+    return head + save_line(vectors) + os.linesep + '.end' + os.linesep
+
+
+def save_vectors(simulator, vectors:Optional[Sequence[str]]):
+    """
+    Make a PySpice simulator save only the given nodes/vectors.
+
+    ngspice then only keeps (and sends back) those vectors and the
+    abscissa, rather than every node voltage and source current,
+    so the per point memory, parsing and pickling shrink accordingly.
+
+    Args:
+        simulator (CircuitSimulator):
+            PySpice simulator, as returned by `circuit.simulator()`.
+        vectors (Sequence[str]):
+            Nodes or vector expressions, e.g. ['n3', 'i(vinput)'],
+            or None to save everything.
+
+    Returns:
+        CircuitSimulator: the simulator
+    """
+    if vectors:
+        simulator.save([vector_expression(v) for v in vectors])
+    return simulator
@@ -0,0 +1,247 @@
+import numpy as np
+import math
+import os
+import time
+from multiprocessing import Pool
+from typing import List, Dict, Optional, Any, Iterator, Sequence
+
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Spice.NgSpice.Shared import NgSpiceShared
+
+from utils.methods import render_netlist
+from utils.outputs import add_saves
+from utils.result import SimulationResult
+from utils.sweep import SweepPoint, DEFAULT_SIMULATOR_KWARGS
+
+
+
+def format_alter_value(value) -> str:
+    """
+    Format a python value for an ngspice `alter`/`altermod` command.
+    Sequences (e.g. a SIN source vector) are written as `[ a b c ]`.
+    """
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return '[ ' + ' '.join(format_alter_value(v) for v in value) + ' ]'
+    if isinstance(value, str):
+        return value
+    # float() also converts PySpice unit values, e.g. 2@u_kOhm -> 2000.0
+    return str(float(value))
+
+
+def alter_commands(
+    point:Dict[str, Any],
+    model_names:Sequence[str]=(),
+) -> List[str]:
+    """
+    Convert a sweep point into ngspice `alter`/`altermod` commands.
+
+    Keys are either an element name, which sets its primary value
+    (e.g. `{'R1': 2e3}` -> `alter r1 = 2000.0`), or 'name.parameter'.
+    If the name is one of the circuit's models an `altermod` is issued
+    (e.g. `{'MyDiode.IS': 5e-9}` -> `altermod mydiode is = 5e-09`).
+
+    Args:
+        point (dict):
+            Parameter name to new value.
+        model_names (Sequence[str]):
+            Names of the models defined in the circuit.
+
+    Returns:
+        list: ngspice commands
+    """
+    models = {name.lower() for name in model_names}
+
+    commands = []
+    for key, value in point.items():
+        name, _, parameter = key.lower().partition('.')
+        value = format_alter_value(value)
+        if not parameter:
+            commands.append(f'alter {name} = {value}')
+        elif name in models:
+            commands.append(f'altermod {name} {parameter} = {value}')
+        else:
+            commands.append(f'alter {name} {parameter} = {value}')
+    return commands
+
+
+class WarmSession:
+    """
+    A long lived ngspice shared library session with one circuit loaded.
+
+    The netlist is parsed once; every new point then only costs the
+    `alter` commands and a `run`, rather than a new simulator and parse.
+
+    Args:
+        netlist (str):
+            Full SPICE deck, including the analysis line.
+        model_names (Sequence[str]):
+            Names of the models defined in the circuit (for `altermod`).
+        vectors (Sequence[str]):
+            Nodes/vectors to return (e.g. ['n3']), or None for all.
+    """
+
+    def __init__(
+        self,
+        netlist:str,
+        model_names:Sequence[str]=(),
+        vectors:Optional[Sequence[str]]=None,
+    ):
+        self.model_names = list(model_names)
+        self.vectors = list(vectors) if vectors else None
+        self.ngspice = NgSpiceShared.new_instance()
+        self.ngspice.load_circuit(netlist)
+        self._altered = None
+
+    def run(
+        self,
+        point:Dict[str, Any],
+    ) -> SimulationResult:
+        """
+        Apply a point's parameter values and re-run the loaded analysis.
+
+        Args:
+            point (dict):
+                Parameter name to value, see `alter_commands`.
+
+        Returns:
+            SimulationResult: columnar analysis results
+        """
+        # Restore the original deck if this point does not overwrite every altered value
+        if self._altered is not None and not self._altered <= set(point):
+            self.ngspice.reset()
+        self._altered = set(point)
+
+        for command in alter_commands(point, self.model_names):
+            self.ngspice.exec_command(command)
+        self.ngspice.run()
+
+        plot_name = self.ngspice.last_plot
+        if plot_name == 'const':
+            raise NameError('Simulation failed')
+        result = SimulationResult.from_analysis(self.ngspice.plot(None, plot_name).to_analysis(), self.vectors)
+
+        # The vectors have been copied, so free this run's plot straight away
+        self.ngspice.destroy(plot_name)
+        return result
+
+
+# Session owned by each pool worker, created once by the initializer
+_worker_session = None
+
+
+def _init_worker(netlist:str, model_names:List[str], vectors:Optional[List[str]]):
+    global _worker_session
+    _worker_session = WarmSession(netlist, model_names, vectors)
+
+
+def _run_worker_point(task) -> SweepPoint:
+    index, point = task
+    tic = time.perf_counter()
+    result = _worker_session.run(point)
+    toc = time.perf_counter()
+    return SweepPoint(index, point, result, toc-tic)
+
+
+class WarmSimulatorPool:
+    """
+    Process pool whose workers each hold a warm ngspice session.
+
+    Each worker loads the ngspice shared library and parses the circuit
+    once, when the pool starts. Sweep points are then applied with
+    `alter`/`altermod` and `run`, so the per-point cost is only the solve.
+    The pool stays up between calls to `map`, until `close` is called
+    (or the `with` block exits).
+
+    Example:
+        with WarmSimulatorPool(build_circuit(500), 'transient',
+                               dict(step_time=0.0001, end_time=0.1)) as pool:
+            points = pool.map([{'R1': r} for r in sweep_resistors])
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit, with the nominal parameter values.
+        analysis (str):
+            Analysis method name, e.g. 'transient'.
+        analysis_kwargs (dict):
+            Keyword arguments of the analysis.
+        simulator_kwargs (dict):
+            Keyword arguments as passed to `circuit.simulator()`.
+        processes (int):
+            Number of worker processes, defaults to the number of CPUs.
+        chunksize (int):
+            Number of points sent to a worker at a time.
+        vectors (Sequence[str]):
+            Nodes/vectors to save and return, e.g. ['n3'], or None for all.
+    """
+
+    def __init__(
+        self,
+        circuit:Circuit,
+        analysis:str='transient',
+        analysis_kwargs:Optional[Dict[str, Any]]=None,
+        simulator_kwargs:Optional[Dict[str, Any]]=None,
+        processes:Optional[int]=None,
+        chunksize:Optional[int]=None,
+        vectors:Optional[Sequence[str]]=None,
+    ):
+        self.vectors = list(vectors) if vectors else None
+        self.netlist = add_saves(render_netlist(
+            circuit,
+            analysis,
+            analysis_kwargs,
+            simulator_kwargs or DEFAULT_SIMULATOR_KWARGS,
+        ), self.vectors)
+        self.model_names = list(circuit.model_names)
+        self.processes = processes or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self._pool = Pool(
+            self.processes,
+            initializer=_init_worker,
+            initargs=(self.netlist, self.model_names, self.vectors),
+        )
+
+    def _chunksize(self, n_points:int) -> int:
+        if self.chunksize is not None:
+            return self.chunksize
+        return max(1, math.ceil(n_points / (self.processes * 4)))
+
+    def imap(
+        self,
+        points:Sequence[Dict[str, Any]],
+    ) -> Iterator[SweepPoint]:
+        """
+        Lazily yield the results of the given points, in order.
+
+        Args:
+            points (Sequence[dict]):
+                Parameter values of each point, see `alter_commands`.
+        """
+        tasks = list(enumerate(points))
+        yield from self._pool.imap(_run_worker_point, tasks, chunksize=self._chunksize(len(tasks)))
+
+    def map(
+        self,
+        points:Sequence[Dict[str, Any]],
+    ) -> List[SweepPoint]:
+        """
+        Simulate every point.
+
+        Args:
+            points (Sequence[dict]):
+                Parameter values of each point, see `alter_commands`.
+
+        Returns:
+            list: SweepPoint results, in the order of the points
+        """
+        return list(self.imap(points))
+
+    def close(self):
+        """ Shut down the workers (and their ngspice sessions). """
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self) -> 'WarmSimulatorPool':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
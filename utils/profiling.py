@@ -0,0 +1,465 @@
+import numpy as np
+import contextlib
+import functools
+import os
+import re
+import subprocess
+import time
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Optional, Any, Callable, Iterator, Sequence, Tuple
+
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Spice.NgSpice.RawFile import RawFile
+
+
+
+# ngspice `rusage` labels (lower case) and the name they are recorded under
+SOLVER_STATISTICS = {
+    'total iterations': 'iterations',
+    'transient iterations': 'transient_iterations',
+    'circuit equations': 'equations',
+    'transient timepoints': 'timepoints',
+    'accepted timepoints': 'accepted_timepoints',
+    'rejected timepoints': 'rejected_timepoints',
+    'total analysis time': 'analysis_time',
+    'transient time': 'transient_time',
+    'matrix reordering time': 'reorder_time',
+    'l-u decomposition time': 'lu_time',
+    'matrix solve time': 'solve_time',
+    'load time': 'load_time',
+}
+
+NUMBER_PATTERN = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+
+def cpu_times() -> Tuple[float, float]:
+    """
+    CPU time (user + system) of this process, and of its finished child
+    processes (e.g. an ngspice subprocess, once it has been waited for).
+    """
+    times = os.times()
+    return times.user + times.system, times.children_user + times.children_system
+
+
+@dataclass
+class StageRecord:
+    """
+    Timing of one stage of a simulation.
+
+    Args:
+        stage (str):
+            Stage name, e.g. 'render' or 'solve'.
+        wall (float):
+            Wall time in seconds.
+        cpu (float):
+            CPU time of this process in seconds.
+        child_cpu (float):
+            CPU time of child processes (the ngspice subprocess) in seconds.
+        label (str):
+            Free label, e.g. the sweep point, to group records by.
+        pid (int):
+            Process id, to tell pool workers apart.
+        extra (dict):
+            Anything else measured, e.g. solver statistics or result size.
+    """
+    stage: str
+    wall: float
+    cpu: float = 0.0
+    child_cpu: float = 0.0
+    label: Optional[str] = None
+    pid: int = field(default_factory=os.getpid)
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ Flat dictionary, with the extra values as top level keys. """
+        record = asdict(self)
+        record.update(record.pop('extra'))
+        return record
+
+
+class Profiler:
+    """
+    Collects per stage wall and CPU timings.
+
+    Example:
+        profiler = Profiler()
+        with profiler.stage('build'):
+            circuit = build_circuit(500)
+        simulator = ProfiledSimulator(circuit, profiler, temperature=25, nominal_temperature=25)
+        analysis = simulator.transient(step_time=0.0001, end_time=0.1)
+        profiler.summary()
+
+    Args:
+        label (str):
+            Default label of the records.
+    """
+
+    def __init__(self, label:Optional[str]=None):
+        self.label = label
+        self.records = []
+
+    @contextlib.contextmanager
+    def stage(
+        self,
+        name:str,
+        label:Optional[str]=None,
+        **extra,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Time the enclosed block as a stage.
+        The yielded dictionary can be filled in with extra values to record.
+        """
+        extra = dict(extra)
+        cpu, child_cpu = cpu_times()
+        tic = time.perf_counter()
+        try:
+            yield extra
+        finally:
+            wall = time.perf_counter() - tic
+            cpu_end, child_cpu_end = cpu_times()
+            self.records.append(StageRecord(
+                name,
+                wall,
+                cpu_end - cpu,
+                child_cpu_end - child_cpu,
+                label if label is not None else self.label,
+                extra=extra,
+            ))
+
+    def profiled(self, stage:Optional[str]=None) -> Callable:
+        """
+        Decorator timing every call of a function as a stage
+        (named after the function by default).
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage or function.__name__):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add(self, records:Sequence[StageRecord|Dict[str, Any]]):
+        """ Add records, e.g. those returned by pool workers. """
+        for record in records:
+            if isinstance(record, dict):
+                record = dict(record)
+                known = {k: record.pop(k) for k in ('stage', 'wall', 'cpu', 'child_cpu', 'label', 'pid') if k in record}
+                record = StageRecord(**known, extra=record)
+            self.records.append(record)
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """ The records as flat dictionaries (e.g. for JSON or a DataFrame). """
+        return [record.to_dict() for record in self.records]
+
+    def summary(self, by:Sequence[str]=('stage',)) -> Dict[Any, Dict[str, float]]:
+        """ Aggregate the records, see `aggregate_records`. """
+        return aggregate_records(self.to_records(), by)
+
+    def clear(self):
+        self.records = []
+
+
+def aggregate_records(
+    records:Sequence[Dict[str, Any]],
+    by:Sequence[str]=('stage',),
+) -> Dict[Any, Dict[str, float]]:
+    """
+    Aggregate flat stage records (e.g. from every worker of a pool run).
+
+    Args:
+        records (Sequence[dict]):
+            Records, as returned by `Profiler.to_records`.
+        by (Sequence[str]):
+            Keys to group by, e.g. ('stage',) or ('pid', 'stage').
+
+    Returns:
+        dict: group to {'count', 'wall', 'wall_mean', 'wall_max', 'cpu', 'child_cpu'},
+        plus the total of every other numeric value (e.g. solver iterations)
+    """
+    groups = {}
+    for record in records:
+        key = tuple(record.get(k) for k in by)
+        groups.setdefault(key[0] if len(by) == 1 else key, []).append(record)
+
+    summary = {}
+    for key, group in groups.items():
+        wall = np.array([record['wall'] for record in group])
+        res = {
+            'count': len(group),
+            'wall': float(wall.sum()),
+            'wall_mean': float(wall.mean()),
+            'wall_max': float(wall.max()),
+            'cpu': float(sum(record.get('cpu', 0.0) for record in group)),
+            'child_cpu': float(sum(record.get('child_cpu', 0.0) for record in group)),
+        }
+        skip = set(res) | set(by) | {'pid', 'label'}
+        for record in group:
+            for name, value in record.items():
+                if name in skip:
+                    continue
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    res[name] = res.get(name, 0) + value
+        summary[key] = res
+    return summary
+
+
+def parse_solver_statistics(lines:Sequence[str]) -> Dict[str, float]:
+    """
+    Parse ngspice solver statistics, as printed by `rusage` (or in a
+    batch log with `.options acct`), e.g. 'Transient iterations = 1254'.
+
+    Args:
+        lines (Sequence[str]):
+            Output lines.
+
+    Returns:
+        dict: statistic name (see `SOLVER_STATISTICS`) to value
+    """
+    statistics = {}
+    for line in lines:
+        label, sep, value = line.partition('=')
+        if not sep:
+            label, sep, value = line.partition(':')
+        if not sep:
+            continue
+        label = label.strip().lower()
+        for known, name in SOLVER_STATISTICS.items():
+            if label.startswith(known):
+                match = NUMBER_PATTERN.search(value)
+                if match is not None:
+                    number = float(match.group())
+                    statistics[name] = int(number) if number.is_integer() and not name.endswith('time') else number
+                break
+    return statistics
+
+
+def solver_statistics(ngspice) -> Dict[str, float]:
+    """
+    Get the solver statistics of the last run of an ngspice shared library session.
+    """
+    try:
+        lines = ngspice.exec_command('rusage everything', join_lines=False)
+    except Exception:
+        return {}
+    return parse_solver_statistics(lines)
+
+
+def add_acct_option(deck:str) -> str:
+    """
+    Add `.options acct` to a deck (before its final `.end`), so that ngspice
+    prints its solver statistics once the analysis is done.
+    """
+    lines = deck.splitlines()
+    for i in range(len(lines) - 1, -1, -1):
+        if lines[i].strip().lower() == '.end':
+            return os.linesep.join(lines[:i] + ['.options acct'] + lines[i:]) + os.linesep
+    return deck
+
+
+def analysis_size(analysis) -> Dict[str, int]:
+    """
+    Size of a PySpice analysis: number of vectors, points, and bytes.
+    """
+    waveforms = list(analysis.nodes.values()) + list(analysis.branches.values())
+    return {
+        'n_vectors': len(waveforms),
+        'n_points': len(waveforms[0]) if waveforms else 0,
+        'nbytes': int(sum(np.asarray(w).nbytes for w in waveforms)),
+    }
+
+
+class _StageClock:
+    """ Records the end of each stage of one analysis call. """
+
+    def __init__(self):
+        self.marks = []
+        self.mark('start')
+
+    def mark(self, stage:str):
+        self.marks.append((stage, time.perf_counter()) + cpu_times())
+
+    def stages(self) -> Iterator[tuple]:
+        for (_, wall0, cpu0, child0), (stage, wall1, cpu1, child1) in zip(self.marks, self.marks[1:]):
+            yield stage, wall1 - wall0, cpu1 - cpu0, child1 - child0
+
+
+class _SpiceServerProbe:
+    """
+    Stand-in for PySpice's SpiceServer (of a subprocess simulator)
+    which marks the render, launch and solve stages.
+
+    The deck is run with `.options acct`, and the solver statistics ngspice
+    prints are kept in `statistics`. They follow the binary data, which
+    PySpice reads by point count, so the results are unaffected.
+    """
+
+    def __init__(self, server, clock:_StageClock):
+        self._server = server
+        self._clock = clock
+        self.statistics = {}
+
+    def __call__(self, spice_input):
+        self._clock.mark('render')
+        process = subprocess.Popen(
+            (self._server._spice_command, '-s'),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self._clock.mark('launch')
+        stdout, stderr = process.communicate(add_acct_option(str(spice_input)).encode('utf-8'))
+        self._clock.mark('solve')
+
+        stderr = stderr.decode('utf-8')
+        self.statistics = parse_solver_statistics(
+            stdout.decode('utf-8', 'replace').splitlines() + stderr.splitlines())
+        self._server._parse_stdout(stdout)
+        number_of_points = self._server._parse_stderr(stderr)
+        if number_of_points is None:
+            raise NameError('The number of points was not found in the standard error buffer,'
+                            ' ngspice returned:' + os.linesep + stderr)
+        return RawFile(stdout, number_of_points)
+
+
+class _NgSpiceSharedProbe:
+    """
+    Stand-in for an NgSpiceShared session (of a shared library simulator)
+    which marks the render, load and solve stages.
+    """
+
+    def __init__(self, ngspice, clock:_StageClock):
+        self._ngspice = ngspice
+        self._clock = clock
+
+    def __getattr__(self, name):
+        return getattr(self._ngspice, name)
+
+    def load_circuit(self, circuit):
+        self._clock.mark('render')
+        res = self._ngspice.load_circuit(circuit)
+        self._clock.mark('load')
+        return res
+
+    def run(self, *args, **kwargs):
+        res = self._ngspice.run(*args, **kwargs)
+        self._clock.mark('solve')
+        return res
+
+
+class ProfiledSimulator:
+    """
+    A PySpice simulator whose analyses are timed stage by stage.
+
+    Each analysis call is split into: 'render' (the netlist), 'launch'
+    (spawning ngspice, subprocess simulator) or 'load' (parsing the
+    netlist, shared library simulator), 'solve' and 'parse' (reading the
+    results back into a PySpice analysis). Creating the simulator is
+    recorded as the 'simulator' stage, and an optional `extract` function
+    (e.g. `format_analysis`) as the 'format' stage.
+
+    The 'solve' record holds the ngspice solver statistics (iterations,
+    timepoints, rejected timepoints...): from `rusage` with the shared
+    library, or from `.options acct` with the subprocess simulator.
+    The 'parse' record holds the result size.
+
+    Example:
+        simulator = ProfiledSimulator(circuit, profiler, temperature=25, nominal_temperature=25)
+        res = simulator.transient(step_time=0.0001, end_time=0.1, extract=format_analysis)
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit object.
+        profiler (Profiler):
+            Where the records are kept, defaults to a new one.
+        label (str):
+            Label of the records, defaults to the profiler's label.
+        **simulator_kwargs:
+            Keyword arguments passed to `circuit.simulator()`.
+    """
+
+    def __init__(
+        self,
+        circuit:Circuit,
+        profiler:Optional[Profiler]=None,
+        label:Optional[str]=None,
+        **simulator_kwargs,
+    ):
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.label = label if label is not None else self.profiler.label
+        with self.profiler.stage('simulator', label=self.label):
+            self.simulator = circuit.simulator(**simulator_kwargs)
+
+    def run(
+        self,
+        analysis:str,
+        extract:Optional[Callable]=None,
+        **analysis_kwargs,
+    ):
+        """
+        Run an analysis, recording the time of each stage.
+
+        Args:
+            analysis (str):
+                Analysis method name, e.g. 'transient'.
+            extract (Callable):
+                Optional function applied to the analysis (timed as 'format'),
+                e.g. `format_analysis` or `SimulationResult.from_analysis`.
+            **analysis_kwargs:
+                Keyword arguments of the analysis.
+
+        Returns:
+            The PySpice analysis, or the output of `extract`.
+        """
+        clock = _StageClock()
+        simulator = self.simulator
+
+        if hasattr(simulator, '_spice_server'):
+            attribute = '_spice_server'
+            probe = _SpiceServerProbe(simulator._spice_server, clock)
+        elif hasattr(simulator, '_ngspice_shared'):
+            attribute = '_ngspice_shared'
+            probe = _NgSpiceSharedProbe(simulator._ngspice_shared, clock)
+        else:
+            attribute = None
+
+        if attribute is not None:
+            original = getattr(simulator, attribute)
+            setattr(simulator, attribute, probe)
+        try:
+            res = getattr(simulator, analysis)(**analysis_kwargs)
+        finally:
+            if attribute is not None:
+                setattr(simulator, attribute, original)
+        clock.mark('parse' if attribute is not None else 'simulate')
+
+        if attribute == '_spice_server':
+            statistics = probe.statistics
+        elif attribute == '_ngspice_shared':
+            statistics = solver_statistics(simulator._ngspice_shared)
+        else:
+            statistics = {}
+        for stage, wall, cpu, child_cpu in clock.stages():
+            extra = {'analysis': analysis}
+            if stage == 'solve':
+                extra.update(statistics)
+            elif stage in ('parse', 'simulate'):
+                extra.update(analysis_size(res))
+            self.profiler.records.append(StageRecord(stage, wall, cpu, child_cpu, self.label, extra=extra))
+
+        if extract is not None:
+            with self.profiler.stage('format', label=self.label, analysis=analysis):
+                res = extract(res)
+        return res
+
+    def operating_point(self, extract:Optional[Callable]=None, **kwargs):
+        return self.run('operating_point', extract, **kwargs)
+
+    def dc(self, extract:Optional[Callable]=None, **kwargs):
+        return self.run('dc', extract, **kwargs)
+
+    def ac(self, extract:Optional[Callable]=None, **kwargs):
+        return self.run('ac', extract, **kwargs)
+
+    def transient(self, extract:Optional[Callable]=None, **kwargs):
+        return self.run('transient', extract, **kwargs)
@@ -0,0 +1,234 @@
+import numpy as np
+import os
+from typing import Optional, Tuple
+
+from PySpice.Spice.Netlist import Circuit
+
+from utils.methods import write_line_to_netlist
+
+
+
+def check_pwl_table(
+    x:np.ndarray,
+    y:np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Check a PWL table, returning x and y as 1-D float arrays.
+    SPICE requires the x values (time, or the control value) to be increasing.
+    """
+    x = np.asarray(x, dtype=np.float64).ravel()
+    y = np.asarray(y, dtype=np.float64).ravel()
+    if len(x) != len(y):
+        raise ValueError(f'x and y must have the same length, got {len(x)} and {len(y)}')
+    if len(x) == 0:
+        raise ValueError('PWL table is empty')
+    if np.any(np.diff(x) <= 0):
+        raise ValueError('PWL x values must be strictly increasing')
+    return x, y
+
+
+def format_pwl_pairs(
+    x:np.ndarray,
+    y:np.ndarray,
+    per_line:int=10,
+    separator:str=', ',
+    x_format:str='%.9g',
+    y_format:str='%.9g',
+) -> str:
+    """
+    Format a table as SPICE PWL pairs, e.g. '1,0, 2,1, 3,5'.
+
+    The whole table is formatted by a single printf-style call (rather than
+    by growing a string pair by pair), so the cost is linear in the number
+    of points. A '+' continuation line is started every `per_line` pairs.
+
+    Args:
+        x (np.ndarray):
+            Increasing x values (time, or the control value).
+        y (np.ndarray):
+            Output values.
+        per_line (int):
+            Number of pairs per netlist line.
+        separator (str):
+            Separator between pairs, ', ' for a B-source pwl() function,
+            ' ' for a V/I source PWL(...).
+        x_format (str):
+            printf-style format of the x values.
+        y_format (str):
+            printf-style format of the y values.
+
+    Returns:
+        str: the formatted pairs
+    """
+    x, y = check_pwl_table(x, y)
+    pair = f'{x_format},{y_format}' if ',' in separator else f'{x_format} {y_format}'
+
+    # Build the printf template line by line (full lines, then the remainder)
+    n_lines, remainder = divmod(len(x), per_line)
+    lines = [separator.join([pair] * per_line)] * n_lines
+    if remainder:
+        lines.append(separator.join([pair] * remainder))
+    template = (separator.rstrip() + os.linesep + '+ ').join(lines)
+
+    values = np.column_stack((x, y)).ravel().tolist()
+    return template % tuple(values)
+
+
+def pwl_expression(
+    control:str,
+    x:np.ndarray,
+    y:np.ndarray,
+    per_line:int=10,
+    x_format:str='%.9g',
+    y_format:str='%.9g',
+) -> str:
+    """
+    Create a B-source look-up table expression, e.g. 'pwl(v(img), 1,0, 2,1)'.
+
+    Example:
+        circuit.B('Bs', 1, circuit.gnd, v=pwl_expression('v(img)', x, y))
+
+    Args:
+        control (str):
+            Expression the table is indexed by, e.g. 'v(img)' or 'time'.
+        x (np.ndarray):
+            Increasing control values.
+        y (np.ndarray):
+            Output values.
+        per_line (int):
+            Number of pairs per netlist line.
+        x_format (str):
+            printf-style format of the x values.
+        y_format (str):
+            printf-style format of the y values.
+
+    Returns:
+        str: the pwl() expression
+    """
+    pairs = format_pwl_pairs(x, y, per_line, ', ', x_format, y_format)
+    return f'pwl({control}, {pairs})'
+
+
+def pwl_source_value(
+    x:np.ndarray,
+    y:np.ndarray,
+    per_line:int=10,
+    x_format:str='%.9g',
+    y_format:str='%.9g',
+) -> str:
+    """
+    Create the value of a PWL voltage/current source, e.g. 'PWL(0 0 1m 5)'.
+
+    Args:
+        x (np.ndarray):
+            Increasing time values.
+        y (np.ndarray):
+            Output values.
+        per_line (int):
+            Number of pairs per netlist line.
+        x_format (str):
+            printf-style format of the time values.
+        y_format (str):
+            printf-style format of the y values.
+
+    Returns:
+        str: the PWL(...) source value
+    """
+    pairs = format_pwl_pairs(x, y, per_line, ' ', x_format, y_format)
+    return f'PWL({pairs})'
+
+
+def write_pwl_file(
+    path:str,
+    x:np.ndarray,
+    y:np.ndarray,
+    x_format:str='%.9g',
+    y_format:str='%.9g',
+) -> str:
+    """
+    Write a table as a two column text file, for an LTspice `PWL FILE=` source.
+
+    Args:
+        path (str):
+            Path of the file to write.
+        x (np.ndarray):
+            Increasing time values.
+        y (np.ndarray):
+            Output values.
+        x_format (str):
+            printf-style format of the time values.
+        y_format (str):
+            printf-style format of the y values.
+
+    Returns:
+        str: the source value, e.g. 'PWL FILE="table.txt"'
+    """
+    x, y = check_pwl_table(x, y)
+    np.savetxt(path, np.column_stack((x, y)), fmt=(x_format, y_format), delimiter=' ')
+    return f'PWL FILE="{path}"'
+
+
+def add_pwl_include(
+    circuit:Circuit,
+    path:str,
+    element:str,
+    node_plus,
+    node_minus,
+    x:np.ndarray,
+    y:np.ndarray,
+    control:Optional[str]=None,
+    per_line:int=10,
+    x_format:str='%.9g',
+    y_format:str='%.9g',
+) -> Circuit:
+    """
+    Write a (large) PWL source to a side file and `.include` it in a circuit,
+    so the netlist itself stays small.
+
+    With a `control` expression a B-source look-up table is written,
+    e.g. `Bs 1 0 v=pwl(v(img), ...)`, otherwise a time based PWL
+    voltage (or current) source, e.g. `Vin 1 0 PWL(...)`.
+
+    Example:
+        add_pwl_include(circuit, 'lut.inc', 'BBs', 1, circuit.gnd, x, y, control='v(img)')
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit object.
+        path (str):
+            Path of the include file to write.
+        element (str):
+            Full element name, including its prefix, e.g. 'BBs' or 'Vin'.
+        node_plus:
+            Positive node.
+        node_minus:
+            Negative node.
+        x (np.ndarray):
+            Increasing x values (time, or the control value).
+        y (np.ndarray):
+            Output values.
+        control (str):
+            B-source control expression, e.g. 'v(img)', or None for a time PWL source.
+        per_line (int):
+            Number of pairs per netlist line.
+        x_format (str):
+            printf-style format of the x values.
+        y_format (str):
+            printf-style format of the y values.
+
+    Returns:
+        Circuit: PySpice circuit object with the added include line
+    """
+    if control is not None:
+        if element[0].upper() != 'B':
+            raise ValueError('A pwl() look-up table needs a B-source element')
+        value = 'v=' + pwl_expression(control, x, y, per_line, x_format, y_format)
+    else:
+        if element[0].upper() not in ('V', 'I'):
+            raise ValueError('A PWL source must be a V or I element')
+        value = pwl_source_value(x, y, per_line, x_format, y_format)
+
+    with open(path, 'w') as f:
+        f.write(f'{element} {node_plus} {node_minus} {value}' + os.linesep)
+
+    return write_line_to_netlist(circuit, f'.include {os.path.abspath(path)}')
@@ -0,0 +1,365 @@
+import numpy as np
+import os
+from typing import List, Dict, Optional, Iterator, Tuple
+
+from utils.outputs import output_filter, output_key
+from utils.result import SimulationResult
+
+
+
+# Marker separating the header from the data, in each supported encoding
+BINARY_MARKERS = {
+    'utf-16-le': 'Binary:\n'.encode('utf-16-le'),
+    'ascii': b'Binary:\n',
+}
+
+
+def detect_encoding(head:bytes) -> str:
+    """
+    Detect the header encoding of a raw file:
+    LTspice writes UTF-16 little-endian, ngspice writes ASCII.
+    """
+    if len(head) > 1 and head[1] == 0:
+        return 'utf-16-le'
+    return 'ascii'
+
+
+def simplified_name(name:str) -> str:
+    """
+    Convert a raw file variable name to a node name, e.g. 'V(n001)' -> 'n001'.
+    Currents (e.g. 'I(R2)') are kept as is.
+    """
+    if name[:2] in ('v(', 'V(') and name.endswith(')'):
+        return name[2:-1]
+    return name
+
+
+def plot_dtypes(
+    flags:set,
+    n_variables:int,
+    is_ltspice:bool=False,
+) -> List[np.dtype]:
+    """
+    Get the binary dtype of each variable of a plot.
+
+    Args:
+        flags (set):
+            Lower case header flags, e.g. {'real', 'forward'}.
+        n_variables (int):
+            Number of variables.
+        is_ltspice (bool):
+            Whether the file was written by LTspice.
+
+    Returns:
+        list: one dtype per variable
+    """
+    if 'complex' in flags:
+        return [np.dtype('<c16')] * n_variables
+    if is_ltspice and 'double' not in flags:
+        return [np.dtype('<f8')] + [np.dtype('<f4')] * (n_variables - 1)
+    return [np.dtype('<f8')] * n_variables
+
+
+def point_dtype(dtypes:List[np.dtype]) -> np.dtype:
+    """
+    Get the (packed) record dtype of one point, from the per variable dtypes.
+    """
+    return np.dtype([(f'f{i}', dt) for i, dt in enumerate(dtypes)])
+
+
+class RawPlot:
+    """
+    One plot (analysis run) of a binary SPICE raw file.
+
+    Traces are exposed as zero-copy views of a memory-mapped file,
+    so indexing or slicing a trace only reads the pages it touches.
+
+    The binary layouts supported are:
+        - ngspice: every value a float64 (real) or complex128 (complex).
+        - LTspice: as above if the 'double' flag is set, otherwise the
+          abscissa is a float64 and every other trace a float32.
+          With the 'fastaccess' flag data is stored trace by trace,
+          rather than point by point.
+
+    Args:
+        buffer (np.memmap):
+            Memory-map of the whole file, as uint8.
+        header (Dict[str, str]):
+            Header fields, e.g. 'Plotname'.
+        variables (List[Tuple[str, str]]):
+            (name, type) of each variable, in file order.
+        data_offset (int):
+            Byte offset of this plot's data in the file.
+        is_ltspice (bool):
+            Whether the file was written by LTspice.
+    """
+
+    def __init__(
+        self,
+        buffer:np.memmap,
+        header:Dict[str, str],
+        variables:List[Tuple[str, str]],
+        data_offset:int,
+        is_ltspice:bool=False,
+    ):
+        self.header = header
+        self.variables = variables
+        self.names = [name for name, _ in variables]
+        self.columns = {name: i for i, name in enumerate(self.names)}
+        self.flags = set(header.get('Flags', '').lower().split())
+        self.is_ltspice = is_ltspice
+        self.data_offset = data_offset
+
+        if len(variables) != int(header['No. Variables']):
+            raise ValueError('Number of variables does not match the header')
+
+        self.dtypes = plot_dtypes(self.flags, len(variables), is_ltspice)
+        self.point_size = sum(dt.itemsize for dt in self.dtypes)
+
+        # A header count of 0 (e.g. a file still being written) is taken from the file size
+        available = (len(buffer) - data_offset) // self.point_size
+        n_points = int(header.get('No. Points', '0') or 0)
+        self.n_points = min(n_points, available) if n_points > 0 else available
+        self.truncated = (n_points == 0 or n_points > available)
+
+        self.nbytes = self.n_points * self.point_size
+        data = buffer[data_offset:data_offset + self.nbytes]
+
+        if 'fastaccess' in self.flags:
+            self._traces = []
+            start = 0
+            for dt in self.dtypes:
+                stop = start + self.n_points * dt.itemsize
+                self._traces.append(data[start:stop].view(dt))
+                start = stop
+        else:
+            records = data.view(point_dtype(self.dtypes))
+            self._traces = [records[f'f{i}'] for i in range(len(self.dtypes))]
+
+    @property
+    def plot_name(self) -> str:
+        return self.header.get('Plotname', '')
+
+    @property
+    def is_complex(self) -> bool:
+        return 'complex' in self.flags
+
+    @property
+    def abscissa(self) -> Optional[str]:
+        """
+        Result name of the plot's abscissa ('time', 'frequency' or 'sweep'),
+        held in the first variable, or None if the plot has none
+        (e.g. an operating point).
+        """
+        if not self.variables or self.plot_name.lower().startswith('operating point'):
+            return None
+        name, kind = self.variables[0]
+        for candidate in ('time', 'frequency'):
+            if candidate in (name.lower(), kind.lower()):
+                return candidate
+        # ngspice names the swept variable e.g. 'v-sweep', LTspice uses the source name
+        if name.lower().endswith('-sweep') or self.plot_name.lower().startswith('dc transfer'):
+            return 'sweep'
+        return None
+
+    @property
+    def variable_names(self) -> List[str]:
+        """ Names of the variables other than the abscissa. """
+        return self.names[1:] if self.abscissa is not None else list(self.names)
+
+    @property
+    def end_offset(self) -> int:
+        """ Byte offset just after this plot's data. """
+        return self.data_offset + self.nbytes
+
+    def __getitem__(self, name:str|int) -> np.ndarray:
+        """
+        Get a trace by name (or index) as a zero-copy strided view.
+        """
+        if isinstance(name, int):
+            return self._traces[name]
+        if name in self.columns:
+            return self._traces[self.columns[name]]
+        for candidate in (f'V({name})', f'v({name})'):
+            if candidate in self.columns:
+                return self._traces[self.columns[candidate]]
+        raise KeyError(name)
+
+    def __contains__(self, name:str) -> bool:
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def keys(self) -> List[str]:
+        return list(self.names)
+
+    def to_result(
+        self,
+        names:Optional[List[str]]=None,
+    ) -> SimulationResult:
+        """
+        Copy (some of) the traces into a SimulationResult.
+
+        Args:
+            names (List[str]):
+                Variables to include, or None for all.
+                The abscissa, if the plot has one, is always included.
+
+        Returns:
+            SimulationResult: columnar results
+        """
+        abscissa = self.abscissa
+
+        values = {}
+        for name in (names if names is not None else self.variable_names):
+            values[simplified_name(name)] = self[name]
+
+        if abscissa is None:
+            return SimulationResult.from_dict(values)
+
+        x = self._traces[0]
+        if abscissa == 'time' and self.is_ltspice:
+            # LTspice flags some time points with a negative sign
+            x = np.abs(x)
+        elif abscissa == 'frequency':
+            x = np.real(x)
+        values[abscissa] = x
+
+        return SimulationResult.from_dict(values, abscissa=abscissa)
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}({self.plot_name!r}, '
+                f'variables={len(self.names)}, points={self.n_points})')
+
+
+class RawFile:
+    """
+    Reader for binary SPICE raw files written by ngspice or LTspice.
+
+    Every plot in the file (e.g. several runs written with ngspice's
+    `set appendwrite`) is parsed. The file is memory-mapped, so even very
+    large transient dumps can be opened and sliced without loading them.
+
+    Example:
+        raw = RawFile('LTSpice_include/d_import.raw')
+        raw['V(n002)'][::100]
+
+    Args:
+        path (str):
+            Path to the raw file.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        self.plots = []
+
+        head = bytes(self.buffer[:2])
+        self.encoding = detect_encoding(head)
+        marker = BINARY_MARKERS[self.encoding]
+
+        offset = 0
+        while offset < len(self.buffer):
+            plot = self._read_plot(offset, marker)
+            self.plots.append(plot)
+            if plot.truncated:
+                # Still being written, nothing can follow it yet
+                break
+            offset = plot.end_offset
+
+    def _read_plot(self, offset:int, marker:bytes) -> RawPlot:
+        # Headers are small, so search a bounded window rather than the whole file
+        window = 1 << 16
+        while True:
+            head = bytes(self.buffer[offset:offset + window])
+            location = head.find(marker)
+            if location >= 0 or offset + window >= len(self.buffer):
+                break
+            window *= 4
+        if location < 0:
+            if b'Values:' in head or 'Values:'.encode('utf-16-le') in head:
+                raise ValueError('ASCII raw files are not supported, write with filetype=binary')
+            raise ValueError(f'Cannot locate binary data in {self.path}')
+
+        text = head[:location].decode(self.encoding)
+        header, variables = parse_header(text)
+        is_ltspice = (self.encoding == 'utf-16-le' or 'LTspice' in header.get('Command', ''))
+        return RawPlot(self.buffer, header, variables, offset + location + len(marker), is_ltspice)
+
+    def __getitem__(self, name:str|int) -> np.ndarray:
+        """ Get a trace of the first plot. """
+        return self.plots[0][name]
+
+    def __iter__(self) -> Iterator[RawPlot]:
+        return iter(self.plots)
+
+    def __len__(self) -> int:
+        return len(self.plots)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.path!r}, plots={self.plots})'
+
+
+def parse_header(text:str) -> Tuple[Dict[str, str], List[Tuple[str, str]]]:
+    """
+    Parse the text header of one raw file plot.
+
+    Args:
+        text (str):
+            Decoded header, up to (not including) the 'Binary:' line.
+
+    Returns:
+        tuple: header fields, and the (name, type) of each variable
+    """
+    header = {}
+    variables = []
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if line.startswith('Variables:'):
+            for var_line in lines[i+1:]:
+                parts = var_line.split()
+                if len(parts) >= 3:
+                    variables.append((parts[1], parts[2]))
+            break
+        key, _, value = line.partition(':')
+        header[key.strip()] = value.strip()
+    return header, variables
+
+
+def read_raw(path:str) -> RawFile:
+    """
+    Open a binary SPICE raw file, see `RawFile`.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    return RawFile(path)
+
+
+def read_result(
+    path:str,
+    vectors:Optional[List[str]]=None,
+) -> SimulationResult:
+    """
+    Read the node voltages of the last plot of a raw file (e.g. one written
+    by `ngspice -b -r`), as `format_analysis` would extract them.
+
+    Args:
+        path (str):
+            Path to the raw file.
+        vectors (List[str]):
+            Nodes to include (e.g. ['n3']), or None for all.
+
+    Returns:
+        SimulationResult: columnar results, with the abscissa (if any)
+    """
+    plot = read_raw(path).plots[-1]
+    wanted = output_filter(vectors)
+    first = 0 if plot.abscissa is None else 1
+    names = [name for name, kind in plot.variables[first:]
+             if kind == 'voltage' and (wanted is None or output_key(name) in wanted)]
+    return plot.to_result(names)
@@ -0,0 +1,256 @@
+import numpy as np
+from typing import Dict, Optional, Any, Sequence, Tuple
+
+from utils.measure import WaveformBatch
+
+
+
+RESAMPLE_METHODS = ('linear', 'pchip')
+
+
+def time_span(
+    batch:WaveformBatch,
+    span:str='common',
+) -> Tuple[float, float]:
+    """
+    Time span of a batch of waveforms.
+
+    Args:
+        batch (WaveformBatch):
+            The waveforms.
+        span (str):
+            'common' for the span covered by every waveform,
+            'full' for the span covered by any waveform (the ends
+            of the shorter waveforms are then held constant).
+
+    Returns:
+        tuple: (start, stop) times
+    """
+    if span == 'common':
+        start, stop = float(batch.t0.max()), float(batch.t1.min())
+    elif span == 'full':
+        start, stop = float(batch.t0.min()), float(batch.t1.max())
+    else:
+        raise ValueError("span must be 'common' or 'full'")
+    if stop < start:
+        raise ValueError('The waveforms do not overlap in time')
+    return start, stop
+
+
+def uniform_grid(
+    start:float,
+    stop:float,
+    step:Optional[float]=None,
+    n_samples:Optional[int]=None,
+) -> np.ndarray:
+    """
+    Uniform time grid from start to stop (both included),
+    given either its step or its number of samples.
+    """
+    if step is not None:
+        n_samples = int(np.floor((stop - start) / step + 1e-9)) + 1
+        return start + step * np.arange(n_samples)
+    if n_samples is None:
+        raise ValueError('Give either the grid step or its number of samples')
+    return np.linspace(start, stop, n_samples)
+
+
+def union_grid(
+    batch:WaveformBatch,
+    start:Optional[float]=None,
+    stop:Optional[float]=None,
+    resolution:float=0.0,
+) -> np.ndarray:
+    """
+    Union of the time points of every waveform, so no waveform loses a
+    sample. Its length grows with the batch size, up to the total number
+    of samples, so a uniform grid is preferable for large sweeps.
+
+    Args:
+        batch (WaveformBatch):
+            The waveforms.
+        start (float):
+            Drop the time points before start.
+        stop (float):
+            Drop the time points after stop.
+        resolution (float):
+            Merge time points closer than this, in seconds.
+
+    Returns:
+        np.ndarray: increasing time points
+    """
+    grid = np.unique(batch.time)
+    if start is not None:
+        grid = grid[grid >= start]
+    if stop is not None:
+        grid = grid[grid <= stop]
+    if resolution > 0 and len(grid) > 1:
+        keep = np.concatenate([[True], np.diff(grid) >= resolution])
+        grid = grid[keep]
+    return grid
+
+
+def pchip_slopes(batch:WaveformBatch, node:str) -> np.ndarray:
+    """
+    Fritsch-Carlson (PCHIP) derivative at every sample of every waveform,
+    as scipy's `PchipInterpolator`, computed for the whole batch at once.
+    The interpolant is monotonic between samples, so it does not
+    overshoot at the steps and edges of switching waveforms.
+    """
+    t = batch.time
+    y = batch.values[node]
+    first = batch.offsets[:-1]
+    last = batch.offsets[1:] - 1
+
+    h = np.diff(t)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(h > 0, np.diff(y) / h, 0.0)
+
+    slopes = np.zeros_like(y)
+
+    # Interior samples: weighted harmonic mean of the adjacent secants, 0 at extrema
+    h0, h1 = h[:-1], h[1:]
+    d0, d1 = delta[:-1], delta[1:]
+    w1 = 2 * h1 + h0
+    w2 = h1 + 2 * h0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        interior = np.where(d0 * d1 > 0, (w1 + w2) / (w1 / d0 + w2 / d1), 0.0)
+    slopes[1:-1] = interior
+
+    # End samples: one sided three point estimate, limited to keep monotonicity
+    def edge(h0, h1, d0, d1):
+        d = ((2 * h0 + h1) * d0 - h0 * d1) / (h0 + h1)
+        d = np.where(np.sign(d) != np.sign(d0), 0.0, d)
+        return np.where((np.sign(d0) != np.sign(d1)) & (np.abs(d) > np.abs(3 * d0)), 3 * d0, d)
+
+    short = last - first < 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k0 = first
+        k1 = np.where(short, first, first + 1)
+        slopes[first] = np.where(short, delta[k0], edge(h[k0], h[k1], delta[k0], delta[k1]))
+        # At the end, the intervals are taken backwards from the last sample
+        k0 = last - 1
+        k1 = np.where(short, last - 1, last - 2)
+        slopes[last] = np.where(short, delta[k0], edge(h[k0], h[k1], delta[k0], delta[k1]))
+    return np.nan_to_num(slopes)
+
+
+def resample_batch(
+    batch:WaveformBatch,
+    grid:np.ndarray,
+    nodes:Optional[Sequence[str]]=None,
+    method:str='linear',
+) -> Dict[str, np.ndarray]:
+    """
+    Resample every waveform of a batch onto one time grid.
+
+    All the waveforms are located on the grid with a single `searchsorted`,
+    and interpolated with array operations, rather than row by row.
+    Grid times outside a waveform hold its first or last value.
+
+    Args:
+        batch (WaveformBatch):
+            The waveforms.
+        grid (np.ndarray):
+            Increasing time points (n_time,).
+        nodes (Sequence[str]):
+            Nodes to resample, defaults to every node of the batch.
+        method (str):
+            'linear', or 'pchip' (monotonic cubic Hermite).
+
+    Returns:
+        dict: 'time' (n_time,) and one (n_points, n_time) array per node
+    """
+    if method not in RESAMPLE_METHODS:
+        raise ValueError(f'Unknown method {method}, must be one of {RESAMPLE_METHODS}')
+
+    grid = np.asarray(grid, dtype=np.float64)
+    nodes = list(batch.values) if nodes is None else list(nodes)
+
+    t = grid[np.newaxis, :]
+    t = np.clip(t, batch.rows(batch.t0, t), batch.rows(batch.t1, t))
+    k = batch.locate(t)
+    t0 = batch.time[k]
+    h = batch.time[k+1] - t0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.where(h > 0, (t - t0) / h, 0.0)
+
+    if method == 'pchip':
+        # Cubic Hermite basis functions
+        s2, s3 = s * s, s * s * s
+        h00 = 2 * s3 - 3 * s2 + 1
+        h10 = s3 - 2 * s2 + s
+        h01 = -2 * s3 + 3 * s2
+        h11 = s3 - s2
+
+    res = {'time': grid}
+    for node in nodes:
+        y = batch.values[node]
+        if method == 'linear':
+            res[node] = y[k] + s * (y[k+1] - y[k])
+        else:
+            slopes = pchip_slopes(batch, node)
+            res[node] = h00 * y[k] + h10 * h * slopes[k] + h01 * y[k+1] + h11 * h * slopes[k+1]
+    return res
+
+
+def resample(
+    results:Sequence[Any]|WaveformBatch,
+    nodes:Optional[Sequence[str]]=None,
+    grid:str|np.ndarray='uniform',
+    step:Optional[float]=None,
+    n_samples:Optional[int]=None,
+    method:str='linear',
+    span:str='common',
+    time_key:str='time',
+) -> Dict[str, np.ndarray]:
+    """
+    Put transient results with different (adaptive) time vectors on a common
+    grid, as one dense (n_points, n_time) array per node.
+
+    Example:
+        points = sweep.run()
+        res = resample(points, ['n3'], step=0.0001)
+        res['n3'].shape  # (n_points, n_time)
+
+    Args:
+        results (Sequence | WaveformBatch):
+            One result per sweep point (see `WaveformBatch.from_results`),
+            or a WaveformBatch.
+        nodes (Sequence[str]):
+            Nodes to resample, defaults to every node of the results.
+        grid (str | np.ndarray):
+            'uniform', 'union' (every time point of every result),
+            or an explicit increasing array of time points.
+        step (float):
+            Step of the uniform grid.
+        n_samples (int):
+            Number of samples of the uniform grid, used if no step is given.
+            Defaults to the length of the longest result.
+        method (str):
+            'linear', or 'pchip' (monotonic cubic Hermite).
+        span (str):
+            'common' or 'full' time span of the grid, see `time_span`.
+        time_key (str):
+            Name of the time vector of the results.
+
+    Returns:
+        dict: 'time' (n_time,) and one (n_points, n_time) array per node
+    """
+    if isinstance(results, WaveformBatch):
+        batch = results
+    else:
+        batch = WaveformBatch.from_results(results, nodes, time_key=time_key)
+
+    if isinstance(grid, str):
+        start, stop = time_span(batch, span)
+        if grid == 'uniform':
+            if step is None and n_samples is None:
+                n_samples = int(np.diff(batch.offsets).max())
+            grid = uniform_grid(start, stop, step, n_samples)
+        elif grid == 'union':
+            grid = union_grid(batch, start, stop)
+        else:
+            raise ValueError("grid must be 'uniform', 'union' or an array of time points")
+
+    return resample_batch(batch, grid, nodes, method)
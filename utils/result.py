@@ -0,0 +1,262 @@
+import numpy as np
+import json
+from typing import List, Dict, Optional, Iterator, Tuple
+
+from utils.methods import cast_waveform
+from utils.outputs import output_filter, output_key
+
+
+
+# Analysis attributes which hold the abscissa of a run, in order of preference
+ABSCISSA_NAMES = ('time', 'frequency', 'sweep')
+
+
+def waveform_unit(waveform) -> str:
+    """
+    Get the unit suffix of a PySpice waveform (e.g. 'V', 'A', 's'),
+    or an empty string if the waveform carries no unit.
+    """
+    try:
+        return str(waveform.unit.unit_suffix)
+    except AttributeError:
+        return ''
+
+
+class SimulationResult:
+    """
+    Columnar container for the vectors of a completed SPICE analysis.
+
+    Every vector (node voltages, branch currents and the abscissa, e.g. `time`)
+    is stored as one column of a single contiguous 2-D NumPy block,
+    with shape (n_columns, n_samples).
+    Each column is therefore a contiguous view, and the whole result pickles
+    as one buffer plus a small name index, rather than as many small arrays.
+
+    Unlike `format_analysis`, single point results (e.g. an operating point)
+    are kept as length 1 arrays, so the return type never depends on the data.
+
+    Args:
+        data (np.ndarray):
+            2-D array of shape (n_columns, n_samples).
+        names (List[str]):
+            Name of each column, in order.
+        units (Dict[str, str]):
+            Optional unit suffix of each column (e.g. 'V').
+        abscissa (str):
+            Name of the column holding the abscissa (e.g. 'time'), if any.
+    """
+
+    def __init__(
+        self,
+        data:np.ndarray,
+        names:List[str],
+        units:Optional[Dict[str, str]]=None,
+        abscissa:Optional[str]=None,
+    ):
+        data = np.ascontiguousarray(data)
+        if data.ndim != 2:
+            raise ValueError('Result data must be a 2-D (n_columns, n_samples) array')
+        if data.shape[0] != len(names):
+            raise ValueError(f'Got {len(names)} names for {data.shape[0]} columns')
+        if abscissa is not None and abscissa not in names:
+            raise ValueError(f'Abscissa {abscissa} is not one of the columns')
+
+        self.data = data
+        self.names = [str(name) for name in names]
+        self.columns = {name: i for i, name in enumerate(self.names)}
+        if len(self.columns) != len(self.names):
+            raise ValueError('Column names must be unique')
+        self.units = dict(units) if units is not None else {}
+        self.abscissa = abscissa
+
+    @classmethod
+    def from_analysis(
+        cls,
+        analysis,
+        vectors:Optional[List[str]]=None,
+    ) -> 'SimulationResult':
+        """
+        Build a result from a completed PySpice analysis.
+
+        Args:
+            analysis (pysepice simulation run object):
+                The run analysis
+            vectors (List[str]):
+                Nodes/vectors to keep (e.g. ['n3'], see `utils.outputs`),
+                or None for all. The abscissa is always kept.
+
+        Returns:
+            SimulationResult: columnar analysis results
+        """
+
+        if hasattr(analysis, 'nodes') is False:
+            raise ValueError('Must pass a completed analysis')
+
+        waveforms = {}
+        wanted = output_filter(vectors)
+
+        # Include node voltages, then branch currents
+        for node, waveform in analysis.nodes.items():
+            if wanted is None or output_key(node) in wanted:
+                waveforms[str(node)] = waveform
+        for branch, waveform in analysis.branches.items():
+            if wanted is None or output_key(branch) in wanted:
+                waveforms.setdefault(str(branch), waveform)
+
+        # Include the abscissa if it exists
+        abscissa = None
+        for name in ABSCISSA_NAMES:
+            if hasattr(analysis, name):
+                abscissa = name
+                waveforms[name] = getattr(analysis, name)
+                break
+
+        units = {name: waveform_unit(waveform) for name, waveform in waveforms.items()}
+        return cls.from_dict(waveforms, units=units, abscissa=abscissa)
+
+    @classmethod
+    def from_dict(
+        cls,
+        values:Dict[str|int, np.ndarray|float],
+        units:Optional[Dict[str, str]]=None,
+        abscissa:Optional[str]=None,
+    ) -> 'SimulationResult':
+        """
+        Build a result from a dictionary of equal length arrays
+        (or floats), such as the output of `format_analysis`.
+
+        Args:
+            values (dict):
+                Vector name to array (or single float) mapping.
+            units (dict):
+                Optional unit suffix of each vector.
+            abscissa (str):
+                Name of the abscissa vector, if any.
+                If not given, 'time' or 'frequency' is used if present.
+
+        Returns:
+            SimulationResult: columnar analysis results
+        """
+        names = [str(name) for name in values.keys()]
+        arrays = [np.atleast_1d(np.asarray(v)) for v in values.values()]
+
+        lengths = {len(a) for a in arrays}
+        if len(lengths) > 1:
+            raise ValueError(f'All vectors must have the same length, got lengths {sorted(lengths)}')
+        n_samples = lengths.pop() if lengths else 0
+
+        # One allocation for the whole block, complex only if needed
+        dtype = np.result_type(np.float64, *[a.dtype for a in arrays])
+        data = np.empty((len(arrays), n_samples), dtype=dtype)
+        for i, a in enumerate(arrays):
+            data[i] = a
+
+        if abscissa is None:
+            abscissa = next((n for n in ABSCISSA_NAMES if n in names), None)
+
+        return cls(data, names, units=units, abscissa=abscissa)
+
+    @property
+    def n_samples(self) -> int:
+        """ Number of samples (points) in each vector. """
+        return self.data.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        """ Size of the data block in bytes. """
+        return self.data.nbytes
+
+    @property
+    def x(self) -> Optional[np.ndarray]:
+        """ The abscissa vector (e.g. time), or None. """
+        if self.abscissa is None:
+            return None
+        return self[self.abscissa]
+
+    def __getitem__(self, name:str|int) -> np.ndarray:
+        try:
+            return self.data[self.columns[str(name)]]
+        except KeyError:
+            raise KeyError(name) from None
+
+    def __contains__(self, name) -> bool:
+        return str(name) in self.columns
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def keys(self) -> List[str]:
+        return list(self.names)
+
+    def values(self) -> List[np.ndarray]:
+        return [self.data[i] for i in range(len(self.names))]
+
+    def items(self) -> List[Tuple[str, np.ndarray]]:
+        return [(name, self.data[i]) for i, name in enumerate(self.names)]
+
+    def to_dict(
+        self,
+        cast:bool=True,
+    ) -> Dict[str, np.ndarray|float]:
+        """
+        Convert to the dictionary format returned by `format_analysis`.
+
+        Args:
+            cast (bool):
+                Whether to convert single point vectors to a float
+                (as `cast_waveform` does), otherwise arrays are returned.
+
+        Returns:
+            dict: analysis results dictionary
+        """
+        if cast:
+            return {name: cast_waveform(column) for name, column in self.items()}
+        return dict(self.items())
+
+    def save(self, path:str):
+        """
+        Save to disk as a raw `.npy` block plus a small `.json` index,
+        so that it can be loaded back memory-mapped.
+
+        Args:
+            path (str):
+                Path without extension, '<path>.npy' and '<path>.json' are written.
+        """
+        np.save(path + '.npy', self.data)
+        with open(path + '.json', 'w') as f:
+            json.dump({'names': self.names, 'units': self.units, 'abscissa': self.abscissa}, f)
+
+    @classmethod
+    def load(
+        cls,
+        path:str,
+        mmap_mode:Optional[str]='r',
+    ) -> 'SimulationResult':
+        """
+        Load a result written by `save`.
+
+        Args:
+            path (str):
+                Path without extension.
+            mmap_mode (str):
+                NumPy memory-map mode, 'r' by default so nothing is read
+                until it is used. None loads the block into memory.
+
+        Returns:
+            SimulationResult: columnar analysis results
+        """
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        data = np.load(path + '.npy', mmap_mode=mmap_mode)
+        return cls(data, meta['names'], units=meta['units'], abscissa=meta['abscissa'])
+
+    def __reduce__(self):
+        # The block is pickled as a single buffer (out-of-band with protocol 5)
+        return (self.__class__, (self.data, self.names, self.units, self.abscissa))
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}(columns={self.names}, '
+                f'n_samples={self.n_samples}, dtype={self.data.dtype})')
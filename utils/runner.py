@@ -0,0 +1,471 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Optional, Any, Callable, Iterator, Sequence, Tuple
+
+from PySpice.Spice.Netlist import Circuit
+
+from utils.methods import render_netlist
+from utils.outputs import add_saves
+from utils.rawfile import read_result
+from utils.result import SimulationResult
+from utils.sweep import ANALYSES, DEFAULT_SIMULATOR_KWARGS, SweepPoint, parameter_grid
+
+
+
+SPICE_COMMAND = 'ngspice'
+
+# ngspice options of each successive attempt at a point: the first as rendered,
+# then with looser tolerances, more iterations, gmin and source stepping,
+# and finally gear integration
+RETRY_OPTIONS = (
+    {},
+    {'reltol': 0.003, 'itl1': 500, 'itl4': 50, 'gminsteps': 100, 'srcsteps': 100},
+    {'reltol': 0.01, 'abstol': 1e-10, 'vntol': 1e-4, 'gmin': 1e-10, 'itl1': 1000, 'itl4': 100,
+     'gminsteps': 100, 'srcsteps': 100, 'method': 'gear'},
+)
+
+# Extra time a worker is given, beyond the point timeout, before it is considered stuck
+WATCHDOG_GRACE = 30.0
+
+
+def add_options(deck:str, options:Optional[Dict[str, Any]]) -> str:
+    """
+    Add an `.options` line to a rendered deck, e.g. {'reltol': 0.01} -> '.options reltol=0.01'.
+    """
+    if not options:
+        return deck
+    line = '.options ' + ' '.join(f'{key}={value}' for key, value in options.items())
+    head, _, _ = deck.rpartition('.end')
+    return head + line + os.linesep + '.end' + os.linesep
+
+
+def run_deck(
+    deck:str,
+    timeout:Optional[float]=None,
+    vectors:Optional[Sequence[str]]=None,
+    spice_command:str=SPICE_COMMAND,
+) -> SimulationResult:
+    """
+    Run a deck with `ngspice -b`, killing it if it runs over the timeout.
+
+    Args:
+        deck (str):
+            SPICE deck, with its analysis line and `filetype=binary`.
+        timeout (float):
+            Time limit in seconds, None for no limit.
+        vectors (Sequence[str]):
+            Nodes to return, or None for all.
+        spice_command (str):
+            ngspice executable.
+
+    Returns:
+        SimulationResult: columnar analysis results
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, 'deck.cir'), 'w') as f:
+            f.write(deck)
+        # subprocess.run kills ngspice before raising TimeoutExpired
+        process = subprocess.run(
+            (spice_command, '-b', '-r', 'output.raw', 'deck.cir'),
+            cwd=workdir,
+            capture_output=True,
+            timeout=timeout,
+        )
+        output_path = os.path.join(workdir, 'output.raw')
+        if process.returncode != 0 or not os.path.exists(output_path):
+            raise NameError('Simulation failed, ngspice returned:' + os.linesep +
+                            process.stdout.decode('utf-8', 'replace') +
+                            process.stderr.decode('utf-8', 'replace'))
+        result = read_result(output_path, vectors)
+    return result
+
+
+class Checkpoint:
+    """
+    On-disk record of the completed points of a sweep, so it can resume.
+
+    The directory holds:
+        - 'sweep.json': a signature of the sweep, checked on resume.
+        - 'journal.jsonl': one line per completed (or finally failed) point,
+          appended and flushed as soon as the point finishes.
+        - 'results/<index>': each point's SimulationResult (see `SimulationResult.save`),
+          written before its journal line.
+
+    A line cut short by a crash is ignored, and that point is simply run again.
+
+    Args:
+        directory (str):
+            Checkpoint directory, created if needed.
+        signature (str):
+            Hash of the sweep definition.
+    """
+
+    def __init__(self, directory:str, signature:str):
+        self.directory = directory
+        self.journal_path = os.path.join(directory, 'journal.jsonl')
+        self.results_dir = os.path.join(directory, 'results')
+        os.makedirs(self.results_dir, exist_ok=True)
+
+        sweep_path = os.path.join(directory, 'sweep.json')
+        if os.path.exists(sweep_path):
+            with open(sweep_path) as f:
+                previous = json.load(f)['signature']
+            if previous != signature:
+                raise ValueError(f'The checkpoint in {directory} belongs to a different sweep')
+        else:
+            with open(sweep_path, 'w') as f:
+                json.dump({'signature': signature}, f)
+
+        self.entries = self._read_journal()
+        self._journal = open(self.journal_path, 'a')
+
+    def _read_journal(self) -> Dict[int, Dict[str, Any]]:
+        entries = {}
+        if not os.path.exists(self.journal_path):
+            return entries
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line
+                entries[entry['index']] = entry
+        return entries
+
+    def result_path(self, index:int) -> str:
+        return os.path.join(self.results_dir, str(index))
+
+    def record(self, entry:Dict[str, Any], result:Optional[SimulationResult]=None):
+        """ Save a point's result (if any), then append its journal entry. """
+        if result is not None:
+            result.save(self.result_path(entry['index']))
+        self._journal.write(json.dumps(entry) + '\n')
+        self._journal.flush()
+        self.entries[entry['index']] = entry
+
+    def load(self, index:int) -> SimulationResult:
+        return SimulationResult.load(self.result_path(index))
+
+    def close(self):
+        self._journal.close()
+
+
+def sweep_signature(*parts) -> str:
+    """ Hash of the JSON form of the parts that define a sweep. """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+# Runner held by each pool worker, set once by the initializer
+_worker_runner = None
+
+
+def _init_worker(runner:'SweepRunner'):
+    global _worker_runner
+    _worker_runner = runner
+
+
+def _run_worker_attempt(task) -> Tuple[str, Optional[SimulationResult], str, float]:
+    index, attempt = task
+    return _worker_runner.run_attempt(index, attempt)
+
+
+class SweepRunner:
+    """
+    Fault tolerant parameter sweep, for long sweeps that must not hang or lose work.
+
+    - Each point runs `ngspice -b` in its own subprocess, which is killed if
+      it runs over `timeout`, so a non-converging point cannot hang the sweep.
+    - A point that fails or times out is retried with the next, more relaxed,
+      set of `retry_options` (tolerances, gmin and source stepping, gear).
+    - Worker processes that crash (or, past `timeout` plus a grace period,
+      hang outside ngspice) are killed and the pool restarted; the points
+      they held are run again.
+    - With a checkpoint directory, every finished point is saved as it
+      completes; running the same sweep again resumes where it stopped.
+
+    Example:
+        runner = SweepRunner(build_circuit, {'r': sweep_resistors},
+                             analysis_kwargs=dict(step_time=0.0001, end_time=0.1),
+                             checkpoint_dir='sweep_checkpoint', timeout=60)
+        summary = runner.run()
+        points = list(runner.completed())
+
+    Args:
+        factory (Callable):
+            Module level function returning a PySpice Circuit, called as `factory(**point)`.
+        parameters (dict):
+            Parameter name to sequence of values.
+        analysis (str):
+            Analysis method name, e.g. 'transient'.
+        analysis_kwargs (dict):
+            Keyword arguments of the analysis.
+        mode (str):
+            'product' (Cartesian) or 'zip' combination of the parameters.
+        simulator_kwargs (dict):
+            Keyword arguments as passed to `circuit.simulator()`.
+        vectors (Sequence[str]):
+            Nodes to save and return, or None for all.
+        checkpoint_dir (str):
+            Directory to checkpoint to and resume from, None to keep results in memory.
+        timeout (float):
+            Time limit of each attempt at a point, in seconds.
+        retry_options (Sequence[dict]):
+            ngspice options of each attempt, the number of attempts is its length.
+        processes (int):
+            Number of worker processes, defaults to the number of CPUs.
+        spice_command (str):
+            ngspice executable.
+        retry_failed (bool):
+            On resume, run again the points that failed every attempt last time.
+    """
+
+    def __init__(
+        self,
+        factory:Callable[..., Circuit],
+        parameters:Dict[str, Sequence],
+        analysis:str='transient',
+        analysis_kwargs:Optional[Dict[str, Any]]=None,
+        mode:str='product',
+        simulator_kwargs:Optional[Dict[str, Any]]=None,
+        vectors:Optional[Sequence[str]]=None,
+        checkpoint_dir:Optional[str]=None,
+        timeout:float=60.0,
+        retry_options:Sequence[Dict[str, Any]]=RETRY_OPTIONS,
+        processes:Optional[int]=None,
+        spice_command:str=SPICE_COMMAND,
+        retry_failed:bool=False,
+    ):
+        if analysis not in ANALYSES:
+            raise ValueError(f'Unknown analysis {analysis}, must be one of {ANALYSES}')
+        if not retry_options:
+            raise ValueError('At least one set of options (e.g. {}) is needed')
+
+        self.factory = factory
+        self.points = parameter_grid(parameters, mode=mode)
+        self.analysis = analysis
+        self.analysis_kwargs = dict(analysis_kwargs or {})
+        self.simulator_kwargs = dict(simulator_kwargs or DEFAULT_SIMULATOR_KWARGS)
+        self.vectors = list(vectors) if vectors else None
+        self.timeout = timeout
+        self.retry_options = [dict(options) for options in retry_options]
+        self.processes = processes or os.cpu_count() or 1
+        self.spice_command = spice_command
+        self.retry_failed = retry_failed
+
+        self.checkpoint = None
+        if checkpoint_dir is not None:
+            signature = sweep_signature(
+                getattr(factory, '__qualname__', str(factory)), self.points, analysis,
+                self.analysis_kwargs, self.simulator_kwargs, self.vectors,
+            )
+            self.checkpoint = Checkpoint(checkpoint_dir, signature)
+        self.entries = dict(self.checkpoint.entries) if self.checkpoint is not None else {}
+        self._results = {}
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def render(self, index:int, attempt:int=0) -> str:
+        """ Deck of a point, with the options of the given attempt. """
+        circuit = self.factory(**self.points[index])
+        # pipe=True adds `filetype=binary`, the raw file format read back
+        deck = render_netlist(circuit, self.analysis, self.analysis_kwargs, self.simulator_kwargs, pipe=True)
+        return add_options(add_saves(deck, self.vectors), self.retry_options[attempt])
+
+    def run_attempt(self, index:int, attempt:int) -> Tuple[str, Optional[SimulationResult], str, float]:
+        """
+        Run one attempt at a point, in this process.
+
+        Returns:
+            tuple: (status, result, error, elapsed), status is 'ok', 'timeout' or 'error'
+        """
+        tic = time.perf_counter()
+        try:
+            result = run_deck(self.render(index, attempt), self.timeout, self.vectors, self.spice_command)
+            return 'ok', result, '', time.perf_counter() - tic
+        except subprocess.TimeoutExpired:
+            return 'timeout', None, f'Timed out after {self.timeout} s', time.perf_counter() - tic
+        except Exception as e:
+            return 'error', None, f'{type(e).__name__}: {e}', time.perf_counter() - tic
+
+    def pending(self) -> List[int]:
+        """ Indices of the points still to run. """
+        done = {index for index, entry in self.entries.items()
+                if entry['status'] == 'ok' or not self.retry_failed}
+        return [index for index in range(len(self.points)) if index not in done]
+
+    def _record(self, index:int, attempt:int, status:str, result, error:str, elapsed:float):
+        entry = {
+            'index': index,
+            'parameters': self.points[index],
+            'status': 'ok' if status == 'ok' else 'failed',
+            'attempts': attempt + 1,
+            'options': self.retry_options[attempt],
+            'error': error,
+            'elapsed': elapsed,
+            'pid': os.getpid(),
+        }
+        if self.checkpoint is not None:
+            self.checkpoint.record(entry, result)
+        elif result is not None:
+            self._results[index] = result
+        self.entries[index] = entry
+
+    def run(
+        self,
+        callback:Optional[Callable[[Dict[str, Any]], None]]=None,
+    ) -> Dict[str, int]:
+        """
+        Run every pending point (all of them, unless resuming).
+
+        Args:
+            callback (Callable):
+                Called with each point's journal entry as it completes,
+                e.g. to report progress.
+
+        Returns:
+            dict: number of points 'ok', 'failed', 'resumed' (done before this run)
+            and 'restarts' (worker pools restarted)
+        """
+        queue = [(index, 0) for index in self.pending()]
+        queue.reverse()  # pop() from the end runs the points in order
+        resumed = len(self.points) - len(queue)
+        restarts = 0
+        started = {}
+
+        def finish(task, outcome):
+            index, attempt = task
+            status, result, error, elapsed = outcome
+            if status != 'ok' and attempt + 1 < len(self.retry_options):
+                queue.append((index, attempt + 1))
+                return
+            self._record(index, attempt, status, result, error, elapsed)
+            if callback is not None:
+                callback(self.entries[index])
+
+        if self.processes == 1:
+            while queue:
+                task = queue.pop()
+                finish(task, self.run_attempt(*task))
+            return self._summary(resumed, restarts)
+
+        # A point stuck beyond this is treated as a hung worker
+        deadline = (self.timeout or 0) + WATCHDOG_GRACE
+
+        # Points in flight when a worker died: the culprit is unknown,
+        # so they are run again one at a time, outside of any attempt count
+        suspects = []
+
+        executor = None
+        try:
+            while queue or suspects or started:
+                if executor is None:
+                    executor = concurrent.futures.ProcessPoolExecutor(
+                        self.processes, initializer=_init_worker, initargs=(self,))
+
+                # Keep one point per worker in flight, so submission time is start time
+                if suspects:
+                    if not started:
+                        task = suspects.pop()
+                        started[executor.submit(_run_worker_attempt, task)] = (task, time.monotonic())
+                else:
+                    while queue and len(started) < self.processes:
+                        task = queue.pop()
+                        started[executor.submit(_run_worker_attempt, task)] = (task, time.monotonic())
+
+                done, _ = concurrent.futures.wait(started, timeout=1.0,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                in_flight = len(started)
+                lost = []
+                for future in done:
+                    task, _ = started.pop(future)
+                    try:
+                        finish(task, future.result())
+                    except BrokenProcessPool:
+                        lost.append(task)
+
+                now = time.monotonic()
+                stuck = [f for f, (_, tic) in started.items() if now - tic > deadline]
+                if not lost and not stuck:
+                    continue
+
+                # Kill every worker and restart the pool
+                for future in stuck:
+                    task, tic = started.pop(future)
+                    finish(task, ('timeout', None, 'Worker hung', now - tic))
+                lost.extend(task for task, _ in started.values())
+                started.clear()
+                if stuck:
+                    queue.extend(lost)
+                elif in_flight == 1:
+                    finish(lost[0], ('error', None, 'Worker process died', 0.0))
+                else:
+                    suspects.extend(lost)
+                _kill_executor(executor)
+                executor = None
+                restarts += 1
+        finally:
+            if executor is not None:
+                _kill_executor(executor)
+
+        return self._summary(resumed, restarts)
+
+    def _summary(self, resumed:int, restarts:int) -> Dict[str, int]:
+        statuses = [entry['status'] for entry in self.entries.values()]
+        return {
+            'ok': statuses.count('ok'),
+            'failed': statuses.count('failed'),
+            'resumed': resumed,
+            'restarts': restarts,
+        }
+
+    def load(self, index:int) -> SimulationResult:
+        """ Result of a completed point (memory-mapped from the checkpoint, if any). """
+        if self.checkpoint is not None:
+            return self.checkpoint.load(index)
+        return self._results[index]
+
+    def completed(self) -> Iterator[SweepPoint]:
+        """
+        Lazily yield the successful points, in sweep order.
+        """
+        for index in sorted(self.entries):
+            entry = self.entries[index]
+            if entry['status'] == 'ok':
+                yield SweepPoint(index, self.points[index], self.load(index), entry['elapsed'], pid=entry['pid'])
+
+    def failures(self) -> List[Dict[str, Any]]:
+        """ Journal entries of the points that failed every attempt. """
+        return [entry for _, entry in sorted(self.entries.items()) if entry['status'] == 'failed']
+
+    def close(self):
+        """ Close the checkpoint journal. """
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+
+    def __getstate__(self):
+        # Workers only run attempts: leave the journal and results behind
+        state = dict(self.__dict__)
+        state['checkpoint'] = None
+        state['_results'] = {}
+        state['entries'] = {}
+        return state
+
+
+def _kill_executor(executor:concurrent.futures.ProcessPoolExecutor):
+    """
+    Shut down a process pool without waiting for its running tasks,
+    killing the workers (a hung worker would never return on its own).
+    """
+    processes = list(getattr(executor, '_processes', {}).values())
+    for process in processes:
+        process.kill()
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.join()
@@ -0,0 +1,195 @@
+import numpy as np
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import List, Dict, Optional
+
+from PySpice.Spice.Netlist import Circuit
+
+from utils.result import SimulationResult
+
+
+
+# Elements whose current ngspice saves as a branch vector (e.g. vinput#branch)
+BRANCH_PREFIXES = ('V', 'L', 'E', 'H')
+
+
+def max_result_columns(circuit:Circuit) -> int:
+    """
+    Upper bound on the number of columns of a circuit's SimulationResult,
+    when every vector is saved: the abscissa, every node and branch current.
+    """
+    nodes = [name for name in circuit.node_names if str(name) != '0']
+    branches = [e for e in circuit.elements if e.PREFIX in BRANCH_PREFIXES]
+    return len(nodes) + len(branches) + 1
+
+
+@dataclass
+class SharedLayout:
+    """
+    What a worker sends back instead of a result written to a
+    `SharedResultBuffer`: enough to read its slot back.
+
+    Args:
+        names (List[str]):
+            Name of each column, in order.
+        units (Dict[str, str]):
+            Unit suffix of each column.
+        abscissa (str):
+            Name of the abscissa column, if any.
+        n_samples (int):
+            Number of samples of each column.
+    """
+    names: List[str]
+    units: Dict[str, str]
+    abscissa: Optional[str]
+    n_samples: int
+
+
+class _Mapping:
+    """
+    Array interface of a shared memory block. Every array viewing the block
+    references this object, so the block is only closed once the last view
+    is gone (closing it earlier would invalidate them).
+    """
+
+    def __init__(self, shm:shared_memory.SharedMemory, shape:tuple, dtype:np.dtype):
+        self.shm = shm
+        address = np.frombuffer(shm.buf, dtype=np.uint8).ctypes.data
+        self.__array_interface__ = {'shape': shape, 'typestr': dtype.str, 'data': (address, False), 'version': 3}
+
+
+class SharedResultBuffer:
+    """
+    One shared memory block holding the results of a whole sweep, so
+    pool workers write their waveforms in place instead of pickling them
+    back through a pipe.
+
+    Each point owns a fixed slot of n_columns * n_samples values. A result
+    is packed at the start of its slot as a contiguous (n_columns, n_samples)
+    block, so it is read back as a zero-copy `SimulationResult` view. Shorter
+    results leave the end of their slot untouched, which costs no memory on
+    Linux as shared memory pages are only allocated once written.
+
+    The creating process owns the block and unlinks it; workers attach to
+    it by name (the buffer pickles as its name and shape).
+
+    Example:
+        buffer = SharedResultBuffer(len(points), n_columns=3, n_samples=20000)
+        layout = buffer.write(index, result)  # in a worker
+        result = buffer.read(index, layout)   # in the parent
+        buffer.unlink()
+
+    Args:
+        n_points (int):
+            Number of slots.
+        n_columns (int):
+            Largest number of columns of a result.
+        n_samples (int):
+            Largest number of samples of a result.
+        dtype (np.dtype):
+            Element type, e.g. complex for AC results.
+        name (str):
+            Name of an existing block to attach to, otherwise one is created.
+    """
+
+    def __init__(
+        self,
+        n_points:int,
+        n_columns:int,
+        n_samples:int,
+        dtype:np.dtype=np.float64,
+        name:Optional[str]=None,
+    ):
+        self.n_points = n_points
+        self.n_columns = n_columns
+        self.n_samples = n_samples
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+
+        shape = (n_points, n_columns * n_samples)
+        size = max(1, int(np.prod(shape)) * self.dtype.itemsize)
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.array = np.asarray(_Mapping(self.shm, shape, self.dtype))
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def nbytes(self) -> int:
+        return self.array.nbytes
+
+    def __len__(self) -> int:
+        return self.n_points
+
+    def fits(self, result:SimulationResult) -> bool:
+        """ Whether a result can be written to a slot. """
+        return (len(result) <= self.n_columns and result.n_samples <= self.n_samples
+                and np.can_cast(result.data.dtype, self.dtype))
+
+    def write(
+        self,
+        index:int,
+        result:SimulationResult,
+    ) -> Optional[SharedLayout]:
+        """
+        Copy a result into its slot.
+
+        Args:
+            index (int):
+                Slot of the result, i.e. its position in the sweep.
+            result (SimulationResult):
+                The result.
+
+        Returns:
+            SharedLayout: to pass to `read`, or None if the result does not fit
+        """
+        if not self.fits(result):
+            return None
+        size = len(result) * result.n_samples
+        self.array[index, :size].reshape(result.data.shape)[...] = result.data
+        return SharedLayout(list(result.names), dict(result.units), result.abscissa, result.n_samples)
+
+    def read(
+        self,
+        index:int,
+        layout:SharedLayout,
+    ) -> SimulationResult:
+        """
+        The result of a slot, as a view of the shared block (no copy).
+
+        Args:
+            index (int):
+                Slot of the result.
+            layout (SharedLayout):
+                As returned by `write`.
+
+        Returns:
+            SimulationResult: columnar analysis results
+        """
+        size = len(layout.names) * layout.n_samples
+        data = self.array[index, :size].reshape(len(layout.names), layout.n_samples)
+        return SimulationResult(data, layout.names, units=layout.units, abscissa=layout.abscissa)
+
+    def unlink(self):
+        """
+        Remove the block's name, so it is freed once every process has
+        dropped it. Views already read in this process stay valid.
+        """
+        if self.owner:
+            self.shm.unlink()
+            self.owner = False
+
+    def __enter__(self) -> 'SharedResultBuffer':
+        return self
+
+    def __exit__(self, *args):
+        self.unlink()
+
+    def __reduce__(self):
+        # Workers attach to the block by name rather than copying it
+        return (self.__class__, (self.n_points, self.n_columns, self.n_samples, self.dtype.str, self.name))
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}(name={self.name}, n_points={self.n_points}, '
+                f'n_columns={self.n_columns}, n_samples={self.n_samples}, dtype={self.dtype})')
@@ -0,0 +1,243 @@
+import numpy as np
+from typing import List, Dict, Optional, Any, Tuple
+
+import scipy.sparse
+from scipy.sparse.linalg import splu
+from PySpice.Spice.Netlist import Circuit
+
+from utils.mna import MNASystem
+from utils.newton import NewtonSystem
+
+
+
+class SparsePattern:
+    """
+    Fixed CSC structure of a matrix assembled from stamped triplets.
+
+    The structure, and where every triplet lands in it, is computed once.
+    Assembling a matrix with new values is then a single `np.bincount`
+    into the data array, with no sorting or duplicate summing.
+
+    Args:
+        rows (np.ndarray):
+            Row of every triplet (duplicates are summed).
+        cols (np.ndarray):
+            Column of every triplet.
+        shape (tuple):
+            Matrix shape.
+    """
+
+    def __init__(
+        self,
+        rows:np.ndarray,
+        cols:np.ndarray,
+        shape:Tuple[int, int],
+    ):
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.cols = np.asarray(cols, dtype=np.int64)
+        self.shape = shape
+
+        # Column major key, so the unique entries come out in CSC order
+        keys, self.slot = np.unique(self.cols * shape[0] + self.rows, return_inverse=True)
+        self.nnz = len(keys)
+        self.indices = (keys % shape[0]).astype(np.int32)
+        self.indptr = np.searchsorted(keys // shape[0], np.arange(shape[1] + 1)).astype(np.int32)
+
+    def __len__(self) -> int:
+        """ Number of triplets. """
+        return len(self.slot)
+
+    def data(self, values:np.ndarray) -> np.ndarray:
+        """ CSC data array of the triplet values (summing duplicates). """
+        if np.iscomplexobj(values):
+            return self.data(values.real) + 1j * self.data(values.imag)
+        return np.bincount(self.slot, weights=values, minlength=self.nnz)
+
+    def assemble(self, values:np.ndarray) -> scipy.sparse.csc_array:
+        """ The matrix with the given value of every triplet. """
+        return scipy.sparse.csc_array((self.data(values), self.indices, self.indptr), shape=self.shape)
+
+    def permute(self, perm:np.ndarray) -> 'SparsePattern':
+        """ Pattern of the same triplets, with row and column i moved to perm[i]. """
+        return SparsePattern(perm[self.rows], perm[self.cols], self.shape)
+
+
+class SparseLU:
+    """
+    Repeated sparse LU factorisation of matrices sharing one pattern.
+
+    SciPy's SuperLU does not expose a separate symbolic factorisation, so
+    what is reused is its value independent part: the fill reducing
+    ordering is computed on the first factorisation only. Later matrices
+    are assembled directly into the pattern of P^T A P, which keeps the
+    MNA diagonal on the diagonal, and factorised with the natural ordering;
+    only the numerical factorisation (with partial pivoting) runs.
+
+    Args:
+        pattern (SparsePattern):
+            The shared pattern.
+        permc_spec (str):
+            SuperLU ordering of the first factorisation. The default suits
+            MNA matrices, whose structure is nearly symmetric.
+    """
+
+    def __init__(
+        self,
+        pattern:SparsePattern,
+        permc_spec:str='MMD_AT_PLUS_A',
+    ):
+        self.pattern = pattern
+        self.permc_spec = permc_spec
+        self.perm_c: Optional[np.ndarray] = None
+        self.permuted: Optional[SparsePattern] = None
+        self.lu = None
+        # Whether the factorised matrix is the permuted one
+        self.ordered = False
+        self.factorizations = 0
+
+    def factorize(self, values:np.ndarray) -> 'SparseLU':
+        """
+        Factorise the matrix with the given triplet values.
+
+        Raises:
+            NameError: if the matrix is singular
+        """
+        try:
+            if self.perm_c is None:
+                self.lu = splu(self.pattern.assemble(values), permc_spec=self.permc_spec)
+                self.perm_c = self.lu.perm_c.copy()
+                self.permuted = self.pattern.permute(self.perm_c)
+                self.ordered = False
+            else:
+                self.lu = splu(self.permuted.assemble(values), permc_spec='NATURAL')
+                self.ordered = True
+        except RuntimeError as e:
+            raise NameError('Simulation failed, the MNA matrix is singular') from e
+        self.factorizations += 1
+        return self
+
+    def solve(self, b:np.ndarray) -> np.ndarray:
+        """ Solve for one (n,) or many (n, k) right hand sides. """
+        b = np.asarray(b, dtype=np.result_type(b, self.lu.L.dtype))
+        if not self.ordered:
+            return self.lu.solve(b)
+        inverse = np.empty_like(self.perm_c)
+        inverse[self.perm_c] = np.arange(len(inverse))
+        return self.lu.solve(b[inverse])[self.perm_c]
+
+
+class SparseSystem(NewtonSystem):
+    """
+    `NewtonSystem` (and `MNASystem`) analyses on sparse matrices, for large
+    netlists (e.g. power grids or ladders of 10^4 to 10^5 nodes).
+
+    Memory scales with the number of nonzeros rather than n^2: the matrix
+    is never stacked or densified. One `SparsePattern` covers every entry
+    any analysis can touch (the linear elements, the shunt diagonal used
+    by gmin stepping, and the diode stamps), so a single `SparseLU` and
+    its column ordering are reused across Newton iterations, time steps,
+    sweep points and frequencies. Points are solved one after the other.
+
+    Example:
+        system = SparseSystem(build_ladder(20000))
+        res = system.ac(start_frequency=1, stop_frequency=1e6, number_of_points=20)
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit, as for `NewtonSystem`.
+        temperature (float):
+            Circuit temperature, in Celsius.
+        options (dict):
+            Overrides of `utils.newton.DEFAULT_OPTIONS`.
+        permc_spec (str):
+            SuperLU ordering, computed once, see `SparseLU`.
+    """
+
+    def __init__(
+        self,
+        circuit:Circuit,
+        temperature:float=25.0,
+        options:Optional[Dict[str, Any]]=None,
+        permc_spec:str='MMD_AT_PLUS_A',
+    ):
+        super().__init__(circuit, temperature, options)
+        n_nodes = len(self.nodes)
+
+        # Two terminal stamps of the diode junctions and series resistances
+        pairs = []
+        for d in self.diodes:
+            pairs.append((d['junction'], d['cathode']))
+            if d['series']:
+                pairs.append((d['anode'], d['junction']))
+
+        # Triplets: G stamps, C stamps, shunt diagonal, then the device pairs
+        rows = [self.g_stamps[0], self.c_stamps[0], np.arange(n_nodes)]
+        cols = [self.g_stamps[1], self.c_stamps[1], np.arange(n_nodes)]
+        self.n_linear = len(self.g_stamps[0]) + len(self.c_stamps[0])
+        offset = self.n_linear + n_nodes
+        self.pair_slots: Dict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]] = {}
+        for i, j in dict.fromkeys(pairs):
+            entries = [(r, c, s) for r, c, s in ((i, i, 1.0), (j, j, 1.0), (i, j, -1.0), (j, i, -1.0))
+                       if r >= 0 and c >= 0]
+            rows.append(np.array([r for r, _, _ in entries]))
+            cols.append(np.array([c for _, c, _ in entries]))
+            self.pair_slots[(i, j)] = (offset + np.arange(len(entries)), np.array([s for _, _, s in entries]))
+            offset += len(entries)
+
+        self.pattern = SparsePattern(np.concatenate(rows), np.concatenate(cols), (self.size, self.size))
+        self.lu = SparseLU(self.pattern, permc_spec)
+
+    def linear_values(self, alpha:float|complex=0.0) -> np.ndarray:
+        """ Linear triplet values of G + alpha*C, the form of `linear` for this system. """
+        return np.concatenate([self.g_stamps[2], alpha * self.c_stamps[2]])
+
+    def values(self, linear:np.ndarray) -> np.ndarray:
+        """ Triplet values of the whole pattern, from linear triplet values. """
+        return np.concatenate([linear, np.zeros(len(self.pattern) - self.n_linear, dtype=linear.dtype)])
+
+    def linear_base(self, linear:Optional[np.ndarray], shunt:float) -> np.ndarray:
+        """
+        Triplet values (n_points or 1, n_triplets) of the linear elements and shunt
+        conductances. `linear` holds per point linear triplet values, see `linear_values`.
+        """
+        linear = self.linear_values()[np.newaxis] if linear is None else np.atleast_2d(linear)
+        base = np.concatenate([linear, np.zeros((len(linear), len(self.pattern) - self.n_linear))], axis=1)
+        base[:, self.n_linear:self.n_linear + len(self.nodes)] += shunt
+        return base
+
+    def solve_linearized(
+        self,
+        base:np.ndarray,
+        conductances:List[Tuple[int, int, np.ndarray]],
+        rhs:np.ndarray,
+    ) -> np.ndarray:
+        values = base.copy() if len(base) == len(rhs) else np.repeat(base, len(rhs), axis=0)
+        for i, j, g in conductances:
+            slots, signs = self.pair_slots[(i, j)]
+            values[:, slots] += g[:, np.newaxis] * signs[np.newaxis, :]
+
+        x = np.empty_like(rhs)
+        for p in range(len(rhs)):
+            x[p] = self.lu.factorize(values[p]).solve(rhs[p])
+        return x
+
+    def solve_dc(self, B:np.ndarray) -> np.ndarray:
+        return self.lu.factorize(self.values(self.linear_values())).solve(B)
+
+    def solve_ac(self, frequency:np.ndarray) -> np.ndarray:
+        b = self.rhs(ac=True)
+        x = np.empty((self.size, len(frequency)), dtype=np.complex128)
+        for k, f in enumerate(np.asarray(frequency, dtype=np.float64)):
+            x[:, k] = self.lu.factorize(self.values(self.linear_values(2j * np.pi * f))).solve(b)
+        return x
+
+    def operating_point(self, parameters=None, cast:bool=True, strict:bool=True) -> Dict[str, np.ndarray|float]:
+        # A linear circuit needs one factorisation, not Newton iterations
+        if self.diodes or parameters:
+            return super().operating_point(parameters, cast, strict)
+        return MNASystem.operating_point(self, cast)
+
+    def dc(self, parameters=None, strict:bool=True, **kwargs) -> Dict[str, np.ndarray]:
+        if self.diodes or parameters:
+            return super().dc(parameters, strict, **kwargs)
+        return MNASystem.dc(self, **kwargs)
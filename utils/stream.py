@@ -0,0 +1,423 @@
+import numpy as np
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+from typing import List, Dict, Optional, Any, Iterator, Sequence, Tuple
+
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Spice.NgSpice.Shared import NgSpiceShared, ffi
+
+from utils.methods import render_netlist
+from utils.outputs import add_saves
+from utils.rawfile import RawPlot, BINARY_MARKERS, parse_header, plot_dtypes, point_dtype, simplified_name
+from utils.sweep import DEFAULT_SIMULATOR_KWARGS
+
+
+
+SPICE_COMMAND = 'ngspice'
+
+# A streamed chunk: (time, {node: values})
+Chunk = Tuple[np.ndarray, Dict[str, np.ndarray]]
+
+
+class WindowBuffer:
+    """
+    Collect streamed transient samples and release them in fixed time windows.
+
+    Samples are held only until their window is complete, so memory is
+    bounded by the number of points in one window (plus one read block).
+
+    Args:
+        window (float):
+            Window length in seconds.
+        start (float):
+            Start time of the first window.
+    """
+
+    def __init__(
+        self,
+        window:float,
+        start:float=0.0,
+    ):
+        if window <= 0:
+            raise ValueError('window must be positive')
+        self.window = window
+        self.boundary = start + window
+        self._time = []
+        self._values = {}
+
+    def append(
+        self,
+        time_block:np.ndarray,
+        values:Dict[str, np.ndarray],
+    ):
+        """ Add a block of samples (in time order). """
+        if not len(time_block):
+            return
+        self._time.append(time_block)
+        for name, block in values.items():
+            self._values.setdefault(name, []).append(block)
+
+    def _concatenate(self) -> Chunk:
+        time_all = np.concatenate(self._time)
+        values = {name: np.concatenate(blocks) for name, blocks in self._values.items()}
+        return time_all, values
+
+    def ready(self) -> Iterator[Chunk]:
+        """ Yield every completed window. """
+        if not self._time or self._time[-1][-1] < self.boundary:
+            return
+        time_all, values = self._concatenate()
+
+        while len(time_all) and time_all[-1] >= self.boundary:
+            i = int(np.searchsorted(time_all, self.boundary, side='left'))
+            if i > 0:
+                yield time_all[:i], {name: v[:i] for name, v in values.items()}
+                time_all = time_all[i:]
+                values = {name: v[i:] for name, v in values.items()}
+            self.boundary += self.window
+
+        self._time = [time_all]
+        self._values = {name: [v] for name, v in values.items()}
+
+    def flush(self) -> Iterator[Chunk]:
+        """ Yield whatever remains, as a final (partial) window. """
+        if self._time and sum(len(t) for t in self._time):
+            yield self._concatenate()
+        self._time = []
+        self._values = {}
+
+
+def iter_raw_chunks(
+    plot:RawPlot,
+    window:float,
+    names:Optional[Sequence[str]]=None,
+) -> Iterator[Chunk]:
+    """
+    Iterate over a (memory-mapped) transient raw file plot in time windows.
+
+    Only one window is copied out of the file at a time.
+
+    Args:
+        plot (RawPlot):
+            A transient plot, e.g. `read_raw(path).plots[0]`.
+        window (float):
+            Window length in seconds.
+        names (Sequence[str]):
+            Vectors to include, or None for all.
+
+    Yields:
+        tuple: (time_chunk, {node: chunk})
+    """
+    time_all = plot[0]
+    if plot.is_ltspice:
+        time_all = np.abs(time_all)
+    names = list(names) if names is not None else plot.names[1:]
+    if not len(time_all):
+        return
+
+    start = float(time_all[0])
+    stop = float(time_all[-1])
+    n_windows = int(np.floor((stop - start) / window)) + 1
+    boundaries = np.searchsorted(time_all, start + window * np.arange(1, n_windows + 1), side='left')
+
+    i = 0
+    for j in boundaries:
+        j = int(j)
+        if j == i:
+            continue
+        yield np.array(time_all[i:j]), {simplified_name(name): np.array(plot[name][i:j]) for name in names}
+        i = j
+    if i < len(time_all):
+        yield np.array(time_all[i:]), {simplified_name(name): np.array(plot[name][i:]) for name in names}
+
+
+def follow_raw_file(
+    path:str,
+    process:subprocess.Popen,
+    block_points:int=4096,
+    poll_interval:float=0.05,
+) -> Iterator[Chunk]:
+    """
+    Read a binary raw file while ngspice is still writing it.
+
+    Complete points are read in blocks of up to `block_points` as they
+    appear on disk, until the writing process exits.
+
+    Args:
+        path (str):
+            Raw file being written (e.g. by `ngspice -b -r path`).
+        process (subprocess.Popen):
+            The ngspice process.
+        block_points (int):
+            Maximum number of points read at a time.
+        poll_interval (float):
+            Seconds to wait for new data.
+
+    Yields:
+        tuple: (time_block, {node: block})
+    """
+    marker = BINARY_MARKERS['ascii']
+
+    # Wait for the header to be written
+    while True:
+        finished = process.poll() is not None
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                head = f.read(1 << 16)
+            location = head.find(marker)
+            if location >= 0:
+                break
+        if finished:
+            raise NameError('ngspice exited before writing the raw file header')
+        time.sleep(poll_interval)
+
+    header, variables = parse_header(head[:location].decode('ascii'))
+    flags = set(header.get('Flags', '').lower().split())
+    record = point_dtype(plot_dtypes(flags, len(variables)))
+    names = [name for name, _ in variables]
+
+    with open(path, 'rb') as f:
+        f.seek(location + len(marker))
+        pending = b''
+        while True:
+            finished = process.poll() is not None
+            data = f.read(block_points * record.itemsize)
+            if data:
+                pending += data
+                n = len(pending) // record.itemsize
+                if n:
+                    records = np.frombuffer(pending[:n * record.itemsize], dtype=record)
+                    pending = pending[n * record.itemsize:]
+                    yield (np.real(records['f0']).copy(),
+                           {simplified_name(name): records[f'f{i}'].copy() for i, name in enumerate(names) if i})
+            elif finished:
+                break
+            else:
+                time.sleep(poll_interval)
+
+
+class StreamingNgSpice(NgSpiceShared):
+    """
+    ngspice shared library session which forwards each new transient point,
+    via the send_data callback, to a bounded queue.
+
+    When the queue is full the simulator thread waits for the consumer,
+    so memory stays bounded however long the simulation is.
+
+    The end of a background run is tracked with the `finished` event, set
+    from ngspice's background thread callback, rather than PySpice's
+    `is_running` (which is only set after bg_run has returned, and holds
+    ngspice's inverted "exited" flag).
+
+    As ngspice is a process wide library, sessions should be obtained with
+    `new_instance`, which keeps one per ngspice id, rather than created directly.
+
+    Args:
+        ngspice_id (int):
+            ngspice instance id.
+        max_points (int):
+            Queue length, in points.
+        put_timeout (float):
+            Seconds the simulator thread waits on a full queue before
+            checking whether the run is being stopped.
+    """
+
+    def __init__(
+        self,
+        ngspice_id:int=0,
+        max_points:int=65536,
+        put_timeout:float=0.05,
+    ):
+        self.max_points = max_points
+        self.points = queue.Queue(maxsize=max_points)
+        self.put_timeout = put_timeout
+        self.finished = threading.Event()
+        self.stopping = threading.Event()
+        super().__init__(ngspice_id=ngspice_id, send_data=True)
+
+    # Streaming sessions, by ngspice id (apart from NgSpiceShared's, which do not send data)
+    _streaming_instances = {}
+
+    @classmethod
+    def new_instance(cls, ngspice_id:int=0) -> 'StreamingNgSpice':
+        """
+        Get the streaming session of an ngspice id, created (and ngspice
+        initialised) only on first use.
+        """
+        if ngspice_id not in cls._streaming_instances:
+            cls._streaming_instances[ngspice_id] = cls(ngspice_id=ngspice_id)
+        return cls._streaming_instances[ngspice_id]
+
+    @staticmethod
+    def _background_thread_running(is_running, ngspice_id, user_data):
+        NgSpiceShared._background_thread_running(is_running, ngspice_id, user_data)
+        # ngspice passes True once the background thread has exited
+        if is_running:
+            ffi.from_handle(user_data).finished.set()
+        return 0
+
+    def run(self, background=False):
+        # A reused session starts each run with an empty queue
+        self.points = queue.Queue(maxsize=self.max_points)
+        self.finished.clear()
+        self.stopping.clear()
+        super().run(background)
+
+    def send_data(self, actual_vector_values, number_of_vectors, ngspice_id):
+        while not self.stopping.is_set():
+            try:
+                self.points.put(actual_vector_values, timeout=self.put_timeout)
+                return 0
+            except queue.Full:
+                continue
+        return 1
+
+    def stop(self):
+        """
+        Stop a background run early.
+
+        The queue is drained before halting, so that the simulator thread
+        is never left blocked in send_data while bg_halt waits for it.
+        """
+        self.stopping.set()
+        while True:
+            try:
+                self.points.get_nowait()
+            except queue.Empty:
+                break
+        if not self.finished.is_set():
+            self.halt()
+
+    def iter_blocks(
+        self,
+        block_points:int=4096,
+        poll_interval:float=0.05,
+    ) -> Iterator[Chunk]:
+        """
+        Yield the queued points in blocks, until the background run ends.
+        """
+        block = []
+        while True:
+            try:
+                block.append(self.points.get(timeout=poll_interval))
+            except queue.Empty:
+                if self.finished.is_set():
+                    break
+                continue
+            if len(block) >= block_points:
+                yield points_to_block(block)
+                block = []
+        if block:
+            yield points_to_block(block)
+
+
+def points_to_block(points:List[Dict[str, complex]]) -> Chunk:
+    """
+    Convert a list of send_data points ({vector: value}) to arrays.
+    """
+    names = [name for name in points[0].keys() if name != 'time']
+    time_block = np.fromiter((p['time'].real for p in points), dtype=np.float64, count=len(points))
+    values = {
+        simplified_name(name): np.fromiter((p[name].real for p in points), dtype=np.float64, count=len(points))
+        for name in names
+    }
+    return time_block, values
+
+
+def stream_transient(
+    circuit:Circuit,
+    step_time:float,
+    end_time:float,
+    window:float,
+    vectors:Optional[Sequence[str]]=None,
+    source:str='raw',
+    simulator_kwargs:Optional[Dict[str, Any]]=None,
+    spice_command:str=SPICE_COMMAND,
+    block_points:int=4096,
+    ngspice_id:int=0,
+) -> Iterator[Chunk]:
+    """
+    Run a transient analysis and stream its results in fixed time windows.
+
+    Post-processing can start on the first windows while the simulation is
+    still running, and peak memory is bounded by the window size, rather
+    than by the length of the whole simulation.
+
+    Example:
+        for t, chunk in stream_transient(circuit, 1e-6, 10, window=0.1, vectors=['n3']):
+            peak = max(peak, chunk['n3'].max())
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit object.
+        step_time (float):
+            Transient step time.
+        end_time (float):
+            Transient end time.
+        window (float):
+            Window length in seconds.
+        vectors (Sequence[str]):
+            Nodes to stream, or None for all.
+        source (str):
+            'raw' to follow the raw file written by an `ngspice -b -r` subprocess,
+            or 'shared' to use the ngspice shared library data callbacks.
+        simulator_kwargs (dict):
+            Keyword arguments as passed to `circuit.simulator()`.
+        spice_command (str):
+            ngspice executable (for source='raw').
+        block_points (int):
+            Maximum number of points read at a time.
+        ngspice_id (int):
+            Streaming session to use (for source='shared'), see `StreamingNgSpice.new_instance`.
+
+    Yields:
+        tuple: (time_chunk, {node: chunk})
+    """
+    analysis_kwargs = dict(step_time=step_time, end_time=end_time)
+    simulator_kwargs = simulator_kwargs or DEFAULT_SIMULATOR_KWARGS
+    buffer = WindowBuffer(window)
+
+    if source == 'raw':
+        deck = render_netlist(circuit, 'transient', analysis_kwargs, simulator_kwargs, pipe=True)
+        deck = add_saves(deck, vectors)
+        with tempfile.TemporaryDirectory() as workdir:
+            with open(os.path.join(workdir, 'stream.cir'), 'w') as f:
+                f.write(deck)
+            process = subprocess.Popen(
+                (spice_command, '-b', '-r', 'stream.raw', 'stream.cir'),
+                cwd=workdir,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                for time_block, values in follow_raw_file(os.path.join(workdir, 'stream.raw'), process, block_points):
+                    buffer.append(time_block, values)
+                    yield from buffer.ready()
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                process.wait()
+
+    elif source == 'shared':
+        deck = render_netlist(circuit, 'transient', analysis_kwargs, simulator_kwargs)
+        deck = add_saves(deck, vectors)
+        ngspice = StreamingNgSpice.new_instance(ngspice_id)
+        ngspice.load_circuit(deck)
+        ngspice.run(background=True)
+        try:
+            for time_block, values in ngspice.iter_blocks(block_points):
+                buffer.append(time_block, values)
+                yield from buffer.ready()
+        finally:
+            ngspice.stop()
+            ngspice.destroy()
+            ngspice.remove_circuit()
+
+    else:
+        raise ValueError("source must be 'raw' or 'shared'")
+
+    yield from buffer.flush()
@@ -0,0 +1,343 @@
+import numpy as np
+import functools
+import itertools
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from multiprocessing import Pool
+from typing import List, Dict, Optional, Any, Callable, Iterator, Sequence
+
+from PySpice.Spice.Netlist import Circuit
+
+from utils.outputs import save_vectors
+from utils.profiling import Profiler, ProfiledSimulator, aggregate_records
+from utils.result import SimulationResult
+from utils.shm import SharedResultBuffer, SharedLayout, max_result_columns
+
+
+
+ANALYSES = ('operating_point', 'dc', 'ac', 'transient')
+
+# Simulator settings used throughout the tutorials
+DEFAULT_SIMULATOR_KWARGS = {'temperature': 25, 'nominal_temperature': 25}
+
+
+def parameter_grid(
+    parameters:Dict[str, Sequence],
+    mode:str='product',
+) -> List[Dict[str, Any]]:
+    """
+    Expand a dictionary of parameter values into a list of sweep points.
+
+    Args:
+        parameters (dict):
+            Parameter name to sequence of values.
+        mode (str):
+            'product' for the Cartesian product of all values,
+            or 'zip' to pair the i-th value of every parameter.
+
+    Returns:
+        list: one {name: value} dictionary per sweep point
+    """
+    names = list(parameters.keys())
+    values = [list(np.asarray(v).tolist()) if isinstance(v, np.ndarray) else list(v)
+              for v in parameters.values()]
+
+    if mode == 'product':
+        combos = itertools.product(*values)
+    elif mode == 'zip':
+        lengths = {len(v) for v in values}
+        if len(lengths) > 1:
+            raise ValueError(f'Zipped parameters must have equal lengths, got {sorted(lengths)}')
+        combos = zip(*values)
+    else:
+        raise ValueError("mode must be 'product' or 'zip'")
+
+    return [dict(zip(names, combo)) for combo in combos]
+
+
+@dataclass
+class SweepPoint:
+    """
+    The outcome of simulating one point of a sweep.
+
+    Args:
+        index (int):
+            Position of the point in the sweep.
+        parameters (dict):
+            Parameter values passed to the circuit factory.
+        result (SimulationResult):
+            The simulation results.
+        elapsed (float):
+            Wall time, in seconds, to build, simulate and extract the point.
+        pid (int):
+            Process id of the worker that ran the point.
+        stages (list):
+            Per stage timing records, if the sweep was profiled
+            (see `utils.profiling`).
+    """
+    index: int
+    parameters: Dict[str, Any]
+    result: SimulationResult
+    elapsed: float
+    pid: int = field(default_factory=os.getpid)
+    stages: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def simulate_point(
+    factory:Callable[..., Circuit],
+    parameters:Dict[str, Any],
+    analysis:str='transient',
+    analysis_kwargs:Optional[Dict[str, Any]]=None,
+    simulator_kwargs:Optional[Dict[str, Any]]=None,
+    profiler:Optional[Profiler]=None,
+    vectors:Optional[Sequence[str]]=None,
+) -> SimulationResult:
+    """
+    Build a circuit from a factory, run an analysis and extract the results.
+
+    Args:
+        factory (Callable):
+            Function called as `factory(**parameters)` returning a PySpice Circuit.
+        parameters (dict):
+            Parameter values of this point.
+        analysis (str):
+            Analysis method of the simulator, e.g. 'transient'.
+        analysis_kwargs (dict):
+            Keyword arguments of the analysis method.
+        simulator_kwargs (dict):
+            Keyword arguments of `circuit.simulator()`.
+        profiler (Profiler):
+            If given, the time of each stage is recorded to it.
+        vectors (Sequence[str]):
+            Nodes/vectors to save and return (e.g. ['n3']), or None for all.
+
+    Returns:
+        SimulationResult: columnar analysis results
+    """
+    if analysis not in ANALYSES:
+        raise ValueError(f'Unknown analysis {analysis}, must be one of {ANALYSES}')
+
+    if profiler is not None:
+        with profiler.stage('build'):
+            circuit = factory(**parameters)
+        simulator = ProfiledSimulator(circuit, profiler, **(simulator_kwargs or DEFAULT_SIMULATOR_KWARGS))
+        save_vectors(simulator.simulator, vectors)
+        extract = functools.partial(SimulationResult.from_analysis, vectors=vectors)
+        return simulator.run(analysis, extract, **(analysis_kwargs or {}))
+
+    circuit = factory(**parameters)
+    simulator = save_vectors(circuit.simulator(**(simulator_kwargs or DEFAULT_SIMULATOR_KWARGS)), vectors)
+    res = getattr(simulator, analysis)(**(analysis_kwargs or {}))
+    return SimulationResult.from_analysis(res, vectors=vectors)
+
+
+# Sweep definition (and shared result block, if any) held by each pool worker, set once by the initializer
+_worker_sweep = None
+_worker_buffer = None
+
+
+def _init_worker(sweep:'ParameterSweep', buffer:Optional[SharedResultBuffer]=None):
+    global _worker_sweep, _worker_buffer
+    _worker_sweep = sweep
+    _worker_buffer = buffer
+
+
+def _run_worker_point(index:int) -> SweepPoint:
+    point = _worker_sweep.run_point(index)
+    if _worker_buffer is not None:
+        # Only the layout goes back through the pipe, unless the result does not fit
+        layout = _worker_buffer.write(index, point.result)
+        if layout is not None:
+            point.result = layout
+    return point
+
+
+class ParameterSweep:
+    """
+    Run a circuit over a grid of parameter values, spread over a process pool.
+
+    PySpice simulators cannot be pickled, so (as in tutorial 7) each worker
+    builds its own circuit. The factory must therefore be a module level
+    function, called as `factory(**point)` for every point of the grid.
+
+    Example:
+        sweep = ParameterSweep(build_circuit, {'r': np.arange(500, 100000, 500)},
+                               analysis='transient',
+                               analysis_kwargs=dict(step_time=0.0001, end_time=0.1))
+        points = sweep.run()
+
+    Args:
+        factory (Callable):
+            Module level function returning a PySpice Circuit.
+        parameters (dict):
+            Parameter name to sequence of values.
+        analysis (str):
+            Analysis method of the simulator, e.g. 'transient'.
+        analysis_kwargs (dict):
+            Keyword arguments of the analysis method.
+        mode (str):
+            'product' (Cartesian) or 'zip' combination of the parameters.
+        simulator_kwargs (dict):
+            Keyword arguments of `circuit.simulator()`.
+        processes (int):
+            Number of worker processes, defaults to the number of CPUs.
+            If 1, points are run serially in this process.
+        chunksize (int):
+            Number of points sent to a worker at a time.
+            Defaults to splitting the sweep into ~4 chunks per worker.
+        profile (bool):
+            Record the time of each stage of every point, see `sweep_stage_summary`.
+        vectors (Sequence[str]):
+            Nodes/vectors to save and return, e.g. ['n3'], or None for all.
+            Only these are transferred from ngspice and pickled back.
+        shared_samples (int):
+            If given, pool workers write their results into one shared
+            memory block with room for this many samples per vector (see
+            `utils.shm`), and only send back its layout. The results are
+            then views of the block. Longer results are pickled as usual.
+    """
+
+    def __init__(
+        self,
+        factory:Callable[..., Circuit],
+        parameters:Dict[str, Sequence],
+        analysis:str='transient',
+        analysis_kwargs:Optional[Dict[str, Any]]=None,
+        mode:str='product',
+        simulator_kwargs:Optional[Dict[str, Any]]=None,
+        processes:Optional[int]=None,
+        chunksize:Optional[int]=None,
+        profile:bool=False,
+        vectors:Optional[Sequence[str]]=None,
+        shared_samples:Optional[int]=None,
+    ):
+        if analysis not in ANALYSES:
+            raise ValueError(f'Unknown analysis {analysis}, must be one of {ANALYSES}')
+
+        self.factory = factory
+        self.points = parameter_grid(parameters, mode=mode)
+        self.analysis = analysis
+        self.analysis_kwargs = dict(analysis_kwargs or {})
+        self.simulator_kwargs = dict(simulator_kwargs or DEFAULT_SIMULATOR_KWARGS)
+        self.processes = processes or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.profile = profile
+        self.vectors = list(vectors) if vectors else None
+        self.shared_samples = shared_samples
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def _chunksize(self) -> int:
+        if self.chunksize is not None:
+            return self.chunksize
+        return max(1, math.ceil(len(self.points) / (self.processes * 4)))
+
+    def run_point(self, index:int) -> SweepPoint:
+        """
+        Simulate a single point of the sweep in this process.
+
+        Args:
+            index (int):
+                Position of the point in the sweep.
+
+        Returns:
+            SweepPoint: the point result and its timing
+        """
+        profiler = Profiler(label=str(index)) if self.profile else None
+        tic = time.perf_counter()
+        result = simulate_point(
+            self.factory,
+            self.points[index],
+            analysis=self.analysis,
+            analysis_kwargs=self.analysis_kwargs,
+            simulator_kwargs=self.simulator_kwargs,
+            profiler=profiler,
+            vectors=self.vectors,
+        )
+        toc = time.perf_counter()
+        stages = profiler.to_records() if profiler is not None else []
+        return SweepPoint(index, self.points[index], result, toc-tic, stages=stages)
+
+    def shared_buffer(self) -> SharedResultBuffer:
+        """ Shared memory block for the results of every point, see `shared_samples`. """
+        if self.vectors:
+            n_columns = len(self.vectors) + 1
+        else:
+            n_columns = max_result_columns(self.factory(**self.points[0]))
+        dtype = np.complex128 if self.analysis == 'ac' else np.float64
+        return SharedResultBuffer(len(self.points), n_columns, self.shared_samples, dtype)
+
+    def imap(self) -> Iterator[SweepPoint]:
+        """
+        Lazily yield the sweep points, in order, as they complete.
+        """
+        indices = range(len(self.points))
+
+        if self.processes == 1:
+            for index in indices:
+                yield self.run_point(index)
+            return
+
+        buffer = self.shared_buffer() if self.shared_samples else None
+        try:
+            with Pool(self.processes, initializer=_init_worker, initargs=(self, buffer)) as p:
+                for point in p.imap(_run_worker_point, indices, chunksize=self._chunksize()):
+                    if isinstance(point.result, SharedLayout):
+                        point.result = buffer.read(point.index, point.result)
+                    yield point
+        finally:
+            # The views read so far stay valid, the block is freed once they are gone
+            if buffer is not None:
+                buffer.unlink()
+
+    def run(self) -> List[SweepPoint]:
+        """
+        Simulate every point of the sweep.
+
+        Returns:
+            list: SweepPoint results, in the order of the parameter grid
+        """
+        return list(self.imap())
+
+
+def sweep_timings(points:List[SweepPoint]) -> Dict[str, float]:
+    """
+    Summarise the per-point timings of a completed sweep.
+
+    Args:
+        points (list):
+            SweepPoint results.
+
+    Returns:
+        dict: total, mean, min and max per-point time (s), and the number of workers used
+    """
+    elapsed = np.array([p.elapsed for p in points])
+    return {
+        'total': float(elapsed.sum()),
+        'mean': float(elapsed.mean()),
+        'min': float(elapsed.min()),
+        'max': float(elapsed.max()),
+        'workers': len({p.pid for p in points}),
+    }
+
+
+def sweep_stage_summary(
+    points:List[SweepPoint],
+    by:Sequence[str]=('stage',),
+) -> Dict[Any, Dict[str, float]]:
+    """
+    Aggregate the per stage timings of a profiled sweep, over every worker.
+
+    Args:
+        points (list):
+            SweepPoint results of a sweep run with `profile=True`.
+        by (Sequence[str]):
+            Record keys to group by, e.g. ('stage',) or ('pid', 'stage').
+
+    Returns:
+        dict: see `utils.profiling.aggregate_records`
+    """
+    return aggregate_records([record for p in points for record in p.stages], by)
@@ -0,0 +1,188 @@
+import re
+from typing import Dict, Optional, Any, Sequence, Tuple
+
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Spice.NgSpice.Shared import NgSpiceShared
+from PySpice.Tools.StringTools import str_spice
+
+from utils.methods import render_netlist
+from utils.result import SimulationResult
+from utils.sweep import DEFAULT_SIMULATOR_KWARGS
+
+
+
+# Placeholder written into the netlist while it is rendered
+SLOT_MARKER = '__slot_{}__'
+SLOT_PATTERN = re.compile(r'__slot_(\d+)__')
+
+
+def resolve_slot(
+    circuit:Circuit,
+    key:str,
+) -> Tuple[str, Any, str]:
+    """
+    Find the object and attribute a slot refers to.
+
+    Keys follow `utils.pool.alter_commands`: an element name sets its
+    primary value (e.g. 'R1' -> resistance), 'Element.attribute' an element
+    attribute (e.g. 'Vx.amplitude') and 'Model.PARAM' a model parameter
+    (e.g. 'MyDiode.IS').
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit object.
+        key (str):
+            Slot key.
+
+    Returns:
+        tuple: (kind, object, attribute), kind is 'element' or 'model'
+    """
+    name, _, attribute = key.partition('.')
+
+    if name in circuit.model_names:
+        if not attribute:
+            raise ValueError(f'Slot {key!r} must name a model parameter, e.g. {name}.IS')
+        model = circuit._models[name]
+        for parameter in model._parameters:
+            if parameter.lower() == attribute.lower():
+                return 'model', model, parameter
+        raise KeyError(f'Model {name} has no parameter {attribute}')
+
+    element = circuit[name]
+    if not attribute:
+        positional = list(type(element)._positional_parameters)
+        if not positional:
+            raise ValueError(f'Element {name} has no primary value, name the attribute, e.g. {name}.amplitude')
+        attribute = positional[0]
+    if not hasattr(element, attribute):
+        raise KeyError(f'Element {name} has no attribute {attribute}')
+    return 'element', element, attribute
+
+
+class NetlistTemplate:
+    """
+    A circuit rendered once to a netlist, with parameter slots.
+
+    The circuit is rendered (with its analysis) a single time, with a
+    placeholder in each slot. Each point is then a single string format
+    call, instead of building a new Circuit and rendering it again.
+
+    Example:
+        template = NetlistTemplate(build_circuit(500), ['R1'], 'transient',
+                                   dict(step_time=0.0001, end_time=0.1))
+        netlist = template.render(R1=1e3)
+        res = template.run(R1=1e3)
+
+    Args:
+        circuit (Circuit):
+            PySpice Circuit, with the nominal parameter values
+            (used for any slot not given a value).
+        slots (Sequence[str]):
+            Slot keys, see `resolve_slot`.
+        analysis (str):
+            Analysis method name, e.g. 'transient', or None for no analysis line.
+        analysis_kwargs (dict):
+            Keyword arguments of the analysis.
+        simulator_kwargs (dict):
+            Keyword arguments as passed to `circuit.simulator()`.
+    """
+
+    def __init__(
+        self,
+        circuit:Circuit,
+        slots:Sequence[str],
+        analysis:Optional[str]='transient',
+        analysis_kwargs:Optional[Dict[str, Any]]=None,
+        simulator_kwargs:Optional[Dict[str, Any]]=None,
+    ):
+        self.slots = list(slots)
+        self.defaults = {}
+
+        # Put a marker in each slot, render, then restore the circuit
+        targets = [resolve_slot(circuit, key) for key in self.slots]
+        originals = []
+        try:
+            for i, (key, (kind, obj, attribute)) in enumerate(zip(self.slots, targets)):
+                if kind == 'model':
+                    originals.append(obj._parameters[attribute])
+                    obj._parameters[attribute] = SLOT_MARKER.format(i)
+                else:
+                    originals.append(getattr(obj, attribute))
+                    setattr(obj, attribute, SLOT_MARKER.format(i))
+                self.defaults[key] = str_spice(originals[-1])
+            netlist = render_netlist(
+                circuit,
+                analysis,
+                analysis_kwargs,
+                simulator_kwargs or DEFAULT_SIMULATOR_KWARGS,
+            )
+        finally:
+            for (kind, obj, attribute), value in zip(targets, originals):
+                if kind == 'model':
+                    obj._parameters[attribute] = value
+                else:
+                    setattr(obj, attribute, value)
+
+        self.template = self.compile(netlist)
+
+    def compile(self, netlist:str) -> str:
+        """
+        Convert a rendered netlist with slot markers into a `%` format string.
+        """
+        found = {int(i) for i in SLOT_PATTERN.findall(netlist)}
+        missing = [self.slots[i] for i in range(len(self.slots)) if i not in found]
+        if missing:
+            raise ValueError(f'Slots {missing} do not appear in the rendered netlist')
+
+        template = netlist.replace('%', '%%')
+        return SLOT_PATTERN.sub(lambda match: f'%({self.slots[int(match.group(1))]})s', template)
+
+    def render(self, **values) -> str:
+        """
+        Fill the slots, any slot not given keeps its nominal value.
+
+        Args:
+            **values:
+                Slot key to value (a number, PySpice unit value or string).
+
+        Returns:
+            str: the netlist
+        """
+        unknown = set(values) - set(self.defaults)
+        if unknown:
+            raise KeyError(f'Unknown slots {sorted(unknown)}')
+        mapping = dict(self.defaults)
+        mapping.update((key, str_spice(value)) for key, value in values.items())
+        return self.template % mapping
+
+    def run(
+        self,
+        ngspice:Optional[NgSpiceShared]=None,
+        **values,
+    ) -> SimulationResult:
+        """
+        Render the netlist for a point and simulate it in an ngspice
+        shared library session.
+
+        Args:
+            ngspice (NgSpiceShared):
+                Session to use, defaults to `NgSpiceShared.new_instance()`.
+            **values:
+                Slot key to value.
+
+        Returns:
+            SimulationResult: columnar analysis results
+        """
+        ngspice = ngspice or NgSpiceShared.new_instance()
+        ngspice.load_circuit(self.render(**values))
+        ngspice.run()
+
+        plot_name = ngspice.last_plot
+        if plot_name == 'const':
+            raise NameError('Simulation failed')
+        result = SimulationResult.from_analysis(ngspice.plot(None, plot_name).to_analysis())
+        ngspice.destroy(plot_name)
+        return result
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(slots={self.slots})'
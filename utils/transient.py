@@ -0,0 +1,338 @@
+import numpy as np
+from typing import List, Dict, Optional, Any, Callable, Sequence, Tuple
+
+import scipy.sparse
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Spice.HighLevelElement import SinusoidalMixin
+
+from utils.mna import spice_value, source_values
+from utils.newton import NewtonSystem, DIODE_DEFAULTS
+from utils.sparse import SparseSystem
+from utils.sweep import parameter_grid
+
+
+
+INTEGRATION_METHODS = ('trapezoidal', 'euler')
+
+STEP_CONTROLS = ('fixed', 'adaptive')
+
+# ngspice's transient error overestimation factor
+TRTOL = 7.0
+
+# Times a step whose Newton iterations fail may be halved (fixed) or cut by 8 (adaptive)
+MAX_STEP_CUTS = 10
+
+
+def source_waveform(element) -> Dict[str, float]:
+    """
+    Transient waveform of an independent source, as the parameters of an
+    ngspice SIN function: VO + VA * exp(-THETA * (t - TD)) * sin(2*pi*FREQ * (t - TD)),
+    VO before TD. A DC source is a sine of zero amplitude.
+    """
+    if isinstance(element, SinusoidalMixin):
+        return {
+            'offset': spice_value(element.offset),
+            'amplitude': spice_value(element.amplitude),
+            'frequency': spice_value(element.frequency),
+            'delay': spice_value(element.delay),
+            'damping': spice_value(element.damping_factor),
+        }
+    if hasattr(element, 'dc_offset') or (isinstance(element.dc_value, str) and '(' in element.dc_value):
+        raise ValueError(f'Source {element.name} ({type(element).__name__}) is not supported, '
+                         'only DC and sinusoidal sources are')
+    dc, _ = source_values(element)
+    return {'offset': dc, 'amplitude': 0.0, 'frequency': 0.0, 'delay': 0.0, 'damping': 0.0}
+
+
+def sinusoid(t:float, waveform:Dict[str, np.ndarray]) -> np.ndarray:
+    """ Value at time t of (batched) `source_waveform` parameters. """
+    tt = t - waveform['delay']
+    ac = waveform['amplitude'] * np.exp(-np.maximum(tt, 0) * waveform['damping']) * np.sin(2 * np.pi * waveform['frequency'] * tt)
+    return waveform['offset'] + np.where(tt >= 0, ac, 0.0)
+
+
+class TransientBatch:
+    """
+    Transient analysis of many variants of one small circuit at once,
+    integrated in process (no ngspice), with the variants as a batch dimension.
+
+    Every variant is built by a factory, as for `ParameterSweep`, and must
+    have the same topology; its element values, diode model parameters and
+    source waveforms may differ. The variants share the time steps: at each
+    step the capacitors and inductors are replaced by their trapezoidal (or
+    backward Euler) companion models, and the resulting nonlinear systems
+    of all the variants are solved together by `NewtonSystem.newton`.
+
+    Supported elements are R, C, L, diodes, and DC or sinusoidal V and I sources.
+
+    The variants' matrices are dense (n_variants, n, n) stacks, fast for
+    small circuits. Large circuits should use `sparse=True`: the matrices
+    are then kept as stamp values and every step is solved by a
+    `SparseSystem`, reusing its pattern and column ordering.
+
+    Example:
+        batch = TransientBatch(build_circuit, {'r': np.arange(500, 100000, 500)})
+        res = batch.run(step_time=0.0001, end_time=0.1)
+        res['n3'].shape  # (n_variants, n_time), on the shared res['time']
+
+    Args:
+        factory (Callable):
+            Function called as `factory(**point)`, returning a PySpice Circuit.
+        parameters (dict):
+            Parameter name to sequence of values.
+        mode (str):
+            'product' (Cartesian) or 'zip' combination of the parameters.
+        method (str):
+            'trapezoidal' or 'euler' (backward Euler) integration.
+        temperature (float):
+            Circuit temperature, in Celsius.
+        options (dict):
+            Overrides of `utils.newton.DEFAULT_OPTIONS`.
+        sparse (bool):
+            Solve with sparse matrices, see `utils.sparse.SparseSystem`.
+    """
+
+    def __init__(
+        self,
+        factory:Callable[..., Circuit],
+        parameters:Dict[str, Sequence],
+        mode:str='product',
+        method:str='trapezoidal',
+        temperature:float=25.0,
+        options:Optional[Dict[str, Any]]=None,
+        sparse:bool=False,
+    ):
+        if method not in INTEGRATION_METHODS:
+            raise ValueError(f'Unknown method {method}, must be one of {INTEGRATION_METHODS}')
+        self.method = method
+        self.sparse = sparse
+        self.points = parameter_grid(parameters, mode=mode)
+
+        circuits = [factory(**point) for point in self.points]
+        system_type = SparseSystem if sparse else NewtonSystem
+        systems = [system_type(circuit, temperature, options) for circuit in circuits]
+        self.system = systems[0]
+        for point, system in zip(self.points[1:], systems[1:]):
+            if (system.nodes != self.system.nodes or system.branches != self.system.branches
+                    or list(system.sources) != list(self.system.sources)
+                    or [d['name'] for d in system.diodes] != [d['name'] for d in self.system.diodes]):
+                raise ValueError(f'Every variant must have the same topology, {point} differs from {self.points[0]}')
+            stamps = system.g_stamps[:2] + system.c_stamps[:2]
+            if sparse and not all(np.array_equal(a, b) for a, b in zip(stamps, self.system.g_stamps[:2] + self.system.c_stamps[:2])):
+                raise ValueError(f'Every variant must stamp the same matrix entries, {point} differs from {self.points[0]}')
+        self.options = self.system.options
+
+        if sparse:
+            # Linear elements of each variant as stamp values, (n_variants, n_stamps)
+            self.G = np.stack([system.g_stamps[2] for system in systems])
+            self.C = np.stack([system.c_stamps[2] for system in systems])
+            # C x sums the products of the capacitive stamps into their rows
+            rows, self.charge_columns, _ = self.system.c_stamps
+            self.charge_rows = scipy.sparse.csr_array(
+                (np.ones(len(rows)), (rows, np.arange(len(rows)))), shape=(self.system.size, len(rows)),
+            )
+        else:
+            # Linear elements of each variant, (n_variants, n, n)
+            self.G = np.stack([system.G.toarray() for system in systems])
+            self.C = np.stack([system.C.toarray() for system in systems])
+
+        # Diode models of each variant, as per point parameters
+        self.diode_overrides = {
+            f'{d["model"]}.{k}': np.array([system.diode_model(d['model'])[k] for system in systems])
+            for d in self.system.diodes for k in DIODE_DEFAULTS
+        }
+        self.diodes = self.system.diode_parameters(self.diode_overrides, len(self))
+
+        # Source waveforms of each variant, and where they enter the system
+        self.sources: List[Tuple[np.ndarray, Dict[str, np.ndarray]]] = []
+        for name, *_ in self.system.sources.values():
+            waveforms = [source_waveform(circuit[name]) for circuit in circuits]
+            self.sources.append((
+                self.system.source_pattern(name),
+                {k: np.array([w[k] for w in waveforms]) for k in waveforms[0]},
+            ))
+
+        self.stats: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def rhs(self, t:float) -> np.ndarray:
+        """ Right hand side of every variant at time t (n_variants, n). """
+        b = np.zeros((len(self), self.system.size))
+        for pattern, waveform in self.sources:
+            b += sinusoid(t, waveform)[:, np.newaxis] * pattern[np.newaxis, :]
+        return b
+
+    def linear(self, alpha:float) -> np.ndarray:
+        """ Linear part G + alpha*C of every variant, in the form `NewtonSystem.newton` takes. """
+        if self.sparse:
+            return np.concatenate([self.G, alpha * self.C], axis=1)
+        return self.G + alpha * self.C
+
+    def charge(self, x:np.ndarray) -> np.ndarray:
+        """ C times the solutions x of every variant (n_variants, n). """
+        if self.sparse:
+            return (self.charge_rows @ (self.C * x[:, self.charge_columns]).T).T
+        return np.einsum('pij,pj->pi', self.C, x)
+
+    def operating_point(self) -> np.ndarray:
+        """
+        Initial solution of every variant (n_variants, n): the DC operating
+        point with the sources at their time zero values.
+        """
+        return self.system.solve_points(self.rhs(0.0), self.diode_overrides, linear=self.linear(0.0))
+
+    def step(
+        self,
+        x:np.ndarray,
+        qdot:np.ndarray,
+        t:float,
+        h:float,
+    ) -> Tuple[np.ndarray, np.ndarray, bool]:
+        """
+        Advance every variant by one time step.
+
+        Args:
+            x (np.ndarray):
+                Solutions at time t - h (n_variants, n).
+            qdot (np.ndarray):
+                C times the time derivative of x at t - h (n_variants, n).
+            t (float):
+                Time reached by the step.
+            h (float):
+                Step size.
+
+        Returns:
+            tuple: solutions and C times their derivative at time t, and
+            whether every variant converged
+        """
+        trapezoidal = self.method == 'trapezoidal'
+        alpha = (2 if trapezoidal else 1) / h
+        q = self.charge(x)
+
+        b = self.rhs(t) + alpha * q + (qdot if trapezoidal else 0.0)
+        x_new, converged, _ = self.system.newton(
+            b, self.diodes, x0=x, linear=self.linear(alpha), max_iterations=self.options['itl4'],
+        )
+
+        qdot_new = alpha * (self.charge(x_new) - q) - (qdot if trapezoidal else 0.0)
+        return x_new, qdot_new, bool(converged.all())
+
+    def local_error(self, times:List[float], states:List[np.ndarray]) -> float:
+        """
+        Truncation error of the last step, relative to the tolerance (accept if <= 1),
+        from the divided differences of the last accepted node voltages.
+        """
+        order = 2 if self.method == 'trapezoidal' else 1
+        if len(times) < order + 2:
+            return 0.0
+
+        n_nodes = len(self.system.nodes)
+        t = np.array(times[-(order + 2):])
+        dd = [s[:, :n_nodes] for s in states[-(order + 2):]]
+        for k in range(1, order + 2):
+            dd = [(dd[i+1] - dd[i]) / (t[i+k] - t[i]) for i in range(len(dd) - 1)]
+        h = t[-1] - t[-2]
+
+        # LTE = h^3/12 x''' (trapezoidal) or h^2/2 x'' (Euler), and x^(k) ~ k! * divided difference
+        lte = (h ** 3 / 2 if order == 2 else h ** 2) * np.abs(dd[0])
+        x = states[-1][:, :n_nodes]
+        tolerance = TRTOL * (self.options['reltol'] * np.abs(x) + self.options['vntol'])
+        return float(np.max(lte / tolerance))
+
+    def run(
+        self,
+        step_time:float,
+        end_time:float,
+        control:str='fixed',
+        max_time:Optional[float]=None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Integrate every variant from time 0 to end_time.
+
+        With 'fixed' control the results are on the uniform step_time grid
+        (a step whose Newton iterations fail is split internally). With
+        'adaptive' control the shared step is chosen from the truncation
+        error of the worst variant, up to max_time, and every accepted
+        time point is returned, as ngspice does.
+
+        Args:
+            step_time (float):
+                Output step, or initial and maximum step with adaptive control.
+            end_time (float):
+                Final time.
+            control (str):
+                'fixed' or 'adaptive' time steps.
+            max_time (float):
+                Largest adaptive step, defaults to min(step_time, end_time / 50) as ngspice.
+
+        Returns:
+            dict: 'time' (n_time,) and one (n_variants, n_time) array per node
+        """
+        if control not in STEP_CONTROLS:
+            raise ValueError(f'Unknown control {control}, must be one of {STEP_CONTROLS}')
+        step_time, end_time = spice_value(step_time), spice_value(end_time)
+
+        x = self.operating_point()
+        qdot = np.zeros_like(x)
+        times, states = [0.0], [x]
+        self.stats = {'steps': 0, 'rejected': 0, 'newton_failures': 0}
+
+        if control == 'fixed':
+            n_steps = int(np.floor(end_time / step_time + 1e-9))
+
+            def advance(x, qdot, t0, t1, cuts=0):
+                x_new, qdot_new, ok = self.step(x, qdot, t1, t1 - t0)
+                self.stats['steps'] += 1
+                if ok:
+                    return x_new, qdot_new
+                self.stats['newton_failures'] += 1
+                if cuts == MAX_STEP_CUTS:
+                    raise NameError(f'Simulation failed, time step too small at t={t0}')
+                tm = (t0 + t1) / 2
+                return advance(*advance(x, qdot, t0, tm, cuts + 1), tm, t1, cuts + 1)
+
+            for k in range(1, n_steps + 1):
+                x, qdot = advance(x, qdot, times[-1], k * step_time)
+                times.append(k * step_time)
+                states.append(x)
+
+        else:
+            order = 2 if self.method == 'trapezoidal' else 1
+            max_step = max_time if max_time is not None else min(step_time, end_time / 50)
+            min_step = end_time * 1e-12
+            h = max_step / 100
+            cuts = 0
+            while times[-1] < end_time * (1 - 1e-12):
+                h = min(h, max_step, end_time - times[-1])
+                t = times[-1] + h
+                x_new, qdot_new, ok = self.step(states[-1], qdot, t, h)
+                if not ok:
+                    self.stats['newton_failures'] += 1
+                    cuts += 1
+                    if cuts > MAX_STEP_CUTS or h / 8 < min_step:
+                        raise NameError(f'Simulation failed, time step too small at t={times[-1]}')
+                    h /= 8
+                    continue
+                cuts = 0
+
+                error = self.local_error(times + [t], states + [x_new])
+                factor = 2.0 if error == 0 else float(np.clip(0.9 * error ** (-1 / (order + 1)), 0.25, 2.0))
+                if error > 1:
+                    self.stats['rejected'] += 1
+                    if h * factor < min_step:
+                        raise NameError(f'Simulation failed, time step too small at t={times[-1]}')
+                    h *= factor
+                    continue
+
+                self.stats['steps'] += 1
+                times.append(t)
+                states.append(x_new)
+                qdot = qdot_new
+                h *= factor
+
+        # (n_time, n_variants, n) -> (n, n_variants, n_time)
+        res = self.system.format_solution(np.transpose(np.array(states), (2, 1, 0)), cast=False)
+        res['time'] = np.array(times)
+        return res